@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+"""Benchmarks of parameter expansion, batch generation and the start-up of
+the generated runsimulation.py, over sweeps of different sizes and shapes.
+
+Every stage of every case is timed, then run again under tracemalloc (on
+Python 3) for its peak memory. Results are compared against a baseline and any
+stage slower or larger than the baseline by more than the tolerance is
+reported as a regression:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 1e3,1e5,1e7 --cases grid6d --save
+
+Baselines depend on the machine they were recorded on, so record a new one
+(--save) before comparing changes on a different machine.
+"""
+from __future__ import print_function, division
+import os
+import sys
+import gc
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from chastesweep import ParamSweeper
+from chastesweep.util.pscan import Scan, unravel_index
+from chastesweep.util.runner import BatchSweep
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5]
+# list expansion holds a dict per task, so is skipped for larger sweeps
+MAX_LIST_EXPANSION = 10 ** 6
+# tasks in the slice read from the middle of a scan
+SLICE_SIZE = 1000
+# indices unravelled in the unravel_index stage
+NUM_UNRAVEL = 10 ** 5
+
+
+def _dimension_sizes(num_combinations, num_dims):
+    # num_dims sizes whose product is close to num_combinations
+    size = max(2, int(round(num_combinations ** (1.0 / num_dims))))
+    sizes = [size] * (num_dims - 1)
+    sizes.append(max(1, int(round(num_combinations / size ** (num_dims - 1)))))
+    return sizes
+
+
+def _grid(sizes):
+    return dict(("p{}".format(d), list(range(size))) for d, size in enumerate(sizes))
+
+
+def repeat_count(params):
+    # 1 to 3 repeats, 2 on average
+    return 1 + params["p0"] % 3
+
+
+def make_case(name, num_tasks):
+    """Sweep arguments of a benchmark case with about num_tasks tasks.
+    :return: Dict of the parameters, joint_lists, default_repeats and count_funcs
+    """
+    case = {"joint_lists": [], "default_repeats": 1, "count_funcs": []}
+    if name == "grid2d":
+        case["parameters"] = _grid(_dimension_sizes(num_tasks, 2))
+    elif name == "grid6d":
+        case["parameters"] = _grid(_dimension_sizes(num_tasks, 6))
+    elif name == "joint":
+        # a joint pair of parameters alongside two varied independently
+        sizes = _dimension_sizes(num_tasks, 3)
+        parameters = _grid(sizes[:2])
+        parameters["j0"] = list(range(sizes[2]))
+        parameters["j1"] = [value * 0.5 for value in range(sizes[2])]
+        case["parameters"] = parameters
+        case["joint_lists"] = [["j0", "j1"]]
+    elif name == "counts":
+        case["parameters"] = _grid(_dimension_sizes(num_tasks // 2, 3))
+        case["count_funcs"] = [repeat_count]
+    elif name == "repeats":
+        case["parameters"] = _grid(_dimension_sizes(num_tasks // 10, 3))
+        case["default_repeats"] = 10
+    else:
+        raise ValueError("Unknown benchmark case {}".format(name))
+    return case
+
+
+CASES = ["grid2d", "grid6d", "joint", "counts", "repeats"]
+
+
+def _scan(case):
+    return Scan(case["parameters"], case["joint_lists"], case["default_repeats"], case["count_funcs"])
+
+
+def stage_scan_params(case, work_dir):
+    for _ in _scan(case).params():
+        pass
+
+
+def stage_scan_slice(case, work_dir):
+    scan = _scan(case)
+    middle = len(scan) // 2
+    for _ in scan.params(middle, middle + SLICE_SIZE):
+        pass
+
+
+def stage_unravel_index(case, work_dir):
+    scan = _scan(case)
+    comb_keys, comb_sizes, joint_sizes = scan._dimensions()
+    shape = comb_sizes + joint_sizes
+    size = scan._grid_size()
+    rng = random.Random(0)
+    for _ in range(NUM_UNRAVEL):
+        unravel_index(rng.randrange(size), shape)
+
+
+def stage_expand_parameters(case, work_dir):
+    ParamSweeper().expand_parameters(case["parameters"], case["joint_lists"], case["default_repeats"],
+                                     case["count_funcs"])
+
+
+def stage_expand_columnar(case, work_dir):
+    ParamSweeper().expand_parameters(case["parameters"], case["joint_lists"], case["default_repeats"],
+                                     case["count_funcs"], columnar=True)
+
+
+def _generate(case, output_dir, params_format=ParamSweeper.PARAMS_INDEXED):
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    sweeper = ParamSweeper()
+    sweeper.progress_interval = None
+    sweeper.generate_batch_output(output_dir, "/bin/true", case["parameters"],
+                                  joint_lists=case["joint_lists"], default_repeats=case["default_repeats"],
+                                  count_funcs=case["count_funcs"], params_format=params_format)
+
+
+def stage_generate_batch_output(case, work_dir):
+    _generate(case, os.path.join(work_dir, "generate"))
+
+
+# Runs runsimulation.py and writes its peak RSS in KB to the file argv[1] on exit. Linux carries ru_maxrss
+# over exec from the (much larger) benchmark process, so the high water mark of the runner's own memory is read
+# from /proc instead
+_RUNNER_WRAPPER = """
+import sys, atexit, runpy
+def report(path=sys.argv[1]):
+    with open("/proc/self/status") as status, open(path, "w") as peak:
+        peak.write("".join(line.split()[1] for line in status if line.startswith("VmHWM")))
+atexit.register(report)
+sys.argv = sys.argv[2:]
+runpy.run_path("runsimulation.py", run_name="__main__")
+"""
+
+
+def runner_startup(case, work_dir, params_format):
+    """Runs the generated runsimulation.py for a task in the middle of the
+    sweep, which only runs /bin/true, so its time is the runner's start-up.
+    :return: Tuple of (wall seconds, peak RSS in KB or None where there is no /proc)
+    """
+    output_dir = os.path.join(work_dir, "runner_{}".format(params_format))
+    if not os.path.exists(output_dir):
+        _generate(case, output_dir, params_format)
+    sweep = BatchSweep(output_dir)
+    num_tasks = sweep.num_tasks
+    sweep.close()
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_DIR] + [path for path in [env.get("PYTHONPATH")] if path])
+    has_proc = os.path.exists("/proc/self/status")
+    peak_path = os.path.join(work_dir, "runner_peak")
+    if has_proc:
+        argv = [sys.executable, "-c", _RUNNER_WRAPPER, peak_path, "runsimulation.py", str(num_tasks // 2 + 1)]
+    else:
+        argv = [sys.executable, "runsimulation.py", str(num_tasks // 2 + 1)]
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        exit_code = subprocess.call(argv, cwd=output_dir, env=env, stdout=devnull)
+        wall = time.time() - start
+    if exit_code != 0:
+        raise RuntimeError("runsimulation.py failed with exit code {}".format(exit_code))
+    shutil.rmtree(os.path.join(output_dir, str(num_tasks // 2 + 1)))
+
+    if not has_proc:
+        return wall, None
+    with open(peak_path) as peak_file:
+        return wall, int(peak_file.read())
+
+
+STAGES = [("scan_params", stage_scan_params),
+          ("scan_slice", stage_scan_slice),
+          ("unravel_index", stage_unravel_index),
+          ("expand_parameters", stage_expand_parameters),
+          ("expand_columnar", stage_expand_columnar),
+          ("generate_batch_output", stage_generate_batch_output)]
+# parameter file formats the runner's start-up is measured with, in a separate process so by its peak RSS
+# rather than tracemalloc
+RUNNER_FORMATS = [("json", ParamSweeper.PARAMS_JSON), ("indexed", ParamSweeper.PARAMS_INDEXED)]
+
+
+def measure(stage, case, work_dir, memory=True):
+    """Time of a stage in seconds, and its peak memory in KB (None without
+    tracemalloc)."""
+    gc.collect()
+    start = time.time()
+    stage(case, work_dir)
+    elapsed = time.time() - start
+
+    peak = None
+    if memory and tracemalloc is not None:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            stage(case, work_dir)
+            peak = tracemalloc.get_traced_memory()[1] // 1024
+        finally:
+            tracemalloc.stop()
+    return elapsed, peak
+
+
+def run_benchmarks(sizes, cases, stages, memory=True):
+    """:return: Dict of "case/size/stage": {"time": seconds, "peak_kb": KB}"""
+    results = {}
+    for size in sizes:
+        for name in cases:
+            case = make_case(name, size)
+            work_dir = tempfile.mkdtemp(prefix="chastesweep_bench_")
+            try:
+                for stage_name, stage in STAGES:
+                    if stage_name not in stages:
+                        continue
+                    if stage_name == "expand_parameters" and size > MAX_LIST_EXPANSION:
+                        continue
+                    elapsed, peak = measure(stage, case, work_dir, memory)
+                    results["{}/{}/{}".format(name, size, stage_name)] = {"time": elapsed, "peak_kb": peak}
+                    print("{:<10} {:>9} {:<22} {:>9.3f} s {:>11} KB".format(name, size, stage_name, elapsed,
+                                                                            peak if peak is not None else "-"))
+                for format_name, params_format in RUNNER_FORMATS:
+                    stage_name = "runner_startup_" + format_name
+                    if stage_name not in stages:
+                        continue
+                    elapsed, peak = runner_startup(case, work_dir, params_format)
+                    results["{}/{}/{}".format(name, size, stage_name)] = {"time": elapsed, "peak_kb": peak}
+                    print("{:<10} {:>9} {:<22} {:>9.3f} s {:>11} KB".format(name, size, stage_name, elapsed,
+                                                                            peak if peak is not None else "-"))
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance, min_time=0.05):
+    """Stages slower or using more memory than the baseline by more than the
+    tolerance. Stages faster than min_time in both are too noisy to compare.
+    :return: List of messages, empty if there are no regressions
+    """
+    regressions = []
+    for key, result in sorted(results.items()):
+        if key not in baseline:
+            continue
+        base = baseline[key]
+        if max(result["time"], base["time"]) >= min_time and result["time"] > base["time"] * (1 + tolerance):
+            regressions.append("{} took {:.3f} s, baseline {:.3f} s".format(key, result["time"], base["time"]))
+        if result["peak_kb"] is not None and base["peak_kb"] is not None and \
+                result["peak_kb"] > base["peak_kb"] * (1 + tolerance) + 64:
+            regressions.append("{} peaked at {} KB, baseline {} KB".format(key, result["peak_kb"], base["peak_kb"]))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]), description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="Comma separated numbers of tasks, e.g. 1e3,1e5,1e7")
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma separated cases of " + ", ".join(CASES))
+    parser.add_argument("--stages", default=",".join([name for name, stage in STAGES] +
+                                                     ["runner_startup_" + format_name
+                                                      for format_name, params_format in RUNNER_FORMATS]),
+                        help="Comma separated stages to run")
+    parser.add_argument("--no-memory", action="store_true", help="Only time the stages")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file to compare against")
+    parser.add_argument("--save", action="store_true", help="Save the results into the baseline file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Fraction by which a stage may exceed its baseline, default 0.5")
+    args = parser.parse_args(argv[1:])
+
+    sizes = [int(float(size)) for size in args.sizes.split(",")]
+    results = run_benchmarks(sizes, args.cases.split(","), args.stages.split(","), not args.no_memory)
+
+    baseline = {"results": {}}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.save:
+        baseline["results"].update(results)
+        baseline["python"] = platform.python_version()
+        baseline["machine"] = platform.machine()
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=1, sort_keys=True)
+        print("Saved {} results to {}".format(len(results), args.baseline))
+        return 0
+
+    if baseline.get("python", platform.python_version()) != platform.python_version():
+        print("Warning: the baseline was recorded with Python {}, this is {}"
+              .format(baseline["python"], platform.python_version()))
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for regression in regressions:
+        print("REGRESSION " + regression)
+    print("{} of {} results have a baseline, {} regression(s)"
+          .format(sum(1 for key in results if key in baseline["results"]), len(results), len(regressions)))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1 +1,14 @@
-from .parametersweep import ParamSweeper
+import sys
+
+__all__ = ["ParamSweeper"]
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        # ParamSweeper needs numpy and jinja2, which the runner of each array
+        # job doesn't, so it is only imported once it is used
+        if name == "ParamSweeper":
+            from .parametersweep import ParamSweeper
+            return ParamSweeper
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+else:
+    from .parametersweep import ParamSweeper
@@ -32,9 +32,20 @@ OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 from __future__ import print_function
 import os
 import json
-import subprocess
 from jinja2 import Environment, PackageLoader, select_autoescape
 from chastesweep.util.pscan import Scan
+from chastesweep.util.paramtable import ParamTable, expand_records, compact_records, shard_records
+from chastesweep.util.executor import SimulationLauncher, simulation_output_dir, run_serial, run_parallel
+from chastesweep.util.paramstore import write_param_store, write_params_json, json_default
+from chastesweep.util.ledger import Ledger
+from chastesweep.util.jobmap import write_job_map
+from chastesweep.util.runner import BatchSweep
+from chastesweep.util.costmodel import pack_tasks, predict_costs, record_costs
+from chastesweep.util.progress import Progress
+from chastesweep.util.adaptive import AdaptiveSweep, RANGE
+from chastesweep.util.catalogue import Catalogue, remove_catalogue
+from chastesweep.util.layout import FLAT
+from chastesweep.util.archive import RunArchive
 
 
 class ParamSweeper:
@@ -45,28 +56,61 @@ class ParamSweeper:
     SGE = 0
     SLURM = 1
 
+    # Formats of the parameter file read by the simulation runner
+    PARAMS_JSON = 0
+    PARAMS_INDEXED = 1
+
     def __init__(self):
 
         self.params_file_name = "params.json"
+        self.params_store_file_name = "params.jsonl"
         self.sge_batch_file_name = "batch.sge.sh"
         self.slurm_batch_file_name = "batch.slurm.sh"
         self.python_sim_runner_file_name = "runsimulation.py"
-
-
-
-    def expand_parameters(self, parameters, joint_lists=[], default_repeats=1, count_funcs=[]):
+        self.ledger_file_name = "ledger.jsonl"
+        self.resume_job_map_file_name = "resume.jobs"
+        self.job_map_file_name = "sweep.jobs"
+        # seconds between progress messages while writing the parameters, None for no messages
+        self.progress_interval = 5.0
+        self.sge_resume_file_name = "resume.sge.sh"
+        self.slurm_resume_file_name = "resume.slurm.sh"
+        self.sge_submit_file_name = "submit.sge.sh"
+        self.slurm_submit_file_name = "submit.slurm.sh"
+        self.sge_resume_submit_file_name = "resume.submit.sge.sh"
+        self.slurm_resume_submit_file_name = "resume.submit.slurm.sh"
+        # claim files of the work queue, and the seconds before a dead worker's simulations are run again
+        self.queue_dir_name = "queue"
+        self.worker_lease = 600.0
+        self.catalogue_file_name = "sweep.db"
+        # where each simulation's output directory goes, e.g. OutputLayout(fan_out=100, levels=2) for a very
+        # large sweep, see util.layout
+        self.output_layout = FLAT
+        # pack each finished simulation's output directory into archives of this many simulations, None to leave
+        # them as they are, see util.archive
+        self.runs_per_archive = None
+        self.archive_dir_name = "archives"
+
+
+
+    def expand_parameters(self, parameters, joint_lists=[], default_repeats=1, count_funcs=[], columnar=False, constraints=[]):
         """
         Generate an expanded list of parameters from the instance variable.
         :param parameters:
         :param joint_lists:
         :param default_repeats:
         :param count_funcs:
+        :param columnar: Return a ParamTable holding one array per parameter and the repeat counts instead of a list
+        :param constraints: Functions of a parameter dict returning False for combinations to leave out, see
+            Scan.add_constraint. These are dropped before the count functions are called
         :return: Array of expanded parameters
         """
 
 
         scan = Scan(parameters, joint_lists,
-                    default_repeats, count_funcs)
+                    default_repeats, count_funcs, constraints)
+
+        if columnar:
+            return scan.table()
 
         expanded_output = []
 
@@ -81,23 +125,62 @@ class ParamSweeper:
 
         return expanded_output
 
-    def generate_batch_output(self, output_dir, exec_cmd, parameters, scheduler=SGE, joint_lists=[], default_repeats=1, count_funcs=[], batch_params=[]):
+    def get_expanded_parameters(self, parameters, joint_lists=[], default_repeats=1, count_funcs=[], constraints=[]):
+        """
+        Expands the parameters unless they have already been expanded into a ParamTable
+        :param parameters: Dictionary of parameter values, or a ParamTable from expand_parameters(columnar=True)
+        :param joint_lists:
+        :param default_repeats:
+        :param count_funcs:
+        :param constraints:
+        :return: Sequence of parameter dicts, one per simulation
+        """
+        if isinstance(parameters, ParamTable):
+            return parameters
+
+        return self.expand_parameters(parameters, joint_lists, default_repeats, count_funcs, constraints=constraints)
+
+    def generate_batch_output(self, output_dir, exec_cmd, parameters, scheduler=SGE, joint_lists=[], default_repeats=1, count_funcs=[], batch_params=[], params_format=PARAMS_JSON, tasks_per_job=1, processes_per_job=1, cache=None, repeat_param=None, max_array_size=None, max_concurrent=None, cost_model=None, constraints=[], num_workers=None, catalogue=False, policy=None):
         """
         Generate output files needed to run parameter sweep in batch mode
         :param output_dir:
         :param exec_cmd:
-        :param parameters:
+        :param parameters: Dictionary of parameter values, or an already expanded ParamTable
         :param scheduler:
         :param joint_lists:
         :param default_repeats:
         :param count_funcs:
         :param batch_params:
+        :param params_format: PARAMS_JSON writes every parameter set into params.json. PARAMS_INDEXED writes them
+            to an indexed store (params.jsonl) so each array task only reads its own parameters, storing each
+            distinct parameter set once along with its number of repeats.
+        :param tasks_per_job: Number of simulations run by each array job, as a contiguous block
+        :param processes_per_job: Number of simulations an array job runs at once, remember to request the
+            matching number of cores through batch_params
+        :param cache: ResultCache the array jobs take the outputs of previously run simulations from, it must be
+            on a filesystem shared by the compute nodes
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :param max_array_size: Largest array job the scheduler accepts (e.g. SLURM's MaxArraySize - 1). A sweep
+            needing more array jobs is split into shards, each with its own parameter file and batch script,
+            and a submit script is written that submits the shards one after another
+        :param max_concurrent: Limit on the number of array jobs of a batch script running at once
+        :param cost_model: Function of a parameter dict predicting its run time, e.g. a CostModel fitted to an
+            earlier sweep. Instead of contiguous blocks of tasks_per_job, simulations are packed into the same
+            number of array jobs so each job has roughly the same predicted run time
+        :param constraints: Functions of a parameter dict returning False for combinations to leave out
+        :param num_workers: Instead of giving each array job a fixed set of simulations, start this many array jobs
+            as workers that take the next unfinished simulation from a queue whenever they are free, see
+            util.workqueue. tasks_per_job is then ignored, and a cost_model orders the queue from the most to the
+            least costly simulation
+        :param catalogue: Also write every simulation into a SQLite catalogue (sweep.db) that can be queried by
+            parameter and status, see util.catalogue. The array jobs don't write to it, it is brought up to date
+            from the ledger with chastesweep_catalogue
+        :param policy: ExecutionPolicy the array jobs run their simulations with, see util.policy. Each array job
+            starts its circuit breaker with the last simulations to finish in the ledger, so once it trips the
+            array jobs still to start skip their simulations
         :return:
         """
 
-
-
-
         # Expand the paths
         output_dir = self.get_abs_expanded_path(output_dir)
         exec_cmd = self.get_abs_expanded_path(exec_cmd)
@@ -111,46 +194,313 @@ class ParamSweeper:
         if not os.path.exists(exec_cmd):
             raise ValueError("Could not locate command {}".format(exec_cmd))
 
-        expanded_output = self.expand_parameters(parameters, joint_lists, default_repeats, count_funcs)
+        if tasks_per_job < 1 or processes_per_job < 1:
+            raise ValueError("Tasks and processes per job must be at least 1")
+
+        if max_array_size is not None and max_array_size < 1:
+            raise ValueError("Maximum array size must be at least 1")
+
+        if num_workers is not None and (num_workers < 1 or num_workers > (max_array_size or num_workers)):
+            raise ValueError("Number of workers must be at least 1 and at most the maximum array size")
+
+        if params_format not in (ParamSweeper.PARAMS_JSON, ParamSweeper.PARAMS_INDEXED):
+            raise Exception("Unsupported parameter format {}".format(params_format))
+
+        if isinstance(parameters, ParamTable):
+            expanded_output = parameters
+        else:
+            # Streamed into the parameter file a combination at a time rather than expanded into a list
+            expanded_output = Scan(parameters, joint_lists, default_repeats, count_funcs, constraints)
         env = Environment(loader=PackageLoader('chastesweep', 'templates'))
 
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
 
 
-        params_output = {"params": expanded_output,
-                         "exec_cmd": exec_cmd,
-                         "output_dir": output_dir}
+        params_output = {"exec_cmd": exec_cmd,
+                         "output_dir": output_dir,
+                         "tasks_per_job": tasks_per_job,
+                         "processes_per_job": processes_per_job,
+                         "ledger": self.ledger_file_name,
+                         "repeat_param": repeat_param,
+                         "layout": self.output_layout.settings()}
 
+        archive = self.get_run_archive(output_dir)
+        if archive is not None:
+            params_output["archive"] = archive.settings()
 
-        json_output_path = os.path.join(output_dir, self.params_file_name)
-        sge_batch_output_path = os.path.join(output_dir, self.sge_batch_file_name)
-        slurm_batch_output_path = os.path.join(output_dir, self.slurm_batch_file_name)
-        python_sim_runner_output_path = os.path.join(output_dir, self.python_sim_runner_file_name)
+        if num_workers is not None:
+            params_output["queue"] = {"dir": self.queue_dir_name, "lease": self.worker_lease}
+
+        if policy is not None:
+            params_output["policy"] = policy.settings()
+
+        if cache is not None:
+            params_output["cache"] = {"cache_dir": cache.cache_dir,
+                                      "max_bytes": cache.max_bytes,
+                                      "link": cache.link}
 
 
-        # Output json
-        with open(json_output_path, 'w') as json_out_file:
-            json.dump(params_output, json_out_file)
+        json_output_path = os.path.join(output_dir, self.params_file_name)
+        params_store_output_path = os.path.join(output_dir, self.params_store_file_name)
+        python_sim_runner_output_path = os.path.join(output_dir, self.python_sim_runner_file_name)
 
         context = {
-            "num_tasks": len(expanded_output),
             "exec_cmd": exec_cmd,
             "output_dir": output_dir,
-            "batch_params": batch_params
+            "batch_params": batch_params,
+            "max_concurrent": max_concurrent,
+            "runner_args": ""
         }
 
+        progress = Progress("Writing parameters", "parameter sets", expanded_output.num_combinations(),
+                            self.progress_interval)
+        records = progress.track(compact_records(expanded_output))
+
+        sweep_catalogue = None
+        if catalogue:
+            catalogue_path = os.path.join(output_dir, self.catalogue_file_name)
+            remove_catalogue(catalogue_path)
+            sweep_catalogue = Catalogue(catalogue_path)
+            records = sweep_catalogue.track(records, 1,
+                                            lambda task_id: self.output_layout.path(output_dir, task_id))
+            params_output["catalogue"] = self.catalogue_file_name
+
+        # Only a sharded sweep needs the number of tasks before writing them, workers share a single queue
+        num_tasks = None
+        if max_array_size is not None and num_workers is None:
+            num_tasks = expanded_output.num_tasks() if isinstance(expanded_output, Scan) else len(expanded_output)
+
+        if num_tasks is not None and (num_tasks + tasks_per_job - 1) // tasks_per_job > max_array_size:
+            context["num_tasks"] = num_tasks
+            context["num_jobs"] = (num_tasks + tasks_per_job - 1) // tasks_per_job
+            self.write_shards(output_dir, scheduler, params_output, records, params_format,
+                              max_array_size * tasks_per_job, context, cost_model)
+        else:
+            if params_format == ParamSweeper.PARAMS_JSON:
+                num_tasks = write_params_json(json_output_path, params_output, records)
+            else:
+                num_tasks = write_param_store(params_store_output_path, records)
+                params_output["params_store"] = self.params_store_file_name
+
+                # Output json
+                with open(json_output_path, 'w') as json_out_file:
+                    json.dump(params_output, json_out_file)
+
+            context["num_tasks"] = num_tasks
+            context["num_jobs"] = (num_tasks + tasks_per_job - 1) // tasks_per_job
+
+            if num_workers is not None:
+                context["num_jobs"] = num_workers
+                context["runner_args"] = " --worker"
+                if cost_model is not None:
+                    costs = predict_costs(cost_model, expanded_output)
+                    order = sorted(range(1, num_tasks + 1), key=lambda task_id: costs[task_id - 1], reverse=True)
+                    write_job_map(os.path.join(output_dir, self.job_map_file_name), [order])
+                    context["runner_args"] += " --job-map {}".format(self.job_map_file_name)
+            elif cost_model is not None:
+                jobs = pack_tasks(range(1, num_tasks + 1), predict_costs(cost_model, expanded_output),
+                                  context["num_jobs"])
+                write_job_map(os.path.join(output_dir, self.job_map_file_name), jobs)
+                context["runner_args"] = " --job-map {}".format(self.job_map_file_name)
+
+            self.write_batch_script(output_dir, scheduler, context)
+
+        if sweep_catalogue is not None:
+            sweep_catalogue.close()
+
+        with open(python_sim_runner_output_path, "w") as simrunner_file:
+            simrunner_file.write(env.get_template("runsimulation.py").render(context))
+
+    def write_shards(self, output_dir, scheduler, settings, records, params_format, shard_size, context,
+                     cost_model=None):
+        """
+        Writes the parameter files and batch scripts of a sweep split into shards of shard_size simulations,
+        and the submit script that chains them. Each shard's array jobs only read the shard's own parameter
+        file, while params.json lists the shards so the whole sweep can still be read, e.g. to resume it.
+        :param output_dir:
+        :param scheduler:
+        :param settings: Contents of params.json apart from the parameters
+        :param records: Iterable of (parameter dict, number of repeats), e.g. from compact_records
+        :param params_format:
+        :param shard_size: Number of simulations in each shard
+        :param context: Template context of the whole sweep
+        :param cost_model: Packs the simulations of each shard into array jobs by predicted run time
+        :return: Number of shards
+        """
+        shards = []
+        batch_scripts = []
+        first_task = 1
+        for shard, (first_repeat, records) in enumerate(shard_records(records, shard_size)):
+            shard_params_file_name = self.get_shard_file_name(self.params_file_name, shard)
+            num_tasks = sum(repeats for params, repeats in records)
+
+            shard_settings = dict(settings, first_task=first_task, first_repeat=first_repeat)
+            if params_format == ParamSweeper.PARAMS_JSON:
+                shard_settings["params"] = [params for params, repeats in records for _ in range(repeats)]
+                shard_settings["repeats"] = [repeats for params, repeats in records]
+            else:
+                shard_store_file_name = self.get_shard_file_name(self.params_store_file_name, shard)
+                write_param_store(os.path.join(output_dir, shard_store_file_name), records)
+                shard_settings["params_store"] = shard_store_file_name
+
+            with open(os.path.join(output_dir, shard_params_file_name), 'w') as json_out_file:
+                json.dump(shard_settings, json_out_file, default=json_default)
+
+            tasks_per_job = settings["tasks_per_job"]
+            shard_context = dict(context,
+                                 num_tasks=num_tasks,
+                                 num_jobs=(num_tasks + tasks_per_job - 1) // tasks_per_job,
+                                 runner_args=" --params {}".format(shard_params_file_name))
+            if cost_model is not None:
+                jobs = pack_tasks(range(first_task, first_task + num_tasks), record_costs(cost_model, records),
+                                  shard_context["num_jobs"])
+                job_map_file_name = self.get_shard_file_name(self.job_map_file_name, shard)
+                write_job_map(os.path.join(output_dir, job_map_file_name), jobs)
+                shard_context["runner_args"] += " --job-map {}".format(job_map_file_name)
+            batch_script = self.write_batch_script(output_dir, scheduler, shard_context, shard=shard)
+            batch_scripts.append(os.path.basename(batch_script))
+
+            shards.append({"params_file": shard_params_file_name, "first_task": first_task, "num_tasks": num_tasks})
+            first_task += num_tasks
+
+        with open(os.path.join(output_dir, self.params_file_name), 'w') as json_out_file:
+            json.dump(dict(settings, shards=shards), json_out_file)
+
+        self.write_submit_script(output_dir, scheduler, context, batch_scripts)
+        return len(shards)
+
+    def get_shard_file_name(self, file_name, shard):
+        """Name of the file of a shard, e.g. batch.sge.sh becomes batch.3.sge.sh"""
+        name, dot, extension = file_name.partition(".")
+        return "{}.{}{}{}".format(name, shard, dot, extension)
+
+    def write_submit_script(self, output_dir, scheduler, context, batch_scripts, resume=False):
+        """
+        Renders the script that submits the batch scripts of a sharded sweep, each depending on the one before
+        :param output_dir:
+        :param scheduler:
+        :param context: Template context
+        :param batch_scripts: File names of the batch scripts, in the order they are submitted
+        :param resume: Write the script for resuming the sweep rather than the main submit script
+        :return: Path of the submit script
+        """
+        env = Environment(loader=PackageLoader('chastesweep', 'templates'))
+
         if scheduler == ParamSweeper.SGE :
-            with open(sge_batch_output_path, "w") as sge_batch_file:
-                sge_batch_file.write(env.get_template("batch.sge.sh").render(context))
+            template_name = "submit.sge.sh"
+            file_name = self.sge_resume_submit_file_name if resume else self.sge_submit_file_name
         elif scheduler == ParamSweeper.SLURM:
-            with open(slurm_batch_output_path, "w") as slurm_batch_file:
-                slurm_batch_file.write(env.get_template("batch.slurm.sh").render(context))
+            template_name = "submit.slurm.sh"
+            file_name = self.slurm_resume_submit_file_name if resume else self.slurm_submit_file_name
         else:
             raise Exception("Unsupported scheduler {}".format(scheduler))
 
-        with open(python_sim_runner_output_path, "w") as simrunner_file:
-            simrunner_file.write(env.get_template("runsimulation.py").render(context))
+        submit_output_path = os.path.join(output_dir, file_name)
+        with open(submit_output_path, "w") as submit_file:
+            submit_file.write(env.get_template(template_name).render(dict(context, batch_scripts=batch_scripts)))
+
+        return submit_output_path
+
+    def write_batch_script(self, output_dir, scheduler, context, resume=False, shard=None):
+        """
+        Renders the batch script of a scheduler into the output directory
+        :param output_dir:
+        :param scheduler:
+        :param context: Template context, runner_args is appended to the runsimulation.py command line
+        :param resume: Write the script for resuming the sweep rather than the main batch script
+        :param shard: Index of the shard the script runs, for a sharded sweep
+        :return: Path of the batch script
+        """
+        env = Environment(loader=PackageLoader('chastesweep', 'templates'))
+
+        if scheduler == ParamSweeper.SGE :
+            template_name = "batch.sge.sh"
+            file_name = self.sge_resume_file_name if resume else self.sge_batch_file_name
+        elif scheduler == ParamSweeper.SLURM:
+            template_name = "batch.slurm.sh"
+            file_name = self.slurm_resume_file_name if resume else self.slurm_batch_file_name
+        else:
+            raise Exception("Unsupported scheduler {}".format(scheduler))
+
+        if shard is not None:
+            file_name = self.get_shard_file_name(file_name, shard)
+
+        batch_output_path = os.path.join(output_dir, file_name)
+        with open(batch_output_path, "w") as batch_file:
+            batch_file.write(env.get_template(template_name).render(context))
+
+        return batch_output_path
+
+    def generate_resume_batch(self, output_dir, scheduler=SGE, batch_params=[], max_array_size=None, max_concurrent=None, cost_model=None):
+        """
+        Generate a batch script that reruns the simulations of a batch sweep that are missing or failed
+        according to its ledger. Incomplete outputs are removed before the simulation is rerun.
+        :param output_dir: Output directory of a sweep created by generate_batch_output
+        :param scheduler:
+        :param batch_params:
+        :param max_array_size: Largest array job the scheduler accepts, more array jobs are split into shards
+            submitted one after another by a resume submit script
+        :param max_concurrent: Limit on the number of array jobs of a batch script running at once
+        :param cost_model: Packs the simulations into array jobs by predicted run time, see generate_batch_output
+        :return: Number of simulations to rerun
+        """
+        output_dir = self.get_abs_expanded_path(output_dir)
+
+        sweep = BatchSweep(output_dir, self.params_file_name)
+        try:
+            completed = Ledger(sweep.ledger_path).completed()
+            pending = [task_id for task_id in range(1, sweep.num_tasks + 1) if task_id not in completed]
+            tasks_per_job = sweep.tasks_per_job
+            if cost_model is not None:
+                costs = [cost_model(sweep.params(task_id)) for task_id in pending]
+        finally:
+            sweep.close()
+
+        if not pending:
+            print("All simulations have completed")
+            return 0
+
+        if cost_model is not None:
+            jobs = pack_tasks(pending, costs, (len(pending) + tasks_per_job - 1) // tasks_per_job)
+        else:
+            jobs = [pending[i:i + tasks_per_job] for i in range(0, len(pending), tasks_per_job)]
+
+        context = {
+            "num_tasks": len(pending),
+            "num_jobs": len(jobs),
+            "exec_cmd": sweep.exec_cmd,
+            "output_dir": output_dir,
+            "batch_params": batch_params,
+            "max_concurrent": max_concurrent,
+            "runner_args": " --resume --job-map {}".format(self.resume_job_map_file_name)
+        }
+
+        if max_array_size is None or len(jobs) <= max_array_size:
+            write_job_map(os.path.join(output_dir, self.resume_job_map_file_name), jobs)
+            self.write_batch_script(output_dir, scheduler, context, resume=True)
+        else:
+            batch_scripts = []
+            for shard, first_job in enumerate(range(0, len(jobs), max_array_size)):
+                shard_jobs = jobs[first_job:first_job + max_array_size]
+                job_map_file_name = self.get_shard_file_name(self.resume_job_map_file_name, shard)
+                write_job_map(os.path.join(output_dir, job_map_file_name), shard_jobs)
+                shard_context = dict(context,
+                                     num_tasks=sum(len(job) for job in shard_jobs),
+                                     num_jobs=len(shard_jobs),
+                                     runner_args=" --resume --job-map {}".format(job_map_file_name))
+                batch_script = self.write_batch_script(output_dir, scheduler, shard_context, resume=True, shard=shard)
+                batch_scripts.append(os.path.basename(batch_script))
+            self.write_submit_script(output_dir, scheduler, context, batch_scripts, resume=True)
+
+        print("{} simulations to rerun".format(len(pending)))
+        return len(pending)
+
+    def get_run_archive(self, output_dir):
+        """The RunArchive of a sweep in output_dir, or None if its simulations' outputs aren't packed."""
+        if self.runs_per_archive is None:
+            return None
+        return RunArchive(os.path.join(output_dir, self.archive_dir_name), self.runs_per_archive)
 
     def get_abs_expanded_path(self, path):
         if path is None:
@@ -158,34 +508,178 @@ class ParamSweeper:
 
         return os.path.abspath(os.path.expanduser(path))
 
-    def perform_serial_sweep(self, output_dir, exec_cmd, parameters, joint_lists=[], default_repeats=1, count_funcs=[]):
+    def perform_serial_sweep(self, output_dir, exec_cmd, parameters, joint_lists=[], default_repeats=1, count_funcs=[], resume=False, cache=None, repeat_param=None, constraints=[], catalogue=False, policy=None):
         """
         Runs the sweep serially
         :param output_dir:
         :param exec_cmd:
-        :param parameters:
+        :param parameters: Dictionary of parameter values, or an already expanded ParamTable
         :param joint_lists:
         :param default_repeats:
         :param count_funcs:
-        :return:
+        :param resume: Only run the simulations that have not completed according to the sweep's ledger
+        :param cache: ResultCache to take the outputs of previously run simulations from
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :param constraints: Functions of a parameter dict returning False for combinations to leave out
+        :param catalogue: Also keep every simulation and its status in a SQLite catalogue (sweep.db) that can be
+            queried by parameter and status, see util.catalogue
+        :param policy: ExecutionPolicy setting a timeout on each simulation, retries of failed simulations and a
+            circuit breaker that stops the sweep when most simulations fail, see util.policy
+        :return: List of exit codes indexed by simulation id, None where the simulation was not run
+        """
+
+        return self._run_local_sweep(output_dir, exec_cmd, parameters, joint_lists, default_repeats, count_funcs,
+                                     constraints, run_serial, resume, cache, repeat_param, catalogue, policy)
+
+    def perform_parallel_sweep(self, output_dir, exec_cmd, parameters, joint_lists=[], default_repeats=1, count_funcs=[], num_processes=None, resume=False, cache=None, repeat_param=None, constraints=[], catalogue=False, policy=None):
+        """
+        Runs the sweep locally, keeping num_processes simulations running at once. Output layout and
+        exit codes are the same as perform_serial_sweep. On Ctrl-C the running simulations are terminated.
+        :param output_dir:
+        :param exec_cmd:
+        :param parameters: Dictionary of parameter values, or an already expanded ParamTable
+        :param joint_lists:
+        :param default_repeats:
+        :param count_funcs:
+        :param num_processes: Number of concurrent simulations, defaults to the number of cores
+        :param resume: Only run the simulations that have not completed according to the sweep's ledger
+        :param cache: ResultCache to take the outputs of previously run simulations from
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :param constraints: Functions of a parameter dict returning False for combinations to leave out
+        :param catalogue: Also keep every simulation and its status in a SQLite catalogue (sweep.db) that can be
+            queried by parameter and status, see util.catalogue
+        :param policy: ExecutionPolicy setting a timeout on each simulation, retries of failed simulations and a
+            circuit breaker that stops the sweep when most simulations fail, see util.policy
+        :return: List of exit codes indexed by simulation id, None where the simulation was not run
+        """
+
+        def run(commands, on_finish, timeout, retry):
+            return run_parallel(commands, num_processes, on_finish, timeout=timeout, retry=retry)
+
+        return self._run_local_sweep(output_dir, exec_cmd, parameters, joint_lists, default_repeats, count_funcs,
+                                     constraints, run, resume, cache, repeat_param, catalogue, policy)
+
+    def perform_async_sweep(self, output_dir, exec_cmd, parameters, joint_lists=[], default_repeats=1, count_funcs=[], num_processes=None, timeout=None, resume=False, cache=None, repeat_param=None, constraints=[], catalogue=False, policy=None):
+        """
+        Runs the sweep locally like perform_parallel_sweep, but with an asyncio engine that starts the
+        executable directly rather than through a shell. Each simulation's stdout and stderr are written to
+        stdout.log and stderr.log in its output directory. Needs Python 3.7, see util.aioexecutor.
+        :param output_dir:
+        :param exec_cmd:
+        :param parameters: Dictionary of parameter values, or an already expanded ParamTable
+        :param joint_lists:
+        :param default_repeats:
+        :param count_funcs:
+        :param num_processes: Number of concurrent simulations, defaults to the number of cores
+        :param timeout: Seconds after which a simulation is terminated and recorded as failed, by default the
+            policy's timeout if it has one
+        :param resume: Only run the simulations that have not completed according to the sweep's ledger
+        :param cache: ResultCache to take the outputs of previously run simulations from
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :param constraints: Functions of a parameter dict returning False for combinations to leave out
+        :param catalogue: Also keep every simulation and its status in a SQLite catalogue (sweep.db) that can be
+            queried by parameter and status, see util.catalogue
+        :param policy: ExecutionPolicy setting a timeout on each simulation, retries of failed simulations and a
+            circuit breaker that stops the sweep when most simulations fail, see util.policy
+        :return: List of exit codes indexed by simulation id, None where the simulation was not run
+        """
+        from chastesweep.util.aioexecutor import run_async
+
+        output_dir, exec_cmd = self.check_local_sweep_paths(output_dir, exec_cmd)
+
+        def run(commands, on_finish, policy_timeout, retry):
+            return run_async(commands, num_processes, on_finish, timeout if timeout is not None else policy_timeout,
+                             lambda simulation_id: simulation_output_dir(output_dir, simulation_id, self.output_layout),
+                             retry)
+
+        return self._run_local_sweep(output_dir, exec_cmd, parameters, joint_lists, default_repeats, count_funcs,
+                                     constraints, run, resume, cache, repeat_param, catalogue, policy, argv=True)
+
+    def _run_local_sweep(self, output_dir, exec_cmd, parameters, joint_lists, default_repeats, count_funcs, constraints, run, resume, cache, repeat_param, catalogue=False, policy=None, argv=False):
+        # Runs a local sweep through run(commands, on_finish, timeout, retry), recording every simulation in the ledger
+        output_dir, exec_cmd = self.check_local_sweep_paths(output_dir, exec_cmd)
+
+        # Repeat indices come from the scan's records, as in a batch sweep, rather than from comparing dicts
+        if isinstance(parameters, ParamTable):
+            expanded_output = parameters
+        else:
+            expanded_output = Scan(parameters, joint_lists, default_repeats, count_funcs, constraints)
+        num_tasks = len(expanded_output)
+
+        sweep_catalogue = None
+        if catalogue:
+            # A resumed sweep keeps the status of the simulations that already ran
+            catalogue_path = os.path.join(output_dir, self.catalogue_file_name)
+            if not resume:
+                remove_catalogue(catalogue_path)
+            sweep_catalogue = Catalogue(catalogue_path)
+            sweep_catalogue.add_tasks((i, iteration_param, repeat_index,
+                                       simulation_output_dir(output_dir, i, self.output_layout))
+                                      for i, (iteration_param, repeat_index)
+                                      in enumerate(expand_records(compact_records(expanded_output))))
+
+        ledger = Ledger(os.path.join(output_dir, self.ledger_file_name), sweep_catalogue)
+        completed = ledger.completed() if resume else None
+        launcher = SimulationLauncher(output_dir, exec_cmd, ledger, completed, cache, repeat_param=repeat_param,
+                                      argv=argv, policy=policy, layout=self.output_layout,
+                                      archive=self.get_run_archive(output_dir))
+
+        tasks = expand_records(compact_records(expanded_output))
+        simulations = ((i, iteration_param, repeat_index) for i, (iteration_param, repeat_index) in enumerate(tasks))
+        try:
+            run(launcher.commands(simulations), launcher.finished, policy.timeout if policy is not None else None,
+                launcher.retry)
+        finally:
+            if sweep_catalogue is not None:
+                sweep_catalogue.close()
+
+        if cache is not None:
+            print(cache.summary())
+
+        return [launcher.exit_codes.get(i) for i in range(num_tasks)]
+
+    def perform_adaptive_sweep(self, output_dir, exec_cmd, grid, metric, threshold, budget, fixed_params={}, default_repeats=1, num_processes=1, criterion=RANGE, log_params=[], repeat_param=None):
+        """
+        Runs a coarse grid locally, then repeatedly refines the cells of the grid where a metric of the
+        simulation output changes by more than threshold, until none do or budget simulations have run.
+        See AdaptiveSweep.
+        :param output_dir: Output directory, which should not hold an earlier sweep
+        :param exec_cmd:
+        :param grid: Dict of parameter name: initial values, at least two for each parameter
+        :param metric: Function of the output directory of a simulation returning a number
+        :param threshold: Cells where the metric changes by more than this are refined
+        :param budget: Maximum number of simulations, counting repeats
+        :param fixed_params: Dict of parameter name: value passed unchanged to every simulation
+        :param default_repeats: Number of times each point is run, its metric is the mean over the runs
+        :param num_processes: Number of concurrent simulations, None for the number of cores
+        :param criterion: adaptive.RANGE or adaptive.VARIANCE of the metric at the corners of a cell
+        :param log_params: Parameters refined in log space
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :return: List of (parameter dict, metric) of every point run
+        """
+        output_dir, exec_cmd = self.check_local_sweep_paths(output_dir, exec_cmd)
+
+        def run(commands, on_finish):
+            return run_parallel(commands, num_processes, on_finish)
+
+        adaptive_sweep = AdaptiveSweep(output_dir, exec_cmd, Ledger(os.path.join(output_dir, self.ledger_file_name)),
+                                       grid, metric, threshold, budget, fixed_params, default_repeats, criterion,
+                                       log_params, repeat_param, run_serial if num_processes == 1 else run,
+                                       self.output_layout)
+        return adaptive_sweep.run()
+
+    def check_local_sweep_paths(self, output_dir, exec_cmd):
+        """
+        Expands and validates the paths used by a local sweep, creating the output directory if needed
+        :param output_dir:
+        :param exec_cmd:
+        :return: Tuple of the expanded (output_dir, exec_cmd)
         """
 
         # Expand the paths
         output_dir = self.get_abs_expanded_path(output_dir)
         exec_cmd = self.get_abs_expanded_path(exec_cmd)
 
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
-        # Check path validity
         # Check path validity
         if output_dir is None:
             raise ValueError("Output directory not specified")
@@ -199,29 +693,7 @@ class ParamSweeper:
         if not os.path.exists(output_dir):
             os.mkdir(output_dir)
 
-        expanded_output = self.expand_parameters(parameters, joint_lists, default_repeats, count_funcs)
-        num_iterations = len(expanded_output)
-        for i in range(num_iterations):
-            iteration_param = expanded_output[i]
-
-            # Create a folder to store simulation results
-            simulation_instance_output_dir = os.path.join(output_dir, str(i))
-            if os.path.exists(simulation_instance_output_dir):
-                print("Output directory for simulation id {} already exists, aborting".format(i))
-            else:
-                os.mkdir(simulation_instance_output_dir)
-
-                # Builds the exec command with parameters and run the simulation
-                iteration_param_string = ""
-                for key, value in iteration_param.items():
-                    iteration_param_string = iteration_param_string + " {}={}".format(key, value)
-                final_cmd = "{} output_dir={}{}".format(exec_cmd, simulation_instance_output_dir,
-                                                        iteration_param_string)
-
-                print("Running simulation ID {}, outputting to {}".format(i, simulation_instance_output_dir))
-                subprocess.call(final_cmd, shell=True)
-
-
+        return output_dir, exec_cmd
 
     def generate_main_cpp(self, param_name_list, output_path):
         """
@@ -1,10 +1,13 @@
 #!/bin/bash
 #$ -cwd {{ output_dir }}
-#$ -t 1-{{ num_tasks }}
+#$ -t 1-{{ num_jobs }}
+{% if max_concurrent %}
+#$ -tc {{ max_concurrent }}
+{% endif %}
 {% for bp in batch_params %}
 #$ {{ bp }}
 {% endfor %}
 
 cd {{ output_dir }}
 
-python runsimulation.py $SGE_TASK_ID
\ No newline at end of file
+python runsimulation.py $SGE_TASK_ID{{ runner_args }}
\ No newline at end of file
@@ -1,5 +1,5 @@
 #!/bin/bash
-#SBATCH --array=1-{{ num_tasks }}
+#SBATCH --array=1-{{ num_jobs }}{% if max_concurrent %}%{{ max_concurrent }}{% endif %}
 #SBATCH --chdir {{ output_dir }}
 {% for bp in batch_params %}
 #SBATCH {{ bp }}
@@ -7,4 +7,4 @@
 
 cd {{ output_dir }}
 
-python runsimulation.py $SLURM_ARRAY_TASK_ID
\ No newline at end of file
+python runsimulation.py $SLURM_ARRAY_TASK_ID{{ runner_args }}
\ No newline at end of file
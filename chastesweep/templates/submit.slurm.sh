@@ -0,0 +1,10 @@
+#!/bin/bash
+# Submits each shard of the sweep once the one before it has finished
+
+cd {{ output_dir }}
+
+job_id=$(sbatch --parsable {{ batch_scripts[0] }} | cut -d';' -f1)
+{% for batch_script in batch_scripts[1:] %}
+job_id=$(sbatch --parsable --dependency=afterany:$job_id {{ batch_script }} | cut -d';' -f1)
+{% endfor %}
+echo "Submitted {{ batch_scripts|length }} shards, the last as job $job_id"
@@ -0,0 +1,69 @@
+from __future__ import print_function
+import unittest
+import os
+import json
+import shutil
+
+from chastesweep import ParamSweeper
+from chastesweep.util.adaptive import VARIANCE
+
+
+def step_metric(run_dir):
+    # 1 to the right of x = 0.37, 0 to the left
+    with open(os.path.join(run_dir, "args.txt")) as args_file:
+        args = dict(arg.split("=") for arg in args_file.read().split())
+    return 1.0 if float(args["x"]) > 0.37 else 0.0
+
+
+class TestAdaptiveSweep(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_adaptive"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+        # Writes its arguments into its output directory for the metric to read
+        self.exec_cmd = os.path.join("/tmp", "echo_args.sh")
+        with open(self.exec_cmd, "w") as exec_file:
+            exec_file.write("#!/bin/bash\necho $@ > ${1#\"output_dir=\"}/args.txt\n")
+        os.chmod(self.exec_cmd, 0o755)
+
+    def test_refines_around_step(self):
+        sweeper = ParamSweeper()
+        results = sweeper.perform_adaptive_sweep(self.output_dir, self.exec_cmd, {'x': [0.0, 0.5, 1.0]}, step_metric,
+                                                 threshold=0.5, budget=8, fixed_params={'end_time': 10})
+
+        # The initial grid, then one new point a round closing in on the step
+        xs = sorted(params['x'] for params, metric in results)
+        self.assertEqual(xs, [0.0, 0.25, 0.3125, 0.34375, 0.359375, 0.375, 0.5, 1.0])
+        for params, metric in results:
+            self.assertEqual(params['end_time'], 10)
+            self.assertEqual(metric, 1.0 if params['x'] > 0.37 else 0.0)
+
+        with open(os.path.join(self.output_dir, "points.jsonl")) as points_file:
+            points = [json.loads(line) for line in points_file]
+        self.assertEqual(len(points), 8)
+        self.assertEqual([point["ids"] for point in points[:3]], [[0], [1], [2]])
+        self.assertEqual(points[3]["params"]["x"], 0.25)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "7", "args.txt")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "8")))
+
+    def test_two_parameters(self):
+        sweeper = ParamSweeper()
+        results = sweeper.perform_adaptive_sweep(self.output_dir, self.exec_cmd,
+                                                 {'x': [0.0, 1.0], 'y': [1.0, 100.0]}, step_metric,
+                                                 threshold=0.1, budget=40, default_repeats=2, num_processes=2,
+                                                 criterion=VARIANCE, log_params=['y'])
+
+        # Only the cells spanning the step are refined, halving y at the geometric mean, until the next round
+        # would go over the budget
+        ys = set(params['y'] for params, metric in results)
+        self.assertIn(10.0, ys)
+        xs = sorted(set(params['x'] for params, metric in results))
+        self.assertEqual(xs, [0.0, 0.25, 0.5, 1.0])
+        self.assertEqual(len(results), 4 + 5 + 9)
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "35")))
+
+        with self.assertRaises(ValueError):
+            sweeper.perform_adaptive_sweep("/tmp/test_adaptive_small", self.exec_cmd, {'x': [0.0, 0.5, 1.0]},
+                                           step_metric, threshold=0.5, budget=2)
@@ -0,0 +1,111 @@
+from __future__ import print_function
+import unittest
+import os
+import csv
+import gzip
+import shutil
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.aggregate import aggregate, load_table, write_csv, main
+from chastesweep.util.ledger import Ledger
+
+# output directories read by read_outputs
+read_dirs = []
+
+
+def read_outputs(run_dir):
+    read_dirs.append(run_dir)
+    return {"size": float(np.loadtxt(os.path.join(run_dir, "size.txt")))}
+
+
+class TestAggregate(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_aggregate"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def finish(self, ledger, task_id, a):
+        # Write the outputs a simulation would, and record it as done
+        run_dir = os.path.join(self.output_dir, str(task_id))
+        os.mkdir(run_dir)
+        np.savetxt(os.path.join(run_dir, "size.txt"), [a * 2])
+        np.savetxt(os.path.join(run_dir, "series.txt"), [a, a + 1, a + 2])
+        ledger.append({"id": task_id, "status": "done", "exit_code": 0, "wall": 1.0})
+
+    def test_local_sweep(self):
+        p = {'a': [1.0, 2.0, 3.0, 4.0], 'label': ["x"]}
+        sweeper = ParamSweeper()
+        expanded = sweeper.expand_parameters(p)
+        os.mkdir(self.output_dir)
+        ledger = Ledger(os.path.join(self.output_dir, sweeper.ledger_file_name))
+        for task_id in [0, 2]:
+            self.finish(ledger, task_id, expanded[task_id]['a'])
+        ledger.append({"id": 1, "status": "failed", "exit_code": 1, "wall": 1.0})
+
+        del read_dirs[:]
+        table = aggregate(self.output_dir, read_outputs, parameters=expanded)
+        self.assertEqual(table["id"].tolist(), [0, 2])
+        self.assertEqual(table["a"].tolist(), [1.0, 3.0])
+        self.assertEqual(table["label"].tolist(), ["x", "x"])
+        self.assertEqual(table["size"].tolist(), [2.0, 6.0])
+
+        # Only the simulations that finished since are read
+        for task_id in [3, 1]:
+            self.finish(ledger, task_id, expanded[task_id]['a'])
+        del read_dirs[:]
+        table = aggregate(self.output_dir, read_outputs, parameters=expanded)
+        self.assertEqual(read_dirs, [os.path.join(self.output_dir, "1"), os.path.join(self.output_dir, "3")])
+        self.assertEqual(table["id"].tolist(), [0, 1, 2, 3])
+        self.assertEqual(table["size"].tolist(), [2.0, 4.0, 6.0, 8.0])
+
+        table = load_table(os.path.join(self.output_dir, "results.npz"))
+        self.assertEqual(table["a"].tolist(), [1.0, 2.0, 3.0, 4.0])
+        self.assertEqual(aggregate(self.output_dir, read_outputs, parameters=expanded)["id"].tolist(), [0, 1, 2, 3])
+
+        with self.assertRaises(ValueError):
+            ledger.append({"id": 4, "status": "done", "exit_code": 0, "wall": 1.0})
+            os.mkdir(os.path.join(self.output_dir, "4"))
+            np.savetxt(os.path.join(self.output_dir, "4", "size.txt"), [1.0])
+            aggregate(self.output_dir, read_outputs, parameters=expanded + [{'a': 5.0}])
+
+    def test_batch_sweep(self):
+        p = {'a': [1, 2, 3]}
+        sweeper = ParamSweeper()
+        sweeper.generate_batch_output(output_dir=self.output_dir, exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p, default_repeats=2)
+        ledger = Ledger(os.path.join(self.output_dir, sweeper.ledger_file_name))
+        for task_id in range(1, 6):
+            self.finish(ledger, task_id, [1, 1, 2, 2, 3][task_id - 1])
+
+        outputs = {"size": "size.txt", "series": "series.txt"}
+        table = aggregate(self.output_dir, outputs, num_processes=2)
+        self.assertEqual(table["id"].tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(table["a"].tolist(), [1, 1, 2, 2, 3])
+        self.assertEqual(table["series"].shape, (5, 3))
+        self.assertEqual(table["series"][4].tolist(), [3.0, 4.0, 5.0])
+
+        # A simulation missing an output is left for the next aggregation
+        ledger.append({"id": 6, "status": "done", "exit_code": 0, "wall": 1.0})
+        table = aggregate(self.output_dir, outputs)
+        self.assertEqual(len(table["id"]), 5)
+        os.mkdir(os.path.join(self.output_dir, "6"))
+        np.savetxt(os.path.join(self.output_dir, "6", "size.txt"), [6.0])
+        np.savetxt(os.path.join(self.output_dir, "6", "series.txt"), [3.0, 4.0, 5.0])
+
+        csv_path = os.path.join(self.output_dir, "results.csv.gz")
+        self.assertEqual(main(["chastesweep_aggregate", self.output_dir, "--output", "size=size.txt",
+                               "--output", "series=series.txt", "--csv", csv_path]), 0)
+        with gzip.open(csv_path, "rt") as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(rows[0], ["id", "a", "series[0]", "series[1]", "series[2]", "size"])
+        self.assertEqual(len(rows), 7)
+        self.assertEqual([float(value) for value in rows[6]], [6, 3, 3, 4, 5, 6])
+
+        write_csv(load_table(os.path.join(self.output_dir, "results.npz")),
+                  os.path.join(self.output_dir, "results.csv"))
+        with open(os.path.join(self.output_dir, "results.csv")) as csv_file:
+            self.assertEqual(len(list(csv.reader(csv_file))), 7)
+
+        self.assertEqual(main(["chastesweep_aggregate", self.output_dir]), 1)
@@ -0,0 +1,119 @@
+from __future__ import print_function
+import unittest
+import os
+import sys
+import time
+import shutil
+
+from chastesweep import ParamSweeper
+from chastesweep.util.ledger import Ledger, DONE, FAILED
+
+if sys.version_info >= (3, 7):
+    from chastesweep.util.aioexecutor import run_async, STDOUT_LOG, STDERR_LOG, NOT_FOUND_EXIT_CODE
+
+
+@unittest.skipIf(sys.version_info < (3, 7), "asyncio engine needs Python 3.7")
+class TestAsyncExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_aioexecutor"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+
+    def log_dir(self, task_id):
+        log_dir = os.path.join(self.output_dir, str(task_id))
+        if not os.path.exists(log_dir):
+            os.mkdir(log_dir)
+        return log_dir
+
+    def test_run_async(self):
+        commands = [(i, ["sh", "-c", "exit {}".format(i % 3)]) for i in range(10)]
+        finished = []
+        exit_codes = run_async(commands, num_processes=3, on_finish=lambda i, code, usage: finished.append(i))
+        self.assertEqual(exit_codes, dict((i, i % 3) for i in range(10)))
+        self.assertEqual(sorted(finished), list(range(10)))
+
+        # Arguments are passed as they are, without a shell splitting them
+        exit_codes = run_async([(0, ["sh", "-c", "test \"$0\" = 'a b;c'", "a b;c"]),
+                                (1, [os.path.join(self.output_dir, "missing")])])
+        self.assertEqual(exit_codes, {0: 0, 1: NOT_FOUND_EXIT_CODE})
+
+        with self.assertRaises(ValueError):
+            run_async(commands, num_processes=0)
+
+    def test_concurrency_and_timeout(self):
+        start = time.time()
+        run_async([(i, ["sleep", "0.3"]) for i in range(4)], num_processes=2)
+        self.assertGreaterEqual(time.time() - start, 0.6)
+
+        start = time.time()
+        exit_codes = run_async([(0, ["sleep", "10"]), (1, ["true"])], timeout=0.5)
+        self.assertLess(time.time() - start, 5)
+        self.assertLess(exit_codes[0], 0)
+        self.assertEqual(exit_codes[1], 0)
+
+        # A failed command waiting to be retried gives up its slot
+        retried = []
+
+        def retry(task_id, exit_code, usage):
+            retried.append(task_id)
+            return 0.5 if retried.count(task_id) == 1 else None
+
+        finished = []
+        start = time.time()
+        exit_codes = run_async([(0, ["false"]), (1, ["sleep", "0.3"])], num_processes=1, retry=retry,
+                               on_finish=lambda i, code, usage: finished.append(i))
+        self.assertLess(time.time() - start, 2)
+        self.assertEqual(exit_codes, {0: 1, 1: 0})
+        self.assertEqual(retried, [0, 0])
+        self.assertEqual(finished, [1, 0])
+
+    def test_logs(self):
+        # Far more output than fits in a pipe buffer
+        script = "import sys; sys.stdout.write('x' * 1000000); sys.stderr.write('error')"
+        exit_codes = run_async([(i, [sys.executable, "-c", script]) for i in range(3)], log_dir=self.log_dir)
+        self.assertEqual(exit_codes, {0: 0, 1: 0, 2: 0})
+        for i in range(3):
+            self.assertEqual(os.path.getsize(os.path.join(self.output_dir, str(i), STDOUT_LOG)), 1000000)
+            with open(os.path.join(self.output_dir, str(i), STDERR_LOG)) as stderr_file:
+                self.assertEqual(stderr_file.read(), "error")
+
+    def test_interrupt_terminates_children(self):
+        marker = os.path.join(self.output_dir, "finished")
+
+        def commands():
+            yield 0, ["sh", "-c", "sleep 1; touch {}".format(marker)]
+            raise KeyboardInterrupt()
+
+        start = time.time()
+        with self.assertRaises(KeyboardInterrupt):
+            run_async(commands(), num_processes=2)
+        self.assertLess(time.time() - start, 1)
+
+        time.sleep(1.5)
+        self.assertFalse(os.path.exists(marker))
+
+    def test_async_sweep(self):
+        p = {'a': [1, 2, 3], 'label': ["x y"]}
+        sweeper = ParamSweeper()
+        exit_codes = sweeper.perform_async_sweep(self.output_dir, "chastesweep/test/test_params.sh", p,
+                                                 default_repeats=2, num_processes=2)
+        self.assertEqual(exit_codes, [0] * 6)
+        for i in range(6):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, str(i), "testout.txt")))
+        with open(os.path.join(self.output_dir, "0", STDOUT_LOG)) as stdout_file:
+            self.assertIn("label=x y", stdout_file.read())
+
+        records = Ledger(os.path.join(self.output_dir, sweeper.ledger_file_name)).read()
+        self.assertEqual(set(record["status"] for record in records.values()), set([DONE]))
+
+        # A simulation over the time limit is recorded as failed
+        slow = os.path.join(self.output_dir, "slow.sh")
+        with open(slow, "w") as slow_file:
+            slow_file.write("#!/bin/sh\nsleep 10\n")
+        os.chmod(slow, 0o755)
+        exit_codes = sweeper.perform_async_sweep(os.path.join(self.output_dir, "slow"), slow, {'a': [1]}, timeout=0.5)
+        self.assertLess(exit_codes[0], 0)
+        records = Ledger(os.path.join(self.output_dir, "slow", sweeper.ledger_file_name)).read()
+        self.assertEqual(records[0]["status"], FAILED)
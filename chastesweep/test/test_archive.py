@@ -0,0 +1,121 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+import tarfile
+import multiprocessing
+
+from chastesweep import ParamSweeper
+from chastesweep.util.aggregate import aggregate
+from chastesweep.util.archive import RunArchive
+from chastesweep.util.runner import BatchSweep, run_array_job
+
+OUTPUT_DIR = "/tmp/test_archive"
+
+
+def write_run(task_id):
+    run_dir = os.path.join(OUTPUT_DIR, str(task_id))
+    os.makedirs(os.path.join(run_dir, "results"))
+    with open(os.path.join(run_dir, "log.txt"), "w") as log_file:
+        log_file.write("simulation {}\n".format(task_id))
+    with open(os.path.join(run_dir, "results", "size.txt"), "w") as size_file:
+        size_file.write(str(task_id * 10))
+    return run_dir
+
+
+def pack_run(task_id):
+    RunArchive(os.path.join(OUTPUT_DIR, "archives"), 100).pack(task_id, write_run(task_id))
+
+
+def count_files(run_dir):
+    return {"files": sum(len(files) for path, dirs, files in os.walk(run_dir))}
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        if os.path.exists(OUTPUT_DIR):
+            shutil.rmtree(OUTPUT_DIR)
+        os.mkdir(OUTPUT_DIR)
+        self.archive_dir = os.path.join(OUTPUT_DIR, "archives")
+
+    def test_pack(self):
+        archive = RunArchive(self.archive_dir, runs_per_archive=2)
+        for task_id in (1, 2, 3):
+            archive.pack(task_id, write_run(task_id))
+            self.assertFalse(os.path.exists(os.path.join(OUTPUT_DIR, str(task_id))))
+        self.assertEqual(sorted(os.listdir(self.archive_dir)), ["0.tar", "0.tar.idx", "1.tar", "1.tar.idx"])
+
+        reader = RunArchive(self.archive_dir, runs_per_archive=2)
+        self.assertTrue(reader.contains(3))
+        self.assertFalse(reader.contains(4))
+        self.assertEqual(sorted(reader.names(2)), ["log.txt", os.path.join("results", "size.txt")])
+        self.assertEqual(reader.read(3, "results/size.txt"), b"30")
+        with self.assertRaises(KeyError):
+            reader.read(3, "missing.txt")
+        with self.assertRaises(KeyError):
+            reader.names(4)
+
+        extract_dir = os.path.join(OUTPUT_DIR, "extracted")
+        reader.extract(2, extract_dir)
+        with open(os.path.join(extract_dir, "results", "size.txt")) as size_file:
+            self.assertEqual(size_file.read(), "20")
+
+        # A packer killed part way leaves data past the indexed end, which the next one overwrites
+        with open(os.path.join(self.archive_dir, "1.tar"), "ab") as archive_file:
+            archive_file.write(b"partial" * 1000)
+        run_dir = write_run(2)
+        with open(os.path.join(run_dir, "log.txt"), "w") as log_file:
+            log_file.write("rerun\n")
+        archive.pack(2, run_dir)
+        self.assertEqual(reader.read(2, "log.txt"), b"rerun\n")
+        self.assertEqual(reader.read(3, "results/size.txt"), b"30")
+        with tarfile.open(os.path.join(self.archive_dir, "1.tar")) as tar:
+            self.assertIn("3/results/size.txt", tar.getnames())
+
+        # Packing carries on from the last complete record of the index, however little is read at a time
+        archive_path = os.path.join(self.archive_dir, "1.tar")
+        end = max(record["end"] for record in archive._read_index(archive_path))
+        with open(archive_path + ".idx", "ab") as index_file:
+            index_file.write(b'{"id":3,"sta')
+        self.assertEqual(archive._indexed_end(archive_path), end)
+        self.assertEqual(archive._indexed_end(archive_path, chunk_size=8), end)
+        self.assertEqual(archive._indexed_end(os.path.join(self.archive_dir, "5.tar")), 0)
+
+    def test_concurrent_packing(self):
+        pool = multiprocessing.Pool(4)
+        try:
+            pool.map(pack_run, range(40), chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        archive = RunArchive(self.archive_dir, 100)
+        for task_id in range(40):
+            self.assertEqual(archive.read(task_id, "log.txt"), "simulation {}\n".format(task_id).encode("utf-8"))
+
+    def test_sweeps(self):
+        p = {'a': [1, 2, 3], 'b': [1, 2]}
+        sweeper = ParamSweeper()
+        sweeper.runs_per_archive = 4
+
+        local_dir = os.path.join(OUTPUT_DIR, "local")
+        sweeper.perform_parallel_sweep(local_dir, "chastesweep/test/test_params.sh", p, num_processes=3)
+        self.assertEqual(sorted(os.listdir(local_dir)), ["archives", "ledger.jsonl"])
+        archive = sweeper.get_run_archive(local_dir)
+        self.assertEqual(archive.names(5), ["testout.txt"])
+        table = aggregate(local_dir, count_files, parameters=sweeper.expand_parameters(p), archive=archive)
+        self.assertEqual(table["files"].tolist(), [1] * 6)
+
+        # Resuming doesn't rerun simulations that were packed
+        exit_codes = sweeper.perform_parallel_sweep(local_dir, "chastesweep/test/test_params.sh", p, resume=True)
+        self.assertEqual(exit_codes, [None] * 6)
+
+        batch_dir = os.path.join(OUTPUT_DIR, "batch")
+        sweeper.generate_batch_output(batch_dir, "chastesweep/test/test_params.sh", p, tasks_per_job=3)
+        sweep = BatchSweep(batch_dir)
+        self.assertEqual([run_array_job(sweep, array_index) for array_index in (1, 2)], [0, 0])
+        sweep.close()
+        self.assertFalse(os.path.exists(os.path.join(batch_dir, "1")))
+        self.assertEqual(sorted(os.listdir(os.path.join(batch_dir, "archives"))),
+                         ["0.tar", "0.tar.idx", "1.tar", "1.tar.idx"])
+        self.assertEqual(aggregate(batch_dir, count_files)["id"].tolist(), list(range(1, 7)))
@@ -0,0 +1,112 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.cache import ResultCache, cache_key, executable_hash
+from chastesweep.util.ledger import Ledger
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.test_dir = "/tmp/test_cache"
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.mkdir(self.test_dir)
+        self.cache_dir = os.path.join(self.test_dir, "cache")
+
+    def make_output(self, name, size):
+        output_dir = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.join(output_dir, "sub"))
+        with open(os.path.join(output_dir, "sub", "result.txt"), "w") as result_file:
+            result_file.write("x" * size)
+        return output_dir
+
+    def test_key(self):
+        exec_hash = executable_hash("chastesweep/test/test_params.sh")
+        key = cache_key(exec_hash, {"a": 0.5, "b": 2}, 0)
+        self.assertEqual(key, cache_key(exec_hash, {"b": np.int64(2), "a": np.float64(0.5)}, 0))
+        self.assertNotEqual(key, cache_key(exec_hash, {"a": 0.5, "b": 2}, 1))
+        self.assertNotEqual(key, cache_key(exec_hash, {"a": 0.5, "b": 3}, 0))
+        self.assertNotEqual(key, cache_key("0" * 64, {"a": 0.5, "b": 2}, 0))
+
+    def test_store_and_lookup(self):
+        cache = ResultCache(self.cache_dir)
+        output_dir = self.make_output("run0", 10)
+        cache.store("ab" * 32, output_dir)
+
+        dest = os.path.join(self.test_dir, "dest")
+        os.mkdir(dest)
+        self.assertTrue(cache.lookup("ab" * 32, dest))
+        with open(os.path.join(dest, "sub", "result.txt")) as result_file:
+            self.assertEqual(result_file.read(), "x" * 10)
+        self.assertFalse(cache.lookup("cd" * 32, dest))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.size(), 10)
+
+    def test_lru_eviction(self):
+        cache = ResultCache(self.cache_dir, max_bytes=250, link=False)
+        for i, key in enumerate(["a" * 64, "b" * 64]):
+            cache.store(key, self.make_output("run{}".format(i), 100))
+            os.utime(os.path.join(self.cache_dir, key[:2], key), (1000 + i, 1000 + i))
+
+        # Using the oldest entry makes the other one the least recently used
+        dest = os.path.join(self.test_dir, "dest")
+        os.mkdir(dest)
+        self.assertTrue(cache.lookup("a" * 64, dest))
+
+        cache.store("c" * 64, self.make_output("run2", 100))
+        keys = sorted(os.path.basename(path) for last_used, size, path in cache.entries())
+        self.assertEqual(keys, ["a" * 64, "c" * 64])
+
+    def test_running_total(self):
+        listed = []
+
+        class CountingCache(ResultCache):
+            def entries(self):
+                listed.append(1)
+                return ResultCache.entries(self)
+
+        cache = CountingCache(self.cache_dir, max_bytes=250, link=False)
+        for i in range(2):
+            cache.store("{}".format(i) * 64, self.make_output("run{}".format(i), 100))
+        # The total is counted from the entries when the size file is created, and only added to after
+        self.assertEqual(len(listed), 1)
+        with open(os.path.join(self.cache_dir, "size")) as size_file:
+            self.assertEqual(size_file.read(), "200")
+
+        # A store taking the cache beyond max_bytes lists the entries to evict the oldest
+        os.utime(os.path.join(self.cache_dir, "00", "0" * 64), (1000, 1000))
+        cache.store("2" * 64, self.make_output("run2", 100))
+        self.assertEqual(len(listed), 2)
+        self.assertEqual(cache.size(), 200)
+        with open(os.path.join(self.cache_dir, "size")) as size_file:
+            self.assertEqual(size_file.read(), "200")
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "00", "0" * 64)))
+
+    def test_cached_sweep(self):
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        sweeper = ParamSweeper()
+        exec_cmd = "chastesweep/test/test_params.sh"
+        cache = ResultCache(self.cache_dir)
+
+        first_dir = os.path.join(self.test_dir, "first")
+        self.assertEqual(sweeper.perform_serial_sweep(first_dir, exec_cmd, p, default_repeats=2, cache=cache), [0] * 10)
+        self.assertEqual((cache.hits, cache.misses), (0, 10))
+
+        # A refined sweep only runs the new points
+        p['a'] = np.linspace(0, 10, 9)
+        second_dir = os.path.join(self.test_dir, "second")
+        cache = ResultCache(self.cache_dir)
+        sweeper.perform_parallel_sweep(second_dir, exec_cmd, p, default_repeats=2, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (10, 8))
+        for i in range(18):
+            self.assertTrue(os.path.exists(os.path.join(second_dir, str(i), "testout.txt")))
+
+        records = Ledger(os.path.join(second_dir, sweeper.ledger_file_name)).read()
+        self.assertTrue(records[0].get("cached"))
+        self.assertFalse(records[2].get("cached"))
@@ -0,0 +1,65 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.catalogue import Catalogue, main
+from chastesweep.util.ledger import Ledger, DONE, FAILED
+
+
+class TestCatalogue(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_catalogue"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def test_local_sweep(self):
+        p = {'a': np.linspace(0, 10, 5), 'b': [1, 2]}
+        sweeper = ParamSweeper()
+        sweeper.perform_serial_sweep(self.output_dir, "chastesweep/test/test_params.sh", p, default_repeats=2,
+                                     catalogue=True)
+        catalogue = Catalogue(os.path.join(self.output_dir, "sweep.db"))
+        self.assertEqual(len(catalogue), 20)
+        self.assertEqual(sorted(catalogue.param_names), ["a", "b"])
+
+        rows = catalogue.lookup(a=2.5, b=2)
+        self.assertEqual([(row["repeat_index"], row["status"]) for row in rows], [(0, DONE), (1, DONE)])
+        self.assertEqual(rows[0]["output_dir"], os.path.join(self.output_dir, str(rows[0]["id"])))
+        self.assertTrue(os.path.exists(os.path.join(rows[0]["output_dir"], "testout.txt")))
+        self.assertEqual(len(catalogue.query("a >= ? AND status = ?", (5, DONE))), 12)
+
+        # Indexed, so a lookup by parameter doesn't scan the table
+        plan = catalogue._connection.execute("EXPLAIN QUERY PLAN SELECT * FROM tasks WHERE a = 2.5").fetchall()
+        self.assertIn("INDEX", " ".join(str(tuple(row)) for row in plan))
+
+        with self.assertRaises(KeyError):
+            catalogue.lookup(c=1)
+        with self.assertRaises(ValueError):
+            catalogue.add_tasks([(100, {"status": 1}, 0, "")])
+        catalogue.close()
+
+    def test_batch_sweep(self):
+        p = {'a': [1, 2, 3], 'c': [10, 14, 20], 'v': [[1, 2]]}
+        sweeper = ParamSweeper()
+        sweeper.generate_batch_output(self.output_dir, "chastesweep/test/test_params.sh", p,
+                                      params_format=ParamSweeper.PARAMS_INDEXED, max_array_size=4, catalogue=True)
+        catalogue = Catalogue(os.path.join(self.output_dir, "sweep.db"))
+        self.assertEqual([row["id"] for row in catalogue.query()], list(range(1, 10)))
+        self.assertEqual(catalogue.query("id = 1")[0]["v"], "[1, 2]")
+        self.assertEqual(catalogue.query("status IS NOT NULL"), [])
+
+        # The array jobs only write the ledger, the catalogue is updated from it
+        ledger = Ledger(os.path.join(self.output_dir, "ledger.jsonl"))
+        for task_id in range(1, 10):
+            ledger.started(task_id)
+            ledger.finished(task_id, 1 if catalogue.query("id = ?", (task_id,))[0]["c"] >= 14 else 0)
+        self.assertEqual(main(["chastesweep_catalogue", self.output_dir, "--where", "c >= 14 AND status = 'failed'"]),
+                         0)
+        failed = catalogue.query("c >= 14 AND status = ?", (FAILED,))
+        self.assertEqual(len(failed), 6)
+        self.assertEqual(failed[0]["host"], ledger.host)
+        self.assertEqual(main(["chastesweep_catalogue", self.output_dir, "--where", "nonsense >"]), 2)
+        catalogue.close()
@@ -0,0 +1,103 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.costmodel import CostModel, pack_tasks, predict_costs
+from chastesweep.util.jobmap import JobMap
+from chastesweep.util.ledger import Ledger
+from chastesweep.util.runner import BatchSweep
+
+
+class TestCostModel(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_costmodel"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+    def test_pack_tasks(self):
+        costs = [8.0, 1.0, 1.0, 1.0, 1.0, 6.0, 5.0, 5.0, 3.0, 2.0, 2.0, 1.0]
+        jobs = pack_tasks(list(range(1, 13)), costs, 3)
+        self.assertEqual(sorted(task_id for job in jobs for task_id in job), list(range(1, 13)))
+        loads = [sum(costs[task_id - 1] for task_id in job) for job in jobs]
+        self.assertEqual(sorted(loads), [12.0, 12.0, 12.0])
+        # The most costly simulation of each job comes first
+        self.assertEqual(jobs[0][0], 1)
+
+        # No more jobs than simulations
+        self.assertEqual(pack_tasks([5, 6], [1.0, 2.0], 4), [[6], [5]])
+
+    def test_fit(self):
+        # Run time grows with the square of the mesh size, and is unaffected by the label
+        samples = [({"mesh": n, "label": "x"}, 0.5 * n ** 2) for n in [2, 4, 8, 16]]
+        model = CostModel(samples)
+        self.assertAlmostEqual(model({"mesh": 32, "label": "y"}), 0.5 * 32 ** 2, delta=1.0)
+        self.assertAlmostEqual(model({"mesh": 4, "label": "x"}), 8.0)
+
+        # Parameter sets seen before are predicted by their mean time
+        model = CostModel([({"a": 1}, 2.0), ({"a": 1}, 4.0), ({"a": 2}, 10.0)])
+        self.assertAlmostEqual(model({"a": 1}), 3.0)
+        self.assertGreater(model({"b": "unknown"}), 0.0)
+
+        with self.assertRaises(ValueError):
+            CostModel([])
+
+    def test_packed_batch_output(self):
+        p = {'a': np.linspace(0, 10, 5), 'b': [1, 2]}
+        cost = lambda params: 10.0 if params['b'] == 2 else 1.0
+        sweeper = ParamSweeper()
+        sweeper.generate_batch_output(output_dir=self.output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      default_repeats=2,
+                                      params_format=ParamSweeper.PARAMS_INDEXED,
+                                      tasks_per_job=4,
+                                      cost_model=cost)
+
+        with open(os.path.join(self.output_dir, "batch.sge.sh")) as batch_file:
+            batch_script = batch_file.read()
+        self.assertIn("#$ -t 1-5", batch_script)
+        self.assertIn("runsimulation.py $SGE_TASK_ID --job-map sweep.jobs", batch_script)
+
+        expanded = sweeper.expand_parameters(p, default_repeats=2)
+        costs = predict_costs(cost, expanded)
+        job_map = JobMap(os.path.join(self.output_dir, "sweep.jobs"))
+        self.assertEqual(len(job_map), 5)
+        self.assertEqual(sorted(sum(costs[task_id - 1] for task_id in job_map[job]) for job in range(5)),
+                         [22.0] * 5)
+        job_map.close()
+
+        # Each shard of a sharded sweep is packed on its own
+        shard_dir = os.path.join(self.output_dir, "sharded")
+        sweeper.generate_batch_output(output_dir=shard_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      default_repeats=2,
+                                      params_format=ParamSweeper.PARAMS_INDEXED,
+                                      tasks_per_job=2,
+                                      max_array_size=4,
+                                      cost_model=cost)
+        with open(os.path.join(shard_dir, "batch.1.sge.sh")) as batch_file:
+            self.assertIn("--job-map sweep.1.jobs", batch_file.read())
+        shard_loads = []
+        for shard, first_task in enumerate((1, 9, 17)):
+            job_map = JobMap(os.path.join(shard_dir, "sweep.{}.jobs".format(shard)))
+            task_ids = sorted(task_id for job in range(len(job_map)) for task_id in job_map[job])
+            self.assertEqual(task_ids, list(range(first_task, min(first_task + 8, 21))))
+            shard_loads.append(sorted(sum(costs[task_id - 1] for task_id in job_map[job])
+                                      for job in range(len(job_map))))
+            job_map.close()
+        self.assertEqual(shard_loads, [[11.0] * 4, [11.0] * 4, [11.0] * 2])
+
+        # Fit a model to the wall times recorded when running the sweep
+        sweep = BatchSweep(self.output_dir)
+        ledger = Ledger(sweep.ledger_path)
+        for task_id in range(1, sweep.num_tasks + 1):
+            ledger.append({"id": task_id, "status": "done", "exit_code": 0, "wall": cost(sweep.params(task_id))})
+        sweep.close()
+        model = CostModel.from_sweep(self.output_dir)
+        self.assertAlmostEqual(model(expanded[0]), 1.0)
+        self.assertAlmostEqual(model(expanded[3]), 10.0)
@@ -0,0 +1,43 @@
+from __future__ import print_function
+import unittest
+import os
+import time
+import shutil
+
+from chastesweep.util.executor import build_command, run_parallel
+
+
+class TestExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_executor"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+
+    def test_build_command(self):
+        cmd = build_command("/bin/sim", "/tmp/out/0", {"a": 1.5})
+        self.assertEqual(cmd, "/bin/sim output_dir=/tmp/out/0 a=1.5")
+
+    def test_run_parallel(self):
+        commands = [(i, "exit {}".format(i % 3)) for i in range(10)]
+        exit_codes = run_parallel(commands, num_processes=3)
+        self.assertEqual(exit_codes, dict((i, i % 3) for i in range(10)))
+
+        with self.assertRaises(ValueError):
+            run_parallel(commands, num_processes=0)
+
+    def test_interrupt_terminates_children(self):
+        marker = os.path.join(self.output_dir, "finished")
+
+        def commands():
+            yield 0, "sleep 1; touch {}".format(marker)
+            raise KeyboardInterrupt()
+
+        start = time.time()
+        with self.assertRaises(KeyboardInterrupt):
+            run_parallel(commands(), num_processes=2)
+        self.assertLess(time.time() - start, 1)
+
+        time.sleep(1.5)
+        self.assertFalse(os.path.exists(marker))
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+
+from chastesweep import ParamSweeper
+from chastesweep.util.aggregate import aggregate
+from chastesweep.util.layout import OutputLayout, FLAT
+from chastesweep.util.runner import BatchSweep, run_array_job
+
+
+class TestLayout(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_layout"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+
+    def test_paths(self):
+        layout = OutputLayout(fan_out=100, levels=2)
+        self.assertEqual(layout.relative_path(123456), os.path.join("12", "34", "123456"))
+        self.assertEqual(layout.relative_path(7), os.path.join("0", "0", "7"))
+        self.assertEqual(layout.path("/sweep", 1234567), "/sweep/123/45/1234567")
+        self.assertEqual(FLAT.path("/sweep", 12), "/sweep/12")
+        self.assertEqual(OutputLayout(fan_out=10, levels=1).relative_path(123), os.path.join("12", "123"))
+
+        for task_id in (0, 99, 100, 123456, 10 ** 7):
+            self.assertEqual(layout.task_id(layout.path("/sweep", task_id)), task_id)
+            self.assertEqual(layout.task_id(layout.relative_path(task_id)), task_id)
+        for path in ("/sweep/12/35/123456", "/sweep/123456", "/sweep/12/34/results"):
+            with self.assertRaises(ValueError):
+                layout.task_id(path)
+
+        self.assertEqual(OutputLayout(**layout.settings()).settings(), layout.settings())
+        with self.assertRaises(ValueError):
+            OutputLayout(fan_out=1)
+
+    def test_sweeps(self):
+        p = {'a': range(12), 'b': [1, 2]}
+        layout = OutputLayout(fan_out=4, levels=2)
+        sweeper = ParamSweeper()
+        sweeper.output_layout = layout
+
+        local_dir = os.path.join(self.output_dir, "local")
+        self.assertEqual(sweeper.perform_parallel_sweep(local_dir, "chastesweep/test/test_params.sh", p,
+                                                        num_processes=4), [0] * 24)
+        self.assertTrue(os.path.exists(os.path.join(local_dir, "1", "1", "23", "testout.txt")))
+        self.assertEqual(sorted(name for name in os.listdir(local_dir) if name.isdigit()), ["0", "1"])
+        self.assertEqual([task_id for task_id, path in layout.task_dirs(local_dir)], list(range(24)))
+
+        # The runner reads the layout from params.json, as do the post-processing helpers
+        batch_dir = os.path.join(self.output_dir, "batch")
+        sweeper.generate_batch_output(batch_dir, "chastesweep/test/test_params.sh", p)
+        sweep = BatchSweep(batch_dir)
+        self.assertEqual(sweep.layout.settings(), layout.settings())
+        for array_index in range(1, 25):
+            self.assertEqual(run_array_job(sweep, array_index), 0)
+        sweep.close()
+        self.assertEqual([path for task_id, path in layout.task_dirs(batch_dir)][-1],
+                         os.path.join(batch_dir, "1", "2", "24"))
+
+        def read_output(run_dir):
+            return {"size": len(os.listdir(run_dir))}
+
+        table = aggregate(batch_dir, read_output)
+        self.assertEqual(table["id"].tolist(), list(range(1, 25)))
+        self.assertEqual(table["size"].tolist(), [1] * 24)
@@ -0,0 +1,65 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+
+from chastesweep.util.ledger import Ledger, STARTED, DONE, FAILED
+from chastesweep.util.jobmap import JobMap, JobMapError, write_job_map
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_ledger"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+        self.path = os.path.join(self.output_dir, "ledger.jsonl")
+
+    def test_status(self):
+        ledger = Ledger(self.path)
+        self.assertEqual(ledger.read(), {})
+
+        for i in range(4):
+            ledger.started(i)
+        ledger.finished(0, 0)
+        ledger.finished(1, 3)
+        ledger.finished(2, 0)
+
+        latest = Ledger(self.path).read()
+        self.assertEqual(latest[0]["status"], DONE)
+        self.assertEqual(latest[1]["status"], FAILED)
+        self.assertEqual(latest[1]["exit_code"], 3)
+        self.assertEqual(latest[3]["status"], STARTED)
+        self.assertGreaterEqual(latest[2]["wall"], 0)
+        self.assertEqual(ledger.completed(), set([0, 2]))
+
+        # A failed simulation that is rerun successfully becomes completed
+        ledger.started(1)
+        ledger.finished(1, 0)
+        self.assertEqual(ledger.completed(), set([0, 1, 2]))
+
+    def test_truncated_record(self):
+        ledger = Ledger(self.path)
+        ledger.started(0)
+        ledger.finished(0, 0)
+        with open(self.path, "a") as ledger_file:
+            ledger_file.write('{"id": 1, "sta')
+        self.assertEqual(ledger.completed(), set([0]))
+
+    def test_job_map(self):
+        path = os.path.join(self.output_dir, "jobs")
+        write_job_map(path, [[1, 2, 3], [7], [10, 12]])
+        job_map = JobMap(path)
+        self.assertEqual(len(job_map), 3)
+        self.assertEqual(job_map[0], [1, 2, 3])
+        self.assertEqual(job_map[1], [7])
+        self.assertEqual(job_map[2], [10, 12])
+        with self.assertRaises(IndexError):
+            job_map[3]
+        job_map.close()
+
+        with open(path, "wb") as job_map_file:
+            job_map_file.write(b"not a job map")
+        with self.assertRaises(JobMapError):
+            JobMap(path)
@@ -35,9 +35,14 @@ import numpy as np
 import json
 import os
 import shutil
+import sys
+import subprocess
 
 from chastesweep import ParamSweeper
-from chastesweep.util.pscan import JointParameterListSizeError
+from chastesweep.util.pscan import JointParameterListSizeError, Scan, vectorised
+from chastesweep.util.ledger import Ledger
+from chastesweep.util.paramstore import json_default
+from chastesweep.util.runner import BatchSweep
 
 
 class TestParameterSweeper(unittest.TestCase):
@@ -98,6 +103,41 @@ class TestParameterSweeper(unittest.TestCase):
         expanded_params = sweeper.expand_parameters(parameters=p, count_funcs=count_funcs)
         self.assertEqual(len(expanded_params), 150)
 
+    def test_columnar_expansion(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+        p['c'] = [10, 20, 30]
+
+        sweeper = ParamSweeper()
+
+        table = sweeper.expand_parameters(parameters=p, default_repeats=2, columnar=True)
+        self.assertEqual(len(table), 150)
+        self.assertEqual(table.num_combinations(), 75)
+        self.assertEqual(table.to_records(), sweeper.expand_parameters(parameters=p, default_repeats=2))
+
+        # Already expanded tables are accepted in place of the parameters
+        self.assertIs(sweeper.get_expanded_parameters(table), table)
+
+        # Constraints leave combinations out before expanding
+        constraints = [lambda p: p['a'] > p['b'] * 20]
+        expanded = sweeper.expand_parameters(parameters=p, default_repeats=2, constraints=constraints)
+        self.assertEqual(expanded, [params for params in sweeper.expand_parameters(parameters=p, default_repeats=2)
+                                    if params['a'] > params['b'] * 20])
+        self.assertEqual(sweeper.expand_parameters(parameters=p, default_repeats=2, columnar=True,
+                                                   constraints=constraints).to_records(), expanded)
+
+        output_dir = "/tmp/myoutdir_columnar"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        sweeper.generate_batch_output(output_dir=output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=table)
+        with open(os.path.join(output_dir, sweeper.params_file_name), "r") as out_file:
+            self.assertEqual(len(json.load(out_file)["params"]), 150)
+
     def test_batch_generation(self):
 
         p = {}
@@ -144,6 +184,135 @@ class TestParameterSweeper(unittest.TestCase):
         self.assertTrue(os.path.exists(os.path.join(output_dir, sweeper.slurm_batch_file_name)))
         self.assertTrue(os.path.exists(os.path.join(output_dir, sweeper.python_sim_runner_file_name)))
 
+    def test_indexed_batch_generation(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.arange(5)
+
+        sweeper = ParamSweeper()
+        output_dir = "/tmp/myoutdir_indexed"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        sweeper.generate_batch_output(output_dir=output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      params_format=ParamSweeper.PARAMS_INDEXED)
+
+        self.assertTrue(os.path.exists(os.path.join(output_dir, sweeper.params_store_file_name)))
+        with open(os.path.join(output_dir, sweeper.params_file_name), "r") as out_file:
+            out_json = json.load(out_file)
+            self.assertNotIn("params", out_json)
+            self.assertEqual(out_json["params_store"], sweeper.params_store_file_name)
+
+        # Run an array task through the generated runner
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.abspath(".")
+        exit_code = subprocess.call([sys.executable, sweeper.python_sim_runner_file_name, "7"], cwd=output_dir, env=env)
+        self.assertEqual(exit_code, 0)
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "7", "testout.txt")))
+
+    def test_streamed_batch_generation(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 1, 20)
+        p['b'] = np.arange(10)
+        p['c'] = ["x", "y"]
+        count_funcs = [vectorised(lambda p: np.where(p['b'] > 6, 3, -1)), lambda p: 1 if p['c'] == "x" else None]
+        constraints = [lambda p: p['a'] < 0.9]
+
+        sweeper = ParamSweeper()
+        output_dir = "/tmp/myoutdir_streamed"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        sweeper.generate_batch_output(output_dir=output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      default_repeats=2,
+                                      count_funcs=count_funcs,
+                                      constraints=constraints)
+
+        expanded = sweeper.expand_parameters(p, default_repeats=2, count_funcs=count_funcs, constraints=constraints)
+        with open(os.path.join(output_dir, sweeper.params_file_name), "r") as out_file:
+            self.assertEqual(json.load(out_file)["params"], json.loads(json.dumps(expanded, default=json_default)))
+        with open(os.path.join(output_dir, sweeper.sge_batch_file_name), "r") as batch_file:
+            self.assertIn("-t 1-{}".format(len(expanded)), batch_file.read())
+
+        scan = Scan(p, default_repeats=2, count_funcs=count_funcs, constraints=constraints)
+        scan.chunk_size = 7
+        self.assertEqual(scan.num_tasks(), len(expanded))
+        self.assertEqual([params for params, repeats in scan.records() for _ in range(repeats)], expanded)
+
+    @unittest.skipIf(sys.version_info < (3, 4), "tracemalloc needs Python 3.4")
+    def test_streamed_batch_generation_memory(self):
+        import tracemalloc
+
+        # Half a million simulations, far more than would fit in the memory limit below as a list of dicts
+        p = {}
+        p['a'] = np.linspace(0, 1, 500)
+        p['b'] = np.arange(100)
+
+        sweeper = ParamSweeper()
+        output_dir = "/tmp/myoutdir_streamed"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        tracemalloc.start()
+        try:
+            sweeper.generate_batch_output(output_dir=output_dir,
+                                          exec_cmd="chastesweep/test/test_params.sh",
+                                          parameters=p,
+                                          default_repeats=10,
+                                          params_format=ParamSweeper.PARAMS_INDEXED)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(peak, 16 * 1024 * 1024)
+
+        with open(os.path.join(output_dir, sweeper.sge_batch_file_name), "r") as batch_file:
+            self.assertIn("-t 1-500000", batch_file.read())
+
+    def test_bundled_batch_generation(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+
+        sweeper = ParamSweeper()
+        output_dir = "/tmp/myoutdir_bundled"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        sweeper.generate_batch_output(output_dir=output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      scheduler=ParamSweeper.SLURM,
+                                      tasks_per_job=10,
+                                      processes_per_job=3)
+
+        with open(os.path.join(output_dir, sweeper.slurm_batch_file_name), "r") as batch_file:
+            self.assertIn("--array=1-3\n", batch_file.read())
+
+        # The last array job runs the remaining 5 simulations
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.abspath(".")
+        exit_code = subprocess.call([sys.executable, sweeper.python_sim_runner_file_name, "3"], cwd=output_dir, env=env)
+        self.assertEqual(exit_code, 0)
+        for i in range(1, 26):
+            self.assertEqual(os.path.exists(os.path.join(output_dir, str(i), "testout.txt")), i > 20)
+
+        # Running it again fails as the outputs already exist
+        exit_code = subprocess.call([sys.executable, sweeper.python_sim_runner_file_name, "3"], cwd=output_dir, env=env)
+        self.assertEqual(exit_code, 1)
+
+        with self.assertRaises(ValueError):
+            sweeper.generate_batch_output(output_dir=output_dir,
+                                          exec_cmd="chastesweep/test/test_params.sh",
+                                          parameters=p,
+                                          tasks_per_job=0)
+
     def test_serial_sweep(self):
 
         p = {}
@@ -164,6 +333,162 @@ class TestParameterSweeper(unittest.TestCase):
         for i in range(25):
             self.assertTrue(os.path.exists("{}/{}/testout.txt".format(output_dir, i)))
 
+        # Serial sweep of an already expanded table
+        shutil.rmtree(output_dir)
+        table = sweeper.expand_parameters(p, columnar=True)
+        self.assertEqual(sweeper.perform_serial_sweep(output_dir, exec_cmd, table), [0] * 25)
+
+        for i in range(25):
+            self.assertTrue(os.path.exists("{}/{}/testout.txt".format(output_dir, i)))
+
+    def test_parallel_sweep(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+
+        # Feed to param sweeper
+        sweeper = ParamSweeper()
+
+        exec_cmd = "chastesweep/test/test_params.sh"
+        output_dir = "/tmp/parallel_sweep"
+
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        exit_codes = sweeper.perform_parallel_sweep(output_dir, exec_cmd, p, num_processes=4)
+
+        self.assertEqual(exit_codes, [0] * 25)
+        for i in range(25):
+            self.assertTrue(os.path.exists("{}/{}/testout.txt".format(output_dir, i)))
+
+        # Existing outputs are not run again
+        exit_codes = sweeper.perform_parallel_sweep(output_dir, exec_cmd, p, num_processes=4)
+        self.assertEqual(exit_codes, [None] * 25)
+
+    def test_repeat_param(self):
+
+        p = {}
+        p['a'] = [1.5, 2.5]
+
+        sweeper = ParamSweeper()
+        output_dir = "/tmp/repeat_param"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        # The test executable writes its arguments to stdout, so record it with an executable of our own
+        exec_cmd = os.path.join("/tmp", "echo_args.sh")
+        with open(exec_cmd, "w") as exec_file:
+            exec_file.write("#!/bin/bash\necho $@ > ${1#\"output_dir=\"}/args.txt\n")
+        os.chmod(exec_cmd, 0o755)
+
+        sweeper.perform_serial_sweep(output_dir, exec_cmd, p, default_repeats=3, repeat_param="seed")
+        for i in range(6):
+            with open(os.path.join(output_dir, str(i), "args.txt")) as args_file:
+                self.assertTrue(args_file.read().strip().endswith("seed={}".format(i % 3)))
+
+        # Batch runner with the compact indexed store
+        output_dir = "/tmp/repeat_param_batch"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        sweeper.generate_batch_output(output_dir=output_dir,
+                                      exec_cmd=exec_cmd,
+                                      parameters=p,
+                                      default_repeats=3,
+                                      params_format=ParamSweeper.PARAMS_INDEXED,
+                                      repeat_param="seed")
+        with open(os.path.join(output_dir, sweeper.params_store_file_name)) as store_file:
+            self.assertEqual(len(store_file.readlines()), 2)
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.abspath(".")
+        self.assertEqual(subprocess.call([sys.executable, sweeper.python_sim_runner_file_name, "5"], cwd=output_dir, env=env), 0)
+        with open(os.path.join(output_dir, "5", "args.txt")) as args_file:
+            args = args_file.read()
+            self.assertIn("a=2.5", args)
+            self.assertTrue(args.strip().endswith("seed=1"))
+
+        # A value listed twice is two parameter sets with repeats of their own, however the sweep is run
+        p = {'a': [1, 1], 'b': [5]}
+        output_dir = "/tmp/repeat_param_duplicates"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        sweeper.perform_serial_sweep(output_dir, exec_cmd, p, default_repeats=2, repeat_param="seed")
+        seeds = []
+        for i in range(4):
+            with open(os.path.join(output_dir, str(i), "args.txt")) as args_file:
+                seeds.append(int(args_file.read().strip().rsplit("seed=", 1)[1]))
+        self.assertEqual(seeds, [0, 1, 0, 1])
+
+        for params_format, max_array_size in ((ParamSweeper.PARAMS_JSON, None), (ParamSweeper.PARAMS_INDEXED, None),
+                                              (ParamSweeper.PARAMS_JSON, 3)):
+            shutil.rmtree(output_dir)
+            sweeper.generate_batch_output(output_dir, exec_cmd, p, default_repeats=2, params_format=params_format,
+                                          repeat_param="seed", max_array_size=max_array_size)
+            sweep = BatchSweep(output_dir)
+            self.assertEqual([sweep.repeat_index(task_id) for task_id in range(1, 5)], [0, 1, 0, 1])
+            sweep.close()
+
+    def test_resume_serial_sweep(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+
+        sweeper = ParamSweeper()
+        exec_cmd = "chastesweep/test/test_params.sh"
+        output_dir = "/tmp/resume_sweep"
+
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        self.assertEqual(sweeper.perform_serial_sweep(output_dir, exec_cmd, p), [0] * 25)
+
+        # Simulate a failed simulation, one killed part way through and one never started
+        ledger = Ledger(os.path.join(output_dir, sweeper.ledger_file_name))
+        ledger.append({"id": 3, "status": "failed", "exit_code": 1})
+        ledger.append({"id": 4, "status": "started"})
+        shutil.rmtree(os.path.join(output_dir, "5"))
+
+        exit_codes = sweeper.perform_parallel_sweep(output_dir, exec_cmd, p, num_processes=2, resume=True)
+        self.assertEqual([i for i, exit_code in enumerate(exit_codes) if exit_code is not None], [3, 4, 5])
+        self.assertEqual(ledger.completed(), set(range(25)))
+
+    def test_resume_batch(self):
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+
+        sweeper = ParamSweeper()
+        output_dir = "/tmp/resume_batch"
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+
+        sweeper.generate_batch_output(output_dir=output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      tasks_per_job=2)
+
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.abspath(".")
+        runner = [sys.executable, sweeper.python_sim_runner_file_name]
+        self.assertEqual(subprocess.call(runner + ["2"], cwd=output_dir, env=env), 0)
+        # Leave an incomplete output behind for simulation 1
+        os.mkdir(os.path.join(output_dir, "1"))
+
+        # Simulations 1, 2 and 5 are left, bundled two per job
+        self.assertEqual(sweeper.generate_resume_batch(output_dir), 3)
+        with open(os.path.join(output_dir, sweeper.sge_resume_file_name), "r") as batch_file:
+            batch = batch_file.read()
+            self.assertIn("-t 1-2\n", batch)
+            self.assertIn("--resume --job-map {}".format(sweeper.resume_job_map_file_name), batch)
+
+        resume_args = ["--resume", "--job-map", sweeper.resume_job_map_file_name]
+        self.assertEqual(subprocess.call(runner + ["1"] + resume_args, cwd=output_dir, env=env), 0)
+        self.assertEqual(subprocess.call(runner + ["2"] + resume_args, cwd=output_dir, env=env), 0)
+        self.assertTrue(os.path.exists(os.path.join(output_dir, "1", "testout.txt")))
+        self.assertEqual(sweeper.generate_resume_batch(output_dir), 0)
+
     def test_main_generation(self):
 
         out_file = "/tmp/test_main.cpp"
@@ -0,0 +1,86 @@
+from __future__ import print_function
+import unittest
+import os
+import shutil
+import numpy as np
+
+import json
+from chastesweep.util.paramstore import ParamStore, ParamStoreWriter, ParamStoreError, write_param_store, INDEX_SUFFIX, \
+    write_params_json
+
+
+class TestParamStore(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_paramstore"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+        self.path = os.path.join(self.output_dir, "params.jsonl")
+
+    def test_round_trip(self):
+        records = [{"a": float(a), "b": int(b), "name": "run\n{}".format(b)}
+                   for a, b in zip(np.linspace(0, 1, 50), np.arange(50))]
+        self.assertEqual(write_param_store(self.path, [(record, 1) for record in records]), 50)
+
+        with ParamStore(self.path) as store:
+            self.assertEqual(len(store), 50)
+            self.assertEqual(store[0], records[0])
+            self.assertEqual(store[37], records[37])
+            self.assertEqual(store[-1], records[-1])
+            self.assertEqual(list(store), records)
+            with self.assertRaises(IndexError):
+                store[50]
+
+        # One line per record
+        with open(self.path) as data_file:
+            self.assertEqual(len(data_file.readlines()), 50)
+
+    def test_repeats(self):
+        records = [({"a": 1}, 3), ({"a": 2}, 1), ({"a": 3}, 0), ({"a": 4}, 2)]
+        self.assertEqual(write_param_store(self.path, records), 6)
+
+        with ParamStore(self.path) as store:
+            self.assertEqual(len(store), 6)
+            self.assertEqual(store.num_records, 4)
+            self.assertEqual([store.locate(i) for i in range(6)],
+                             [(0, 0), (0, 1), (0, 2), (1, 0), (3, 0), (3, 1)])
+            self.assertEqual([record["a"] for record in store], [1, 1, 1, 2, 4, 4])
+            self.assertEqual(store.repeats(2), 0)
+            with self.assertRaises(IndexError):
+                store.locate(6)
+
+        # Each distinct parameter set is stored once
+        with open(self.path) as data_file:
+            self.assertEqual(len(data_file.readlines()), 4)
+
+    def test_params_json(self):
+        path = os.path.join(self.output_dir, "params.json")
+        records = [({"a": np.int64(1)}, 2), ({"a": 2.5}, 0), ({"a": 3}, 1)]
+        self.assertEqual(write_params_json(path, {"exec_cmd": "run.sh", "tasks_per_job": 1}, records), 3)
+        with open(path) as json_file:
+            self.assertEqual(json.load(json_file),
+                             {"exec_cmd": "run.sh", "tasks_per_job": 1, "params": [{"a": 1}, {"a": 1}, {"a": 3}],
+                              "repeats": [2, 0, 1]})
+
+        write_params_json(path, {}, [])
+        with open(path) as json_file:
+            self.assertEqual(json.load(json_file), {"params": [], "repeats": []})
+
+    def test_numpy_values(self):
+        with ParamStoreWriter(self.path) as writer:
+            writer.append({"a": np.int64(3), "b": np.float64(0.5)})
+        with ParamStore(self.path) as store:
+            self.assertEqual(store[0], {"a": 3, "b": 0.5})
+
+    def test_empty_store(self):
+        write_param_store(self.path, [])
+        with ParamStore(self.path) as store:
+            self.assertEqual(len(store), 0)
+
+    def test_invalid_index(self):
+        write_param_store(self.path, [({"a": 1}, 1)])
+        with open(self.path + INDEX_SUFFIX, "wb") as index_file:
+            index_file.write(b"not an index")
+        with self.assertRaises(ParamStoreError):
+            ParamStore(self.path)
@@ -0,0 +1,120 @@
+from __future__ import print_function
+import unittest
+import os
+import time
+import shutil
+import signal
+
+from chastesweep import ParamSweeper
+from chastesweep.util.executor import run_serial, run_parallel
+from chastesweep.util.ledger import Ledger, DONE, FAILED, SKIPPED
+from chastesweep.util.policy import ExecutionPolicy, CircuitBreaker
+from chastesweep.util.runner import BatchSweep, run_array_job
+
+
+class TestPolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_policy"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+
+    def test_policy(self):
+        policy = ExecutionPolicy(retries=2, backoff=1.0, max_backoff=1.5, retry_exit_codes=[3])
+        self.assertEqual([policy.retry_delay(3, attempt) for attempt in (1, 2, 3)], [1.0, 1.5, None])
+        self.assertIsNone(policy.retry_delay(0, 1))
+        self.assertIsNone(policy.retry_delay(4, 1))
+        self.assertIsNone(policy.circuit_breaker())
+        self.assertEqual(ExecutionPolicy(**policy.settings()).settings(), policy.settings())
+
+        breaker = CircuitBreaker(0.5, 4)
+        for failed in (True, True, True):
+            breaker.record(failed)
+        # Not until the window is full
+        self.assertFalse(breaker.tripped)
+        breaker.record(False)
+        self.assertTrue(breaker.tripped)
+        self.assertEqual(breaker.failure_rate(), 0.75)
+
+        with self.assertRaises(ValueError):
+            ExecutionPolicy(failure_threshold=1.0)
+
+    def test_timeout_and_retries(self):
+        marker = os.path.join(self.output_dir, "marker{}")
+        # Fails the first time it is run
+        flaky = "test -e {0} || (touch {0}; exit 3)"
+        commands = [(0, "sleep 10"), (1, flaky.format(marker.format(1))), (2, "exit 4")]
+        retried = []
+
+        def retry(task_id, exit_code, usage):
+            retried.append((task_id, exit_code))
+            return 0.01 if len([r for r in retried if r[0] == task_id]) == 1 else None
+
+        for run in (run_serial, run_parallel):
+            retried = []
+            if os.path.exists(marker.format(1)):
+                os.remove(marker.format(1))
+            start_time = time.time()
+            exit_codes = run(commands, timeout=0.5, retry=retry)
+            self.assertLess(time.time() - start_time, 5)
+            self.assertEqual(exit_codes, {0: -signal.SIGTERM, 1: 0, 2: 4})
+            self.assertEqual(sorted(retried), [(0, -signal.SIGTERM), (0, -signal.SIGTERM), (1, 3), (2, 4), (2, 4)])
+
+    def test_local_sweep(self):
+        script = os.path.join(self.output_dir, "flaky.sh")
+        with open(script, "w") as script_file:
+            script_file.write("#!/bin/sh\ntest -e {0} && exit 0\ntouch {0}\nexit 3\n"
+                              .format(os.path.join(self.output_dir, "marker")))
+        os.chmod(script, 0o755)
+
+        sweep_dir = os.path.join(self.output_dir, "retried")
+        exit_codes = ParamSweeper().perform_parallel_sweep(sweep_dir, script, {'a': [1, 2]}, num_processes=1,
+                                                           policy=ExecutionPolicy(retries=1, backoff=0.01))
+        self.assertEqual(exit_codes, [0, 0])
+        ledger = Ledger(os.path.join(sweep_dir, "ledger.jsonl"))
+        self.assertEqual([record["status"] for record in ledger.records() if record["id"] == 0],
+                         ["started", FAILED, "started", DONE])
+
+        # Every simulation fails, the sweep stops once 3 of the last 4 have
+        sweep_dir = os.path.join(self.output_dir, "broken")
+        exit_codes = ParamSweeper().perform_serial_sweep(sweep_dir, "/bin/false", {'a': range(10)},
+                                                         policy=ExecutionPolicy(failure_threshold=0.5, window=4))
+        self.assertEqual(exit_codes, [1] * 4 + [None] * 6)
+        records = Ledger(os.path.join(sweep_dir, "ledger.jsonl")).read()
+        self.assertEqual([records[i]["status"] for i in range(10)], [FAILED] * 4 + [SKIPPED] * 6)
+        self.assertFalse(os.path.exists(os.path.join(sweep_dir, "4")))
+
+    def test_batch_sweep(self):
+        sweeper = ParamSweeper()
+        sweeper.generate_batch_output(self.output_dir, "/bin/false", {'a': range(6)},
+                                      policy=ExecutionPolicy(failure_threshold=0.5, window=4))
+        sweep = BatchSweep(self.output_dir)
+        self.assertEqual(sweep.policy_settings["window"], 4)
+
+        # The array jobs still to start once the breaker trips skip their simulations
+        self.assertEqual([run_array_job(sweep, i) for i in range(1, 7)], [1] * 6)
+        records = Ledger(sweep.ledger_path).read()
+        self.assertEqual([records[i]["status"] for i in range(1, 7)], [FAILED] * 4 + [SKIPPED] * 2)
+        self.assertEqual(Ledger(sweep.ledger_path).tail(2), [records[5], records[6]])
+        sweep.close()
+
+    def test_retried_batch_sweep(self):
+        # Every simulation fails the first time it is run
+        script = os.path.join(self.output_dir, "flaky.sh")
+        with open(script, "w") as script_file:
+            script_file.write("#!/bin/sh\nmarker={}/$(basename ${{1#output_dir=}})\n"
+                              "test -e $marker && exit 0\ntouch $marker\nexit 3\n".format(self.output_dir))
+        os.chmod(script, 0o755)
+
+        sweep_dir = os.path.join(self.output_dir, "sweep")
+        ParamSweeper().generate_batch_output(sweep_dir, script, {'a': range(6)},
+                                             policy=ExecutionPolicy(retries=1, backoff=0.01, failure_threshold=0.25,
+                                                                    window=4))
+        sweep = BatchSweep(sweep_dir)
+        # The retried failures at the end of the ledger don't trip the breaker of the array jobs after
+        self.assertEqual([run_array_job(sweep, i) for i in range(1, 7)], [0] * 6)
+        records = list(Ledger(sweep.ledger_path).records())
+        self.assertEqual(len([record for record in records if record["status"] == FAILED and record["retry"]]), 6)
+        self.assertEqual([record["status"] for record in Ledger(sweep.ledger_path).read().values()], [DONE] * 6)
+        sweep.close()
@@ -1,7 +1,8 @@
 from __future__ import print_function
 import unittest
 import numpy as np
-from chastesweep.util.pscan import Scan
+from chastesweep.util.pscan import Scan, vectorised
+from chastesweep.util.paramtable import compact_records, repeat_indices, shard_records
 
 
 class TestScan(unittest.TestCase):
@@ -54,3 +55,192 @@ class TestScan(unittest.TestCase):
         for i in range(num_expanded):
             for j in range(num_vars):
                 self.assertAlmostEqual(ans[i][j], output[i][j])
+
+    def test_random_access(self):
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+        p['c'] = np.linspace(10, 20, 3)
+
+        s = Scan(p, joint_lists=[['a', 'b']], count_funcs=[lambda p: 2, lambda p: 1 if p['c'] >= 14 else None])
+        expected = list(s.params())
+        self.assertEqual(len(s), 20)
+        self.assertEqual(len(s), len(expected))
+        for i in range(len(s)):
+            self.assertEqual(s[i], expected[i])
+
+        self.assertEqual(s.locate(0), (0, 0))
+        self.assertEqual(s.locate(1), (0, 1))
+        self.assertEqual(s.locate(10), (5, 0))
+        self.assertEqual(s[-1], expected[-1])
+        self.assertEqual(s[3:12:2], expected[3:12:2])
+        with self.assertRaises(IndexError):
+            s[20]
+
+        # Without count functions the index is computed arithmetically
+        s = Scan(p, default_repeats=3)
+        expected = list(s.params())
+        self.assertEqual(len(s), 225)
+        self.assertEqual(s[::7], expected[::7])
+
+        # Changing the scan invalidates the index
+        s.add_count(lambda p: 1)
+        self.assertEqual(len(s), 75)
+        s.add_params({'d': [1, 2]})
+        self.assertEqual(len(s), 150)
+
+    def test_sliced_params(self):
+        p = {}
+        p['a'] = [1, 2, 3]
+        p['b'] = ['x', 'y']
+        p['c'] = [0.5, 1.5, 2.5, 3.5]
+        p['d'] = [10, 20, 30, 40]
+
+        s = Scan(p, joint_lists=[['c', 'd']], count_funcs=[lambda p: 2 if p['b'] == 'y' else None])
+        # The odometer walk matches random access, including across carries
+        expected = [s[i] for i in range(len(s))]
+        self.assertEqual(list(s.params()), expected)
+        self.assertEqual(list(s.params(5)), expected[5:])
+        self.assertEqual(list(s.params(7, 30)), expected[7:30])
+        self.assertEqual(list(s.params(-4)), expected[-4:])
+        self.assertEqual(list(s.params(3, 40, 5)), expected[3:40:5])
+        self.assertEqual(list(s.params(step=-3)), expected[::-3])
+        self.assertEqual(list(s.params(30, 10)), [])
+        self.assertEqual(s[11:19], expected[11:19])
+
+        # Dicts handed out earlier are not changed by later steps
+        dicts = list(s.params(0, 4))
+        self.assertEqual(dicts[0], expected[0])
+
+        s = Scan(p, default_repeats=2)
+        expected = [s[i] for i in range(len(s))]
+        self.assertEqual(list(s.params()), expected)
+        self.assertEqual(list(s.params(9, 95)), expected[9:95])
+
+    def test_constraints(self):
+        p = {}
+        p['birth'] = [0.1, 0.2, 0.3, 0.4]
+        p['death'] = [0.15, 0.25, 0.35]
+        p['width'] = [5, 10, 20]
+        p['cells'] = [2, 4, 8]
+        p['spacing'] = [1.0, 2.0, 1.5]
+
+        def keep(params):
+            return params['birth'] >= params['death'] and params['width'] >= params['cells'] * params['spacing']
+
+        full = Scan(p, joint_lists=[['cells', 'spacing']], default_repeats=2)
+        expected = [params for params in full.params() if keep(params)]
+
+        counted = []
+
+        def count(params):
+            counted.append(params)
+            return 3 if params['width'] == 20 else None
+
+        s = Scan(p, joint_lists=[['cells', 'spacing']], default_repeats=2)
+        s.add_constraint(lambda params: params['birth'] >= params['death'])
+        s.add_constraint(lambda columns: columns['width'] >= columns['cells'] * columns['spacing'], vectorised=True)
+        # Make the constraints span several chunks
+        s.chunk_size = 5
+        self.assertEqual(s.num_combinations(), len(expected) // 2)
+        self.assertEqual(list(s.params()), expected)
+        self.assertEqual(s.num_tasks(), len(expected))
+        # Streaming and counting don't keep the position of every combination, random access does
+        self.assertIsNone(s._valid)
+        self.assertEqual([s[i] for i in range(len(s))], expected)
+        self.assertIsNotNone(s._valid)
+        self.assertEqual(s[3:11], expected[3:11])
+        self.assertEqual(s.table().to_records(), expected)
+
+        # Count functions only see the combinations that are kept
+        s.add_count(count)
+        distinct = Scan(p, joint_lists=[['cells', 'spacing']]).params()
+        expected = [params for params in distinct if keep(params)
+                    for _ in range(3 if params['width'] == 20 else 2)]
+        self.assertEqual(list(s.params()), expected)
+        self.assertEqual(s.num_tasks(), len(expected))
+        self.assertIsNone(s._valid)
+        self.assertEqual(s[len(s) - 1], expected[-1])
+        self.assertTrue(all(keep(params) for params in counted))
+
+        # Nothing satisfies the constraints
+        s.add_constraint(lambda params: False)
+        self.assertEqual(len(s), 0)
+        self.assertEqual(list(s.params()), [])
+
+    def test_table(self):
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+        p['c'] = [10, 15, 20]
+
+        s = Scan(p, joint_lists=[['a', 'b']], count_funcs=[lambda p: 2, lambda p: 1 if p['c'] >= 14 else None])
+        table = s.table()
+        expected = list(s.params())
+
+        self.assertEqual(table.num_combinations(), 15)
+        self.assertEqual(len(table), len(expected))
+        self.assertEqual(table.to_records(), expected)
+        self.assertEqual(table[11], expected[11])
+        self.assertEqual(list(table.repeats), [2] * 5 + [1] * 10)
+        self.assertEqual(list(table.repeat_indices()[:4]), [0, 1, 0, 1])
+
+        columns = table.task_columns()
+        self.assertEqual(len(columns['c']), 20)
+        self.assertTrue(np.allclose(columns['a'], [e['a'] for e in expected]))
+        self.assertEqual(list(columns['c']), [e['c'] for e in expected])
+
+    def test_compact_records(self):
+        p = {'a': [1, 2], 'c': [10, 20]}
+        count_funcs = [lambda p: 3 if p['c'] == 20 else 2]
+        table = Scan(p, count_funcs=count_funcs).table()
+        expanded = list(Scan(p, count_funcs=count_funcs).params())
+
+        self.assertEqual(list(compact_records(table)), list(compact_records(expanded)))
+        self.assertEqual([repeats for params, repeats in compact_records(expanded)], [2, 3, 2, 3])
+        self.assertEqual(list(repeat_indices(expanded)), list(repeat_indices(table)))
+        self.assertEqual(list(repeat_indices(expanded)), [0, 1, 0, 1, 2, 0, 1, 0, 1, 2])
+
+        # Shards split the repeats of a parameter set where needed
+        shards = list(shard_records(compact_records(table), 4))
+        self.assertEqual([first_repeat for first_repeat, records in shards], [0, 2, 1])
+        self.assertEqual([[repeats for params, repeats in records] for first_repeat, records in shards],
+                         [[2, 2], [1, 2, 1], [2]])
+        self.assertEqual([params for first_repeat, records in shards for params, repeats in records
+                          for _ in range(repeats)], expanded)
+
+    def test_vectorised_counts(self):
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = np.linspace(0.1, -0.5, 5)
+        p['c'] = np.linspace(10, 20, 3)
+
+        big_c_count = lambda p: 1 if p['c'] >= 14 else None
+        expected = list(Scan(p, joint_lists=[['a', 'b']], count_funcs=[lambda p: 2, big_c_count]).params())
+
+        # A plain number applies to every parameter set, negative values defer
+        s = Scan.from_dict(p, joint_lists=[['a', 'b']])
+        s.add_count(lambda p: 2, vectorised=True)
+        s.add_count(lambda p: np.where(p['c'] >= 14, 1, -1), vectorised=True)
+        self.assertEqual(list(s.params()), expected)
+        self.assertEqual(s.table().to_records(), expected)
+        self.assertEqual(len(s), 20)
+
+        # Masked values defer, and vectorised and per-dict functions mix in order
+        @vectorised
+        def masked_count(p):
+            return np.ma.masked_array(np.full(len(p['c']), 5), mask=p['c'] < 14)
+
+        s = Scan(p, joint_lists=[['a', 'b']], count_funcs=[lambda p: 2, masked_count, big_c_count])
+        self.assertEqual(list(s.params()), expected)
+
+        s = Scan(p, joint_lists=[['a', 'b']], count_funcs=[lambda p: 2, big_c_count, masked_count])
+        self.assertEqual(list(s.table().repeats), [2] * 5 + [5] * 10)
+
+    def test_vectorised_counts_chunked(self):
+        p = {'a': np.arange(10), 'b': np.arange(7)}
+        per_dict = Scan(p, count_funcs=[lambda p: 1 + (p['a'] * p['b']) % 3])
+        s = Scan(p, count_funcs=[vectorised(lambda p: 1 + (p['a'] * p['b']) % 3)])
+        s.chunk_size = 4
+        self.assertEqual(list(s.table().repeats), list(per_dict.table().repeats))
+        self.assertEqual(s[100], per_dict[100])
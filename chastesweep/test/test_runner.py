@@ -0,0 +1,114 @@
+from __future__ import print_function
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.runner import BatchSweep, run_array_job
+
+
+class TestRunner(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_runner"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = [1, 2]
+        self.sweeper = ParamSweeper()
+        self.sweeper.generate_batch_output(output_dir=self.output_dir,
+                                           exec_cmd="chastesweep/test/test_params.sh",
+                                           parameters=p,
+                                           params_format=ParamSweeper.PARAMS_INDEXED,
+                                           tasks_per_job=4)
+        self.expanded = self.sweeper.expand_parameters(p)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "ParamSweeper is imported lazily from Python 3.7")
+    def test_runner_imports(self):
+        # The runner of each array job doesn't pay for importing numpy and jinja2
+        loaded = subprocess.check_output([sys.executable, "-c", "import sys, chastesweep.util.runner; "
+                                          "print(sorted(name for name in ('numpy', 'jinja2') if name in sys.modules))"])
+        self.assertEqual(loaded.strip(), b"[]")
+
+    def test_job_task_ids(self):
+        sweep = BatchSweep(self.output_dir)
+        self.assertEqual(sweep.num_tasks, 10)
+        self.assertEqual(list(sweep.job_task_ids(1)), [1, 2, 3, 4])
+        self.assertEqual(list(sweep.job_task_ids(3)), [9, 10])
+        with self.assertRaises(IndexError):
+            sweep.job_task_ids(4)
+        with self.assertRaises(IndexError):
+            sweep.job_task_ids(0)
+        self.assertEqual(sweep.params(10), self.expanded[9])
+        sweep.close()
+
+    def test_run_array_job(self):
+        sweep = BatchSweep(self.output_dir)
+        self.assertEqual(run_array_job(sweep, 2), 0)
+        for i in range(5, 9):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, str(i), "testout.txt")))
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "4")))
+        sweep.close()
+
+    def test_sharded_sweep(self):
+        p = {}
+        p['a'] = np.linspace(0, 10, 5)
+        p['b'] = [1, 2]
+        expanded = self.sweeper.expand_parameters(p, default_repeats=3)
+        for params_format in [ParamSweeper.PARAMS_JSON, ParamSweeper.PARAMS_INDEXED]:
+            shutil.rmtree(self.output_dir)
+            self.sweeper.generate_batch_output(output_dir=self.output_dir,
+                                               exec_cmd="chastesweep/test/test_params.sh",
+                                               parameters=p,
+                                               scheduler=ParamSweeper.SLURM,
+                                               default_repeats=3,
+                                               params_format=params_format,
+                                               tasks_per_job=2,
+                                               max_array_size=4,
+                                               max_concurrent=2)
+
+            # 30 simulations in shards of 4 array jobs running 2 simulations each
+            for shard in range(4):
+                self.assertTrue(os.path.exists(os.path.join(self.output_dir, "batch.{}.slurm.sh".format(shard))))
+            self.assertFalse(os.path.exists(os.path.join(self.output_dir, "batch.4.slurm.sh")))
+            with open(os.path.join(self.output_dir, "batch.3.slurm.sh")) as batch_file:
+                batch_script = batch_file.read()
+            self.assertIn("--array=1-3%2", batch_script)
+            self.assertIn("runsimulation.py $SLURM_ARRAY_TASK_ID --params params.3.json", batch_script)
+            with open(os.path.join(self.output_dir, "submit.slurm.sh")) as submit_file:
+                self.assertIn("--dependency=afterany:$job_id batch.3.slurm.sh", submit_file.read())
+
+            # The whole sweep reads through its shards
+            sweep = BatchSweep(self.output_dir)
+            self.assertEqual(sweep.num_tasks, 30)
+            self.assertEqual([sweep.params(i) for i in range(1, 31)], expanded)
+            self.assertEqual([sweep.repeat_index(i) for i in range(1, 31)], [i % 3 for i in range(30)])
+            sweep.close()
+
+            # A shard only holds its own simulations
+            sweep = BatchSweep(self.output_dir, "params.1.json")
+            self.assertEqual(sweep.num_tasks, 8)
+            self.assertEqual(list(sweep.job_task_ids(1)), [9, 10])
+            self.assertEqual(list(sweep.job_task_ids(4)), [15, 16])
+            with self.assertRaises(IndexError):
+                sweep.job_task_ids(5)
+            self.assertEqual(sweep.repeat_index(9), 2)
+            self.assertEqual(sweep.repeat_index(10), 0)
+            self.assertEqual(sweep.params(9), expanded[8])
+            self.assertEqual(run_array_job(sweep, 1), 0)
+            for i in [9, 10]:
+                self.assertTrue(os.path.exists(os.path.join(self.output_dir, str(i), "testout.txt")))
+            sweep.close()
+
+        # Resuming the sweep shards the unfinished simulations again
+        self.assertEqual(self.sweeper.generate_resume_batch(self.output_dir, scheduler=ParamSweeper.SLURM,
+                                                            max_array_size=10), 28)
+        for shard in range(2):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, "resume.{}.slurm.sh".format(shard))))
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, "resume.{}.jobs".format(shard))))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "resume.submit.slurm.sh")))
@@ -0,0 +1,69 @@
+from __future__ import print_function
+import unittest
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.pscan import Scan
+from chastesweep.util.sampling import latin_hypercube, halton, sobol, sample_parameters, SamplingError, \
+    LATIN_HYPERCUBE, HALTON, SOBOL
+
+
+class TestSampling(unittest.TestCase):
+
+    def assertStratified(self, points):
+        # every one of the len(points) equal intervals of each dimension holds a point
+        num_points = len(points)
+        for d in range(points.shape[1]):
+            self.assertEqual(len(set((points[:, d] * num_points).astype(int))), num_points)
+
+    def test_sequences(self):
+        np.testing.assert_allclose(sobol(8, 3, scramble=False),
+                                   [[0, 0, 0], [0.5, 0.5, 0.5], [0.75, 0.25, 0.25], [0.25, 0.75, 0.75],
+                                    [0.375, 0.375, 0.625], [0.875, 0.875, 0.125], [0.625, 0.125, 0.875],
+                                    [0.125, 0.625, 0.375]])
+        np.testing.assert_allclose(halton(4, 2, scramble=False),
+                                   [[0, 0], [0.5, 1 / 3.0], [0.25, 2 / 3.0], [0.75, 1 / 9.0]])
+
+        self.assertStratified(latin_hypercube(50, 4, seed=1))
+        self.assertStratified(sobol(64, 21, seed=5))
+        self.assertStratified(sobol(64, 21, scramble=False))
+
+        for sampler in [latin_hypercube, halton, sobol]:
+            points = sampler(128, 5, seed=2)
+            self.assertEqual(points.shape, (128, 5))
+            self.assertTrue(np.all((points >= 0) & (points < 1)))
+            np.testing.assert_allclose(points.mean(axis=0), 0.5, atol=0.05)
+            # The same seed gives the same points
+            np.testing.assert_array_equal(points, sampler(128, 5, seed=2))
+
+        with self.assertRaises(SamplingError):
+            sobol(8, 22)
+
+    def test_sample_parameters(self):
+        ranges = {'birth_rate': (0.1, 1.0), 'mesh_size': (1e-3, 1e-1, 'log')}
+        for method in [LATIN_HYPERCUBE, HALTON, SOBOL]:
+            samples = sample_parameters(ranges, 32, method, seed=4)
+            self.assertEqual(sorted(samples), ['birth_rate', 'mesh_size'])
+            self.assertTrue(np.all((samples['birth_rate'] >= 0.1) & (samples['birth_rate'] <= 1.0)))
+            log_mesh = np.log10(samples['mesh_size'])
+            self.assertTrue(np.all((log_mesh >= -3) & (log_mesh <= -1)))
+
+        with self.assertRaises(SamplingError):
+            sample_parameters({'a': (0, 1, 'log')}, 4)
+        with self.assertRaises(SamplingError):
+            sample_parameters(ranges, 4, method="grid")
+
+    def test_sampled_scan(self):
+        s = Scan({'end_time': [10, 20]}, default_repeats=2)
+        s.add_samples({'a': (0, 1), 'b': (-1, 1)}, 16, method=HALTON, seed=3)
+        s.add_count(lambda p: 3 if p['a'] > 0.5 else None)
+        self.assertEqual(s.num_combinations(), 32)
+        samples = sample_parameters({'a': (0, 1), 'b': (-1, 1)}, 16, method=HALTON, seed=3)
+        self.assertEqual(len(s), 2 * sum(3 if a > 0.5 else 2 for a in samples['a']))
+        self.assertEqual(s[0], {'end_time': 10, 'a': samples['a'][0], 'b': samples['b'][0]})
+
+        # The samples go through ParamSweeper as a joint list
+        p = {'end_time': [10, 20]}
+        p.update(samples)
+        expanded = ParamSweeper().expand_parameters(p, joint_lists=[list(samples)])
+        self.assertEqual(len(expanded), 32)
@@ -0,0 +1,67 @@
+from __future__ import print_function
+import unittest
+import os
+import sys
+import shutil
+
+from chastesweep import ParamSweeper
+from chastesweep.util.executor import run_serial, run_parallel
+from chastesweep.util.ledger import Ledger
+from chastesweep.util.summary import summarise, format_summary, main
+
+
+class TestSummary(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_summary"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        os.mkdir(self.output_dir)
+
+    @unittest.skipIf(not hasattr(os, "wait4"), "Resource usage needs os.wait4")
+    def test_usage(self):
+        # The child of the shell holds 64MB and spins for a while
+        script = "import time; x = bytearray(64 << 20); t = time.time()\nwhile time.time() - t < 0.2: pass"
+        cmd = "{} -c '{}'".format(sys.executable, script)
+        for run in (run_serial, run_parallel):
+            usages = {}
+            exit_codes = run([(0, cmd), (1, "exit 2")], on_finish=lambda i, code, usage: usages.update({i: usage}))
+            self.assertEqual(exit_codes, {0: 0, 1: 2})
+            self.assertGreater(usages[0]["maxrss"], 60000)
+            self.assertGreater(usages[0]["user"] + usages[0]["sys"], 0.1)
+            self.assertEqual(sorted(usages[1]), ["maxrss", "sys", "user"])
+
+    def test_summary(self):
+        p = {'a': [1, 2, 3]}
+        sweeper = ParamSweeper()
+        sweeper.perform_parallel_sweep(self.output_dir, "chastesweep/test/test_params.sh", p, default_repeats=2)
+        ledger = Ledger(os.path.join(self.output_dir, sweeper.ledger_file_name))
+        records = ledger.read()
+        self.assertEqual(records[0]["host"], ledger.host)
+        if hasattr(os, "wait4"):
+            self.assertIn("maxrss", records[0])
+            self.assertIn("user", records[0])
+
+        # Make the parameter set a=2 the slowest
+        for task_id in [2, 3]:
+            record = dict(records[task_id])
+            record["wall"] = 100.0 + task_id
+            ledger.append(record)
+        ledger.started(6)
+        ledger.cached(7)
+
+        summary = summarise(self.output_dir, parameters=sweeper.expand_parameters(p, default_repeats=2), top=2)
+        self.assertEqual((summary["done"], summary["failed"], summary["running"], summary["cached"]), (7, 0, 1, 1))
+        self.assertEqual(summary["slowest"][0], ({'a': 2}, 102.5, 2))
+        self.assertEqual(len(summary["slowest"]), 2)
+        self.assertEqual(summary["distributions"]["wall"]["max"], 103.0)
+        self.assertEqual(summary["hosts"], {ledger.host: 6})
+        self.assertIn('102.5 s    2  {"a": 2}', format_summary(summary))
+
+        # Without parameters the simulations are listed by id
+        summary = summarise(self.output_dir)
+        self.assertEqual(summary["slowest"][0][0], {"id": 3})
+        self.assertEqual(main(["chastesweep_summary", self.output_dir]), 0)
+
+        self.assertEqual(format_summary(summarise("/tmp/test_summary_missing")).split("\n"),
+                         ["0 done, 0 failed, 0 started but not finished, 0 from the cache"])
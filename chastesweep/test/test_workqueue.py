@@ -0,0 +1,120 @@
+from __future__ import print_function
+import unittest
+import os
+import sys
+import time
+import shutil
+import subprocess
+import numpy as np
+
+from chastesweep import ParamSweeper
+from chastesweep.util.jobmap import JobMap
+from chastesweep.util.ledger import Ledger, STARTED
+from chastesweep.util.runner import BatchSweep, run_worker
+from chastesweep.util.workqueue import WorkQueue
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "/tmp/test_workqueue"
+        if os.path.exists(self.output_dir):
+            shutil.rmtree(self.output_dir)
+        self.queue_dir = os.path.join(self.output_dir, "queue")
+
+    def test_claims(self):
+        first = WorkQueue(self.queue_dir, range(1, 6), worker_id="first")
+        second = WorkQueue(self.queue_dir, range(1, 6), worker_id="second")
+        self.assertEqual(first.claim(), 1)
+        self.assertEqual(second.claim(), 2)
+        self.assertEqual(first.claim(), 3)
+        self.assertEqual(second.pending(), [1, 3])
+
+        first.finish(1)
+        self.assertEqual(second.pending(), [3])
+        self.assertEqual(list(second.claims()), [4, 5])
+        self.assertIsNone(first.claim())
+
+        # Claims aren't reclaimed while their lease is renewed, and are once it expires
+        self.assertIsNone(second.reclaim())
+        first.heartbeat()
+        os.utime(os.path.join(self.queue_dir, "3"), (time.time() - 1000, time.time() - 1000))
+        self.assertEqual(second.reclaim(), 3)
+        self.assertTrue(second.holds(3))
+        self.assertEqual(first.pending(), [2, 4, 5])
+
+        # The worker that lost the claim doesn't mark it finished
+        first.finish(3)
+        self.assertEqual(first.pending(), [2, 3, 4, 5])
+        for task_id in [2, 3, 4, 5]:
+            second.finish(task_id)
+        self.assertEqual(first.pending(), [])
+
+        # A finished simulation is never claimed again
+        late = WorkQueue(self.queue_dir, range(1, 6), worker_id="late")
+        self.assertEqual(list(late.claims()), [])
+
+    def test_heartbeat(self):
+        queue = WorkQueue(self.queue_dir, [7, 8], lease=0.4)
+        self.assertEqual(queue.claim(), 7)
+        queue.start_heartbeat(0.05)
+        time.sleep(0.6)
+        self.assertIsNone(WorkQueue(self.queue_dir, [7, 8], lease=0.4).reclaim())
+        queue.stop_heartbeat()
+        time.sleep(0.6)
+        self.assertEqual(WorkQueue(self.queue_dir, [7, 8], lease=0.4).reclaim(), 7)
+
+    def test_workers(self):
+        p = {'a': np.linspace(0, 10, 10), 'b': [1, 2]}
+        sweeper = ParamSweeper()
+        sweeper.worker_lease = 5.0
+        sweeper.generate_batch_output(output_dir=self.output_dir,
+                                      exec_cmd="chastesweep/test/test_params.sh",
+                                      parameters=p,
+                                      params_format=ParamSweeper.PARAMS_INDEXED,
+                                      num_workers=3,
+                                      cost_model=lambda params: params['a'])
+        with open(os.path.join(self.output_dir, "batch.sge.sh")) as batch_file:
+            batch_script = batch_file.read()
+        self.assertIn("#$ -t 1-3", batch_script)
+        self.assertIn("runsimulation.py $SGE_TASK_ID --worker --job-map sweep.jobs", batch_script)
+
+        # A worker that died holding simulation 20
+        os.mkdir(self.queue_dir)
+        with open(os.path.join(self.queue_dir, "20"), "w") as claim_file:
+            claim_file.write("dead")
+        os.utime(os.path.join(self.queue_dir, "20"), (time.time() - 1000, time.time() - 1000))
+        os.mkdir(os.path.join(self.output_dir, "20"))
+
+        env = dict(os.environ, PYTHONPATH=os.getcwd())
+        workers = [subprocess.Popen([sys.executable, "runsimulation.py", str(i), "--worker", "--job-map", "sweep.jobs"],
+                                    cwd=self.output_dir, env=env, stdout=subprocess.PIPE)
+                   for i in range(1, 4)]
+        outputs = [worker.communicate()[0] for worker in workers]
+        self.assertEqual([worker.returncode for worker in workers], [0, 0, 0])
+
+        # Every simulation ran exactly once
+        starts = [record["id"] for record in Ledger(os.path.join(self.output_dir, "ledger.jsonl")).records()
+                  if record["status"] == STARTED]
+        self.assertEqual(sorted(starts), list(range(1, 21)))
+        # The workers claim in the order of the job map, most costly first. Workers running at once can start
+        # their simulations out of that order, so it is checked here rather than in the ledger
+        job_map = JobMap(os.path.join(self.output_dir, "sweep.jobs"))
+        claim_order = job_map[0]
+        job_map.close()
+        self.assertEqual(sorted(claim_order), list(range(1, 21)))
+        costs = [p['a'][(task_id - 1) // 2] for task_id in claim_order]
+        self.assertEqual(costs, sorted(costs, reverse=True))
+        for task_id in range(1, 21):
+            self.assertTrue(os.path.exists(os.path.join(self.output_dir, str(task_id), "testout.txt")))
+        self.assertTrue(any(b"Reclaiming simulation ID 20" in output for output in outputs))
+
+        # Running a worker again finds nothing to do
+        sweep = BatchSweep(self.output_dir)
+        self.assertEqual(run_worker(sweep, 4), 0)
+        sweep.close()
+        self.assertEqual(len(Ledger(os.path.join(self.output_dir, "ledger.jsonl")).read()), 20)
+
+        with self.assertRaises(ValueError):
+            sweeper.generate_batch_output(self.output_dir, "chastesweep/test/test_params.sh", p, num_workers=5,
+                                          max_array_size=4)
@@ -0,0 +1,177 @@
+"""Adaptive sweeps, which start from a coarse grid and only run the finer
+points where a metric of the simulation output changes sharply."""
+from __future__ import print_function, division
+import os
+import json
+import itertools
+import numpy as np
+
+from chastesweep.util.executor import SimulationLauncher, simulation_output_dir, run_serial
+from chastesweep.util.layout import FLAT
+from chastesweep.util.paramstore import json_default
+
+# How the metric values at the corners of a cell are scored
+RANGE = "range"
+VARIANCE = "variance"
+
+
+class AdaptiveSweep:
+    """Runs a grid of parameter values, then repeatedly refines the cells of
+    the grid whose score is above a threshold, until no cell needs refining or
+    the budget of simulations is used up.
+
+    A cell is the box between neighbouring grid values of every refined
+    parameter. Its score is the range (or variance) of the metric at its
+    corners, so a cell where the metric changes sharply scores highly.
+    Refining a cell halves it along every parameter, running the new points at
+    the midpoints, and the highest scoring cells are refined first. Each point
+    is run default_repeats times and its metric is the mean over the runs that
+    succeeded. Cells with a failed corner are never refined.
+
+    Simulations are numbered from 0 across all rounds, with outputs and ledger
+    laid out as in a local sweep, and every point is also recorded with its
+    metric in points.jsonl.
+    """
+
+    points_file_name = "points.jsonl"
+
+    def __init__(self, output_dir, exec_cmd, ledger, grid, metric, threshold, budget, fixed_params={},
+                 default_repeats=1, criterion=RANGE, log_params=(), repeat_param=None, run=run_serial,
+                 layout=FLAT):
+        """
+        :param output_dir: Output directory of the sweep, which should be empty
+        :param exec_cmd:
+        :param ledger: Ledger of the sweep
+        :param grid: Dict of parameter name: initial values, at least two for each parameter
+        :param metric: Function of the output directory of a simulation returning a number
+        :param threshold: Cells scoring above this are refined
+        :param budget: Maximum number of simulations, counting repeats
+        :param fixed_params: Dict of parameter name: value passed unchanged to every simulation
+        :param default_repeats: Number of times each point is run
+        :param criterion: RANGE or VARIANCE of the metric at the corners of a cell
+        :param log_params: Parameters halved in log space, i.e. at the geometric mean
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :param run: run_serial, or a function taking the same arguments that runs the simulations in parallel
+        :param layout: OutputLayout of the simulations' output directories, see util.layout
+        """
+        if criterion not in (RANGE, VARIANCE):
+            raise ValueError("Unsupported refinement criterion {}".format(criterion))
+
+        self.output_dir = output_dir
+        self.exec_cmd = exec_cmd
+        self.ledger = ledger
+        self.layout = layout
+        self.names = sorted(grid)
+        self.grid = dict((name, sorted(set(grid[name]))) for name in self.names)
+        for name in self.names:
+            if len(self.grid[name]) < 2:
+                raise ValueError("Parameter {} needs at least two initial values".format(name))
+        self.metric = metric
+        self.threshold = threshold
+        self.budget = budget
+        self.fixed_params = dict(fixed_params)
+        self.default_repeats = default_repeats
+        self.criterion = criterion
+        self.log_params = set(log_params)
+        self.repeat_param = repeat_param
+        self._run = run
+
+        # metric of every point run so far, keyed by its tuple of values in the order of names
+        self.metrics = {}
+        self.num_simulations = 0
+        self.rounds = 0
+
+    def params(self, point):
+        """Parameter dict of a point."""
+        params = dict(self.fixed_params)
+        params.update(zip(self.names, point))
+        return params
+
+    def _midpoint(self, name, low, high):
+        if name in self.log_params:
+            return float(np.sqrt(low * high))
+        return (low + high) / 2
+
+    def score(self, cell):
+        """Score of a cell, a tuple of (low, high) for every parameter."""
+        values = [self.metrics[corner] for corner in itertools.product(*cell)]
+        if self.criterion == VARIANCE:
+            return float(np.var(values))
+        return float(np.max(values) - np.min(values))
+
+    def _cell_points(self, cell):
+        # the corners of the cell's halves along every parameter
+        return itertools.product(*[(low, self._midpoint(name, low, high), high)
+                                   for name, (low, high) in zip(self.names, cell)])
+
+    def _split(self, cell):
+        halves = []
+        for name, (low, high) in zip(self.names, cell):
+            middle = self._midpoint(name, low, high)
+            halves.append([(low, middle), (middle, high)])
+        return list(itertools.product(*halves))
+
+    def evaluate(self, points):
+        """Run every point default_repeats times and record its metric."""
+        simulations = []
+        for point in points:
+            params = self.params(point)
+            for repeat_index in range(self.default_repeats):
+                simulations.append((self.num_simulations, params, repeat_index))
+                self.num_simulations += 1
+
+        launcher = SimulationLauncher(self.output_dir, self.exec_cmd, self.ledger, repeat_param=self.repeat_param,
+                                      layout=self.layout)
+        self._run(launcher.commands(simulations), launcher.finished)
+
+        with open(os.path.join(self.output_dir, self.points_file_name), "a") as points_file:
+            for i, point in enumerate(points):
+                ids = [simulation[0] for simulation in
+                       simulations[i * self.default_repeats:(i + 1) * self.default_repeats]]
+                values = [self.metric(simulation_output_dir(self.output_dir, simulation_id, self.layout))
+                          for simulation_id in ids if launcher.exit_codes.get(simulation_id) == 0]
+                self.metrics[point] = float(np.mean(values)) if values else float("nan")
+                points_file.write(json.dumps({"round": self.rounds, "ids": ids, "params": self.params(point),
+                                              "metric": self.metrics[point]}, default=json_default) + "\n")
+
+    def run(self):
+        """Run the initial grid and then refine it until no cell scores above
+        the threshold or the budget is used up.
+        :return: List of (parameter dict, metric) of every point run
+        """
+        initial_points = list(itertools.product(*[self.grid[name] for name in self.names]))
+        if len(initial_points) * self.default_repeats > self.budget:
+            raise ValueError("The initial grid needs {} simulations, more than the budget of {}"
+                             .format(len(initial_points) * self.default_repeats, self.budget))
+        self.evaluate(initial_points)
+        cells = list(itertools.product(*[list(zip(self.grid[name][:-1], self.grid[name][1:]))
+                                         for name in self.names]))
+
+        while True:
+            self.rounds += 1
+            # highest scoring first, a NaN score (from a failed corner) never exceeds the threshold
+            scored = [(score, cell) for score, cell in ((self.score(cell), cell) for cell in cells)
+                      if score > self.threshold]
+            cells = [cell for score, cell in sorted(scored, key=lambda item: item[0], reverse=True)]
+
+            new_points = []
+            new_point_set = set()
+            refined = 0
+            for cell in cells:
+                points = [point for point in self._cell_points(cell)
+                          if point not in self.metrics and point not in new_point_set]
+                if self.num_simulations + (len(new_points) + len(points)) * self.default_repeats > self.budget:
+                    break
+                new_points.extend(points)
+                new_point_set.update(points)
+                refined += 1
+
+            # nothing fits in the budget, or the cells can't be halved any further
+            if not new_points:
+                break
+            print("Refinement round {}: refining {} of {} cells with {} new points"
+                  .format(self.rounds, refined, len(cells), len(new_points)))
+            self.evaluate(new_points)
+            cells = cells[refined:] + [half for cell in cells[:refined] for half in self._split(cell)]
+
+        return [(self.params(point), value) for point, value in self.metrics.items()]
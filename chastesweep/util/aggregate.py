@@ -0,0 +1,243 @@
+"""Gathering the outputs of every simulation of a sweep, together with its
+parameters, into a single table.
+
+The table is a compressed NumPy file with one column per parameter and output
+and an "id" column of simulation ids, one row per simulation that succeeded.
+Scalar outputs are 1D columns and array outputs are stacked into columns with
+a dimension per simulation, so every output of a given name must have the
+same shape. Aggregating again only reads the simulations that are not in the
+table yet, so a sweep can be aggregated as it runs.
+
+>>> table = aggregate("sweep_results", {"final_size": "results/size.txt"}, num_processes=8)
+>>> table["birth_rate"], table["final_size"]
+"""
+from __future__ import print_function
+import os
+import sys
+import csv
+import gzip
+import shutil
+import argparse
+import tempfile
+import importlib
+import multiprocessing
+import numpy as np
+
+from chastesweep.util.executor import simulation_output_dir, default_num_processes
+from chastesweep.util.ledger import Ledger, DONE
+from chastesweep.util.layout import FLAT
+from chastesweep.util.runner import BatchSweep
+
+ID_COLUMN = "id"
+
+
+def load_outputs(run_dir, outputs):
+    """Outputs of a single simulation.
+    :param run_dir: Output directory of the simulation
+    :param outputs: Dict of output name: path of a text file relative to run_dir, read with numpy.loadtxt,
+        or a function of run_dir returning a dict of output name: scalar or array
+    :return: Dict of output name: scalar or numpy array
+    """
+    if callable(outputs):
+        values = outputs(run_dir)
+    else:
+        values = dict((name, np.loadtxt(os.path.join(run_dir, path))) for name, path in outputs.items())
+
+    for name, value in values.items():
+        value = np.asarray(value)
+        values[name] = value.item() if value.ndim == 0 else value
+    return values
+
+
+def _load_run(args):
+    # Run by the worker processes, a run whose outputs can't be read is left for the next aggregation
+    task_id, run_dir, outputs, archive = args
+    extracted_dir = None
+    try:
+        if archive is not None and not os.path.isdir(run_dir) and archive.contains(task_id):
+            # Packed, its files are read from a temporary copy
+            extracted_dir = tempfile.mkdtemp(prefix="chastesweep_aggregate_")
+            archive.extract(task_id, extracted_dir)
+            run_dir = extracted_dir
+        return task_id, load_outputs(run_dir, outputs), None
+    except (IOError, OSError, ValueError, KeyError) as e:
+        return task_id, None, str(e)
+    finally:
+        if extracted_dir is not None:
+            shutil.rmtree(extracted_dir)
+
+
+def load_table(path):
+    """Table written by aggregate.
+    :return: Dict of column name: numpy array
+    """
+    with np.load(path) as table_file:
+        return dict((name, table_file[name]) for name in table_file.files)
+
+
+def _save_table(path, table):
+    # Written to a temporary file and renamed over the old table, so it is never left half written
+    tmp_path = "{}.tmp.{}".format(path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as table_file:
+            np.savez_compressed(table_file, **table)
+        os.rename(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _column(name, values):
+    column = np.array(values)
+    if column.dtype == object:
+        raise ValueError("Values of {} have different shapes or types and can't form a column".format(name))
+    return column
+
+
+def aggregate(output_dir, outputs, parameters=None, table_file_name="results.npz", num_processes=1,
+              ledger_file_name="ledger.jsonl", layout=FLAT, archive=None):
+    """Add the outputs of the simulations of a sweep that succeeded since the
+    last aggregation to its table, creating it if needed.
+    :param output_dir: Output directory of the sweep
+    :param outputs: Outputs to read from each simulation's output directory, see load_outputs. A function
+        must be defined at module level to be used with more than one process.
+    :param parameters: Expanded parameters of a local sweep. A batch sweep's are read from its params.json
+    :param table_file_name: Table file in output_dir
+    :param num_processes: Number of processes reading outputs, None for the number of cores
+    :param ledger_file_name: Ledger of a local sweep
+    :param layout: OutputLayout of a local sweep, see util.layout. A batch sweep's is read from its params.json
+    :param archive: RunArchive the outputs of a local sweep were packed into, see util.archive. A batch sweep's
+        is read from its params.json
+    :return: The whole table, as a dict of column name: numpy array
+    """
+    table_path = os.path.join(output_dir, table_file_name)
+    table = load_table(table_path) if os.path.exists(table_path) else {}
+    aggregated = set(table[ID_COLUMN].tolist()) if table else set()
+
+    sweep = None
+    if parameters is None:
+        sweep = BatchSweep(output_dir)
+        ledger_path = sweep.ledger_path
+        layout = sweep.layout
+        archive = sweep.archive
+    else:
+        ledger_path = os.path.join(output_dir, ledger_file_name)
+
+    try:
+        task_ids = sorted(task_id for task_id, record in Ledger(ledger_path).read().items()
+                          if record["status"] == DONE and task_id not in aggregated)
+        if not task_ids:
+            print("No new simulations to aggregate")
+            return table
+
+        runs = [(task_id, simulation_output_dir(output_dir, task_id, layout), outputs, archive)
+                for task_id in task_ids]
+        if num_processes is None:
+            num_processes = default_num_processes()
+        if num_processes == 1:
+            results = [_load_run(run) for run in runs]
+        else:
+            pool = multiprocessing.Pool(num_processes)
+            try:
+                results = pool.map(_load_run, runs, chunksize=max(1, len(runs) // (4 * num_processes)))
+            finally:
+                pool.close()
+                pool.join()
+
+        rows = []
+        for task_id, values, error in results:
+            if values is None:
+                print("Could not read the outputs of simulation ID {}: {}".format(task_id, error))
+                continue
+            params = sweep.params(task_id) if sweep is not None else parameters[task_id]
+            rows.append((task_id, params, values))
+    finally:
+        if sweep is not None:
+            sweep.close()
+
+    if not rows:
+        return table
+
+    names = sorted(rows[0][1]) + sorted(rows[0][2])
+    if ID_COLUMN in names or len(set(names)) < len(names):
+        raise ValueError("Parameter and output names must be distinct and not {}".format(ID_COLUMN))
+    for task_id, params, values in rows:
+        if sorted(params) + sorted(values) != names:
+            raise ValueError("Simulation ID {} has different parameters or outputs to the others".format(task_id))
+    if table and set(table) != set(names) | set([ID_COLUMN]):
+        raise ValueError("The parameters or outputs differ from those already in {}".format(table_path))
+
+    new_columns = {ID_COLUMN: np.array([task_id for task_id, params, values in rows])}
+    for name in names:
+        new_columns[name] = _column(name, [params[name] if name in params else values[name]
+                                           for task_id, params, values in rows])
+
+    if table:
+        table = dict((name, np.concatenate([table[name], new_columns[name]])) for name in new_columns)
+    else:
+        table = new_columns
+    order = np.argsort(table[ID_COLUMN], kind="mergesort")
+    table = dict((name, column[order]) for name, column in table.items())
+
+    _save_table(table_path, table)
+    print("Aggregated {} new simulation(s), {} in total".format(len(rows), len(order)))
+    return table
+
+
+def write_csv(table, path):
+    """Write a table to a CSV file, gzipped if path ends with .gz. Array
+    columns are flattened into one column per element, named name[i]."""
+    names = [ID_COLUMN] + sorted(name for name in table if name != ID_COLUMN)
+    columns = [table[name].reshape(len(table[name]), -1) for name in names]
+    header = []
+    for name, column in zip(names, columns):
+        if table[name].ndim == 1:
+            header.append(name)
+        else:
+            header.extend("{}[{}]".format(name, i) for i in range(column.shape[1]))
+
+    if sys.version_info[0] < 3:
+        csv_file = gzip.open(path, "wb") if path.endswith(".gz") else open(path, "wb")
+    else:
+        csv_file = gzip.open(path, "wt", newline="") if path.endswith(".gz") else open(path, "w", newline="")
+    with csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(header)
+        for row in range(len(table[ID_COLUMN])):
+            writer.writerow([value for column in columns for value in column[row].tolist()])
+
+
+def _import_function(name):
+    module_name, function_name = name.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def main(argv):
+    """Entry point of chastesweep_aggregate.
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="Aggregate the outputs of a batch sweep into a single table")
+    parser.add_argument("output_dir", help="Output directory of the sweep, holding its params.json")
+    parser.add_argument("--output", action="append", default=[], metavar="NAME=PATH",
+                        help="Text file of each simulation's output directory to read as output NAME")
+    parser.add_argument("--function", metavar="MODULE:FUNCTION",
+                        help="Function of a simulation's output directory returning a dict of its outputs")
+    parser.add_argument("--table", default="results.npz", help="Table file in the output directory")
+    parser.add_argument("--csv", help="Also write the whole table to this CSV file, gzipped if it ends with .gz")
+    parser.add_argument("--processes", type=int, default=None, help="Number of processes, defaults to the core count")
+    args = parser.parse_args(argv[1:])
+
+    if bool(args.output) == bool(args.function):
+        print("Either --output or --function must be given")
+        return 1
+
+    if args.function:
+        outputs = _import_function(args.function)
+    else:
+        outputs = dict(output.split("=", 1) for output in args.output)
+
+    table = aggregate(args.output_dir, outputs, table_file_name=args.table, num_processes=args.processes)
+    if args.csv and table:
+        write_csv(table, args.csv)
+    return 0
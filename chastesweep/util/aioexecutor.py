@@ -0,0 +1,188 @@
+"""Running simulation instances as local child processes with asyncio,
+launching the executable directly from an argument list rather than through
+a shell. Needs Python 3.7.
+
+Each child's stdout and stderr are redirected straight to log files in its
+output directory, so nothing is read through pipes by the sweep and a chatty
+simulation can't fill a pipe buffer and stall. Children are reaped with
+os.wait4 on worker threads, which gives the resources each one used. run_commands is the coroutine
+for use within an event loop, run_async runs it to completion and takes the
+same arguments as executor.run_parallel, with the commands built by a
+SimulationLauncher created with argv=True.
+"""
+import os
+import signal
+import asyncio
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from chastesweep.util.executor import default_num_processes, wait_process
+
+STDOUT_LOG = "stdout.log"
+STDERR_LOG = "stderr.log"
+
+# Exit code reported when the executable can't be started, as a shell would
+NOT_FOUND_EXIT_CODE = 127
+
+
+def _signal_process(process, sig):
+    try:
+        os.killpg(process.pid, sig)
+    except OSError:
+        # Already exited
+        pass
+
+
+async def terminate_process(process, waiting, grace_period=5.0):
+    """Terminates a process started by run_process and its children, killing
+    them if they have not exited after the grace period.
+    :param waiting: Future of the process's wait_process
+    :return: Result of wait_process
+    """
+    _signal_process(process, signal.SIGTERM)
+    try:
+        return await asyncio.wait_for(asyncio.shield(waiting), grace_period)
+    except asyncio.TimeoutError:
+        _signal_process(process, signal.SIGKILL)
+        return await waiting
+
+
+async def run_process(argv, log_dir=None, timeout=None, grace_period=5.0, executor=None):
+    """Runs a single command to completion.
+    :param argv: List of the executable and its arguments
+    :param log_dir: Directory to write stdout.log and stderr.log to, or None to inherit this process's
+    :param timeout: Seconds after which the process is terminated, None to wait for as long as it takes
+    :param grace_period: Seconds a terminated process has to exit before it is killed
+    :param executor: Executor whose threads wait for the process, defaults to the loop's
+    :return: Tuple of (exit code, usage) as executor.wait_process, the exit code negative for the signal that
+        ended a process that was terminated
+    """
+    stdout = stderr = None
+    try:
+        if log_dir is not None:
+            stdout = open(os.path.join(log_dir, STDOUT_LOG), "wb")
+            stderr = open(os.path.join(log_dir, STDERR_LOG), "wb")
+
+        try:
+            # In its own session so the process and anything it spawns are terminated as a group
+            process = subprocess.Popen(argv, stdout=stdout, stderr=stderr, start_new_session=True)
+        except OSError as e:
+            print("Could not run {}: {}".format(argv[0], e))
+            return NOT_FOUND_EXIT_CODE, None
+
+        # The process is reaped with os.wait4 on a thread to collect the resources it used
+        waiting = asyncio.get_running_loop().run_in_executor(executor, wait_process, process)
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiting), timeout)
+        except asyncio.TimeoutError:
+            print("Command {} timed out after {} seconds, terminating".format(" ".join(argv), timeout))
+            return await terminate_process(process, waiting, grace_period)
+        except asyncio.CancelledError:
+            await terminate_process(process, waiting, grace_period)
+            raise
+    finally:
+        for log_file in (stdout, stderr):
+            if log_file is not None:
+                log_file.close()
+
+
+async def run_commands(commands, num_processes=None, on_finish=None, timeout=None, log_dir=None, retry=None):
+    """Runs commands, keeping at most num_processes of them running at once.
+
+    Commands are consumed lazily, a new one is only taken once a slot is free.
+    If cancelled, all running children are terminated before the cancellation
+    is passed on.
+    :param commands: Iterable of (task_id, argv) pairs
+    :param num_processes: Maximum number of concurrent processes, defaults to the core count
+    :param on_finish: Called with (task_id, exit code, usage) as each command finishes
+    :param timeout: Seconds after which a command is terminated, None for no limit
+    :param log_dir: Function of a task_id returning the directory its output is logged to, None for no logs
+    :param retry: Decides whether a failed command is run again, see executor.run_serial. A command waiting to
+        be retried doesn't take up a slot
+    :return: Dictionary of task_id to exit code
+    """
+    if num_processes is None:
+        num_processes = default_num_processes()
+
+    if num_processes < 1:
+        raise ValueError("Number of processes must be at least 1")
+
+    slots = asyncio.BoundedSemaphore(num_processes)
+    # a thread to wait for each running process
+    executor = ThreadPoolExecutor(num_processes)
+    running = set()
+    exit_codes = {}
+
+    async def run(task_id, argv):
+        holding_slot = True
+        try:
+            while True:
+                exit_codes[task_id], usage = await run_process(argv,
+                                                               log_dir(task_id) if log_dir is not None else None,
+                                                               timeout, executor=executor)
+                delay = retry(task_id, exit_codes[task_id], usage) \
+                    if retry is not None and exit_codes[task_id] != 0 else None
+                if delay is None:
+                    break
+                slots.release()
+                holding_slot = False
+                await asyncio.sleep(delay)
+                await slots.acquire()
+                holding_slot = True
+        finally:
+            if holding_slot:
+                slots.release()
+        if on_finish is not None:
+            on_finish(task_id, exit_codes[task_id], usage)
+
+    commands = iter(commands)
+    try:
+        while True:
+            await slots.acquire()
+            try:
+                task_id, argv = next(commands)
+            except StopIteration:
+                slots.release()
+                break
+            task = asyncio.ensure_future(run(task_id, argv))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        if running:
+            await asyncio.gather(*running)
+    except BaseException:
+        # Includes KeyboardInterrupt raised by the commands and the cancellation of this coroutine
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        raise
+    finally:
+        executor.shutdown(wait=False)
+
+    return exit_codes
+
+
+def run_async(commands, num_processes=None, on_finish=None, timeout=None, log_dir=None, retry=None):
+    """Runs run_commands in a new event loop, see run_commands. If interrupted
+    (e.g. Ctrl-C) all running children are terminated before the
+    KeyboardInterrupt is re-raised.
+    """
+    loop = asyncio.new_event_loop()
+    main = loop.create_task(run_commands(commands, num_processes, on_finish, timeout, log_dir, retry))
+    try:
+        return loop.run_until_complete(main)
+    except KeyboardInterrupt:
+        # Raised by the commands, run_commands has already cleaned up
+        if main.done():
+            main.exception()
+            raise
+        print("Interrupted, terminating running simulation(s)")
+        main.cancel()
+        try:
+            loop.run_until_complete(main)
+        except asyncio.CancelledError:
+            pass
+        raise
+    finally:
+        loop.close()
@@ -0,0 +1,212 @@
+"""Packing the output directories of finished simulations into tar archives,
+so a large sweep doesn't use an inode for every file its simulations write,
+and copying its results elsewhere moves a few large files rather than
+millions of small ones.
+
+>>> archive = RunArchive("sweep_results/archives")
+>>> archive.names(123)
+>>> archive.read(123, "results/size.txt")
+>>> archive.extract(123, "run_123")
+"""
+from __future__ import print_function
+import os
+import json
+import fcntl
+import errno
+import shutil
+import tarfile
+
+INDEX_SUFFIX = ".idx"
+
+
+class RunArchive:
+    """Each archive is an uncompressed tar file holding the output
+    directories of runs_per_archive consecutive simulation ids, e.g. 3.tar
+    for simulations 3000 to 3999. A simulation's files are stored under
+    <id>/ and appended to the end of the archive. Next to each archive an
+    index, <n>.tar.idx, gives the byte range of every simulation in it, one
+    JSON record per line, so a simulation's files are read without scanning
+    the rest of the archive.
+
+    Processes packing into the same archive take turns with an exclusive
+    flock on it, which works across nodes on NFS and on Lustre mounted with
+    the flock option. A simulation is only added to the index once its files
+    are written and synced, and its loose files are only removed after that,
+    so a packer that is killed part way loses nothing: the next packer
+    overwrites whatever it left past the indexed end of the archive. A
+    simulation packed again, e.g. after it was rerun, replaces the earlier
+    copy in the index.
+    """
+
+    def __init__(self, archive_dir, runs_per_archive=1000):
+        """
+        :param archive_dir: Directory of the archives and their indexes, created when first packed into
+        :param runs_per_archive: Number of consecutive simulation ids sharing an archive
+        """
+        if runs_per_archive < 1:
+            raise ValueError("Number of simulations per archive must be at least 1")
+        self.archive_dir = archive_dir
+        self.runs_per_archive = runs_per_archive
+        # index of each archive read so far, archive number: (size of its index file, {id: record})
+        self._indexes = {}
+
+    def settings(self):
+        """Keyword arguments recreating this archive, as stored in params.json."""
+        return {"archive_dir": self.archive_dir, "runs_per_archive": self.runs_per_archive}
+
+    def archive_path(self, task_id):
+        """Path of the archive a simulation is packed into."""
+        return os.path.join(self.archive_dir, "{}.tar".format(task_id // self.runs_per_archive))
+
+    def _read_index(self, archive_path):
+        # Records in the order they were written, leaving out one cut short by a killed packer
+        records = []
+        if not os.path.exists(archive_path + INDEX_SUFFIX):
+            return records
+        with open(archive_path + INDEX_SUFFIX, "rb") as index_file:
+            for line in index_file:
+                try:
+                    records.append(json.loads(line.decode("utf-8")))
+                except ValueError:
+                    continue
+        return records
+
+    def _indexed_end(self, archive_path, chunk_size=4096):
+        # End of the last simulation in the index, read back from the end of the index file so packing
+        # doesn't slow down as the archive fills up
+        if not os.path.exists(archive_path + INDEX_SUFFIX):
+            return 0
+        with open(archive_path + INDEX_SUFFIX, "rb") as index_file:
+            index_file.seek(0, os.SEEK_END)
+            end = index_file.tell()
+            size = min(chunk_size, end)
+            while size > 0:
+                index_file.seek(end - size)
+                lines = index_file.read(size).split(b"\n")
+                if size < end:
+                    # The first line may be the end of a record
+                    lines = lines[1:]
+                for line in reversed(lines):
+                    try:
+                        return json.loads(line.decode("utf-8"))["end"]
+                    except ValueError:
+                        continue
+                if size == end:
+                    break
+                size = min(size * 2, end)
+        return 0
+
+    def _index(self, task_id):
+        # Read again whenever the index file has grown, as another process packed into the archive
+        number = task_id // self.runs_per_archive
+        archive_path = self.archive_path(task_id)
+        try:
+            size = os.path.getsize(archive_path + INDEX_SUFFIX)
+        except OSError:
+            size = 0
+        if number not in self._indexes or self._indexes[number][0] != size:
+            self._indexes[number] = (size, dict((record["id"], record) for record in self._read_index(archive_path)))
+        return self._indexes[number][1]
+
+    def _record(self, task_id):
+        index = self._index(task_id)
+        if task_id not in index:
+            raise KeyError("Simulation {} is not in the archive".format(task_id))
+        return index[task_id]
+
+    def contains(self, task_id):
+        """Whether a simulation has been packed."""
+        try:
+            self._record(task_id)
+            return True
+        except KeyError:
+            return False
+
+    def pack(self, task_id, run_dir, remove=True):
+        """Append a simulation's output directory to its archive.
+        :param task_id:
+        :param run_dir: Output directory of the simulation
+        :param remove: Remove the output directory once it is packed
+        """
+        try:
+            os.makedirs(self.archive_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        archive_path = self.archive_path(task_id)
+        fd = os.open(archive_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+b") as archive_file:
+            # Released when the file is closed
+            fcntl.flock(archive_file.fileno(), fcntl.LOCK_EX)
+            end = self._indexed_end(archive_path)
+
+            archive_file.seek(end)
+            archive_file.truncate()
+            tar = tarfile.open(fileobj=archive_file, mode="w", format=tarfile.GNU_FORMAT)
+            try:
+                start = tar.offset
+                tar.add(run_dir, arcname=str(task_id))
+                end = tar.offset
+            finally:
+                # Ends the archive with the end-of-archive blocks, overwritten by the next simulation packed
+                tar.close()
+            archive_file.flush()
+            os.fsync(archive_file.fileno())
+
+            record = {"id": task_id, "start": start, "end": end}
+            index_fd = os.open(archive_path + INDEX_SUFFIX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(index_fd, (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8"))
+                os.fsync(index_fd)
+            finally:
+                os.close(index_fd)
+
+        if remove:
+            shutil.rmtree(run_dir)
+
+    def _members(self, task_id):
+        # Generator of (tar, member, path relative to the simulation's output directory) of a packed simulation
+        record = self._record(task_id)
+        prefix = str(task_id)
+        with open(self.archive_path(task_id), "rb") as archive_file:
+            archive_file.seek(record["start"])
+            tar = tarfile.TarFile(fileobj=archive_file, mode="r")
+            member = tar.next()
+            while member is not None and member.offset < record["end"]:
+                if member.name != prefix:
+                    yield tar, member, member.name[len(prefix) + 1:]
+                member = tar.next()
+
+    def names(self, task_id):
+        """Paths of the files a packed simulation wrote, relative to its output directory.
+        :raises KeyError: If the simulation has not been packed
+        """
+        return [name for tar, member, name in self._members(task_id) if member.isfile()]
+
+    def read(self, task_id, name):
+        """Contents of a file a packed simulation wrote.
+        :param name: Path of the file relative to the simulation's output directory
+        :return: bytes
+        :raises KeyError: If the simulation has not been packed or did not write the file
+        """
+        for tar, member, member_name in self._members(task_id):
+            if member_name == name and member.isfile():
+                return tar.extractfile(member).read()
+        raise KeyError("Simulation {} has no file {} in the archive".format(task_id, name))
+
+    def extract(self, task_id, dest_dir):
+        """Extract a packed simulation's files into dest_dir, as they were in its output directory.
+        :raises KeyError: If the simulation has not been packed
+        """
+        # Only regular files and directories, as written by the simulation
+        for tar, member, name in self._members(task_id):
+            path = os.path.join(dest_dir, name)
+            if member.isdir():
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+            elif member.isfile():
+                if not os.path.isdir(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                with open(path, "wb") as out_file:
+                    shutil.copyfileobj(tar.extractfile(member), out_file)
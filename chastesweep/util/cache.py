@@ -0,0 +1,212 @@
+"""Content addressed cache of simulation outputs, so that a simulation already
+run in an earlier sweep does not have to be run again."""
+from __future__ import print_function
+import os
+import json
+import fcntl
+import errno
+import shutil
+import hashlib
+
+from chastesweep.util.paramstore import json_default
+
+# file in the cache directory holding the total size of its entries
+SIZE_FILE_NAME = "size"
+
+
+def executable_hash(path, block_size=1 << 20):
+    """SHA-256 of the contents of an executable."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as exec_file:
+        block = exec_file.read(block_size)
+        while block:
+            digest.update(block)
+            block = exec_file.read(block_size)
+    return digest.hexdigest()
+
+
+def cache_key(exec_hash, params, repeat_index):
+    """Key of a simulation, the hash of its executable's contents, its
+    parameters and its repeat index. Parameters are canonicalised by sorting
+    their names and converting NumPy scalars, so the same values always give
+    the same key."""
+    canonical = json.dumps({"exec": exec_hash, "params": params, "repeat": repeat_index},
+                           sort_keys=True, separators=(",", ":"), default=json_default)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _copy_tree(src, dst, link):
+    # Like shutil.copytree into an existing directory, hard linking files when possible
+    for name in os.listdir(src):
+        src_path = os.path.join(src, name)
+        dst_path = os.path.join(dst, name)
+        if os.path.isdir(src_path) and not os.path.islink(src_path):
+            os.mkdir(dst_path)
+            _copy_tree(src_path, dst_path, link)
+            continue
+        if link and not os.path.islink(src_path):
+            try:
+                os.link(src_path, dst_path)
+                continue
+            except OSError:
+                # e.g. cache and output on different filesystems
+                pass
+        shutil.copy2(src_path, dst_path)
+
+
+def _tree_size(path):
+    size = 0
+    for dir_path, dir_names, file_names in os.walk(path):
+        for name in file_names:
+            size += os.lstat(os.path.join(dir_path, name)).st_size
+    return size
+
+
+class ResultCache:
+    """Cache of simulation output directories, keyed by cache_key.
+
+    Entries are stored under cache_dir/<first 2 characters of key>/<key>. Each
+    holds the cached output in "data" and its size in bytes in "size". The
+    modification time of an entry is updated whenever it is used, and the
+    least recently used entries are evicted once the cache grows beyond
+    max_bytes. New entries are copied to a temporary directory and renamed into
+    place, so concurrent sweeps never see a partial entry.
+
+    The total size of the entries is kept in cache_dir/size, which every store
+    adds to while holding an exclusive flock on it. The entries are only
+    listed to evict some of them once the total is beyond max_bytes, rather
+    than each time a simulation is stored.
+    """
+
+    def __init__(self, cache_dir, max_bytes=None, link=True):
+        """
+        :param cache_dir: Directory holding the cache, created if needed
+        :param max_bytes: Size limit of the cache, unlimited if None
+        :param link: Hard link files between the cache and output directories instead of copying them
+        """
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+        self.max_bytes = max_bytes
+        self.link = link
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def lookup(self, key, output_dir):
+        """Fill output_dir with the cached output of key, if there is one.
+        :return: True on a cache hit
+        """
+        entry_path = self._entry_path(key)
+        if not os.path.isdir(entry_path):
+            self.misses += 1
+            return False
+
+        try:
+            _copy_tree(os.path.join(entry_path, "data"), output_dir, self.link)
+            os.utime(entry_path, None)
+        except (IOError, OSError):
+            # Evicted by another sweep while copying
+            for name in os.listdir(output_dir):
+                path = os.path.join(output_dir, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            self.misses += 1
+            return False
+
+        self.hits += 1
+        return True
+
+    def store(self, key, output_dir):
+        """Add the output of a successful simulation to the cache."""
+        entry_path = self._entry_path(key)
+        if os.path.isdir(entry_path):
+            return
+
+        parent_dir = os.path.dirname(entry_path)
+        if not os.path.exists(parent_dir):
+            try:
+                os.makedirs(parent_dir)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        tmp_path = "{}.tmp.{}".format(entry_path, os.getpid())
+        os.mkdir(tmp_path)
+        try:
+            os.mkdir(os.path.join(tmp_path, "data"))
+            _copy_tree(output_dir, os.path.join(tmp_path, "data"), self.link)
+            size = _tree_size(os.path.join(tmp_path, "data"))
+            with open(os.path.join(tmp_path, "size"), "w") as size_file:
+                size_file.write(str(size))
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # Another sweep stored the same key first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            if not os.path.isdir(entry_path):
+                raise
+            return
+
+        self._update_total(size, self.max_bytes)
+
+    def _update_total(self, change, max_bytes=None, force=False):
+        # Add change to the total size in the size file, evicting entries if the total is beyond max_bytes, or
+        # whatever it is with force. The total is counted from the entries if the file is new or unreadable.
+        fd = os.open(os.path.join(self.cache_dir, SIZE_FILE_NAME), os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as size_file:
+            # Released when the file is closed
+            fcntl.flock(size_file.fileno(), fcntl.LOCK_EX)
+            try:
+                total = int(size_file.read()) + change
+            except ValueError:
+                total = self.size()
+            if max_bytes is not None and (force or total > max_bytes):
+                total = self._evict(max_bytes)
+            size_file.seek(0)
+            size_file.truncate()
+            size_file.write(str(total))
+        return total
+
+    def entries(self):
+        """List of (last used time, size, path) of every complete entry."""
+        entries = []
+        for prefix in os.listdir(self.cache_dir):
+            prefix_path = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_path):
+                continue
+            for key in os.listdir(prefix_path):
+                entry_path = os.path.join(prefix_path, key)
+                try:
+                    with open(os.path.join(entry_path, "size"), "r") as size_file:
+                        size = int(size_file.read())
+                    entries.append((os.stat(entry_path).st_mtime, size, entry_path))
+                except (IOError, OSError, ValueError):
+                    # Temporary directories of entries being stored
+                    continue
+        return entries
+
+    def size(self):
+        """Total size in bytes of the cached outputs."""
+        return sum(size for last_used, size, entry_path in self.entries())
+
+    def evict(self, max_bytes):
+        """Remove the least recently used entries until the cache is no larger than max_bytes."""
+        self._update_total(0, max_bytes, force=True)
+
+    def _evict(self, max_bytes):
+        # Called with the size file locked, returns the size left
+        entries = sorted(self.entries())
+        total = sum(size for last_used, size, entry_path in entries)
+        for last_used, size, entry_path in entries:
+            if total <= max_bytes:
+                break
+            shutil.rmtree(entry_path, ignore_errors=True)
+            total -= size
+        return total
+
+    def summary(self):
+        return "Result cache: {} hits, {} misses".format(self.hits, self.misses)
@@ -0,0 +1,226 @@
+"""A SQLite catalogue of the simulations of a sweep, for looking simulations
+up by their parameters or status without reading the whole parameter file or
+walking the output directories.
+
+>>> catalogue = Catalogue("sweep_results/sweep.db")
+>>> catalogue.query("c >= ? AND status = ?", (14, FAILED))
+>>> catalogue.lookup(a=2.5)
+
+Local sweeps keep their catalogue up to date as they run. The array jobs of a
+batch sweep, which may run on any node, only write the ledger, and the
+catalogue written by generate_batch_output is brought up to date from it with
+chastesweep_catalogue or Catalogue.update_from_ledger.
+"""
+from __future__ import print_function
+import os
+import json
+import sqlite3
+import argparse
+
+from chastesweep.util.ledger import Ledger
+from chastesweep.util.paramstore import json_default
+
+# Columns of every simulation apart from its parameters, filled in from the ledger as it runs
+TASK_COLUMNS = ["id", "repeat_index", "output_dir", "status", "exit_code", "start", "end", "wall", "host", "user",
+                "sys", "maxrss", "cached"]
+_LEDGER_COLUMNS = TASK_COLUMNS[3:]
+
+
+def _quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def _sql_value(value):
+    # SQLite takes numbers and strings, anything else (e.g. a list) is stored as JSON
+    if hasattr(value, "item") and not isinstance(value, (list, dict)):
+        try:
+            value = value.item()
+        except (TypeError, ValueError):
+            pass
+    if value is None or isinstance(value, (int, float, str)) or type(value).__name__ in ("long", "unicode"):
+        return value
+    return json.dumps(value, default=json_default)
+
+
+class Catalogue:
+    """One row per simulation in the table tasks, with a column per parameter
+    as well as the columns in TASK_COLUMNS. Every parameter column is indexed.
+
+    The database is in WAL mode, so readers don't block the writers, and
+    writers on the same node wait their turn rather than failing. As with any
+    SQLite database it should not be written from several nodes over a network
+    filesystem, so runs on a cluster are best catalogued on one node from the
+    ledger with update_from_ledger.
+    """
+
+    # simulations inserted per statement when adding many at once
+    batch_size = 10000
+
+    def __init__(self, path, timeout=60.0):
+        """
+        :param path: Database file, created if it doesn't exist
+        :param timeout: Seconds a writer waits for another to finish
+        """
+        self.path = path
+        self._connection = sqlite3.connect(path, timeout=timeout)
+        self._connection.row_factory = sqlite3.Row
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, repeat_index INTEGER, "
+                                     "output_dir TEXT, status TEXT, exit_code INTEGER, start REAL, \"end\" REAL, "
+                                     "wall REAL, host TEXT, user REAL, sys REAL, maxrss INTEGER, cached INTEGER)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status)")
+        self._columns = self._table_columns()
+
+    def _table_columns(self):
+        return [row[1] for row in self._connection.execute("PRAGMA table_info(tasks)")]
+
+    @property
+    def param_names(self):
+        """Names of the parameter columns."""
+        return [name for name in self._columns if name not in TASK_COLUMNS]
+
+    def _add_param_columns(self, names):
+        for name in names:
+            self._connection.execute("ALTER TABLE tasks ADD COLUMN {}".format(_quote(name)))
+            self._connection.execute("CREATE INDEX IF NOT EXISTS {} ON tasks ({})"
+                                     .format(_quote("tasks_param_" + name), _quote(name)))
+        self._columns = self._table_columns()
+
+    def add_tasks(self, tasks):
+        """Add simulations, leaving any already in the catalogue as they are.
+        :param tasks: Iterable of (simulation id, parameter dict, repeat index, output directory)
+        """
+        batch = []
+        for task in tasks:
+            batch.append(task)
+            if len(batch) >= self.batch_size:
+                self._insert(batch)
+                batch = []
+        if batch:
+            self._insert(batch)
+
+    def _insert(self, tasks):
+        names = set()
+        for task_id, params, repeat_index, output_dir in tasks:
+            names.update(params)
+        clashes = sorted(names.intersection(TASK_COLUMNS))
+        if clashes:
+            raise ValueError("Parameters {} have the same names as columns of the catalogue".format(", ".join(clashes)))
+        with self._connection:
+            new_names = sorted(names - set(self._columns))
+            if new_names:
+                self._add_param_columns(new_names)
+            names = sorted(names)
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO tasks (id, repeat_index, output_dir{}) VALUES (?, ?, ?{})"
+                .format("".join(", " + _quote(name) for name in names), ", ?" * len(names)),
+                [[task_id, repeat_index, output_dir] + [_sql_value(params.get(name)) for name in names]
+                 for task_id, params, repeat_index, output_dir in tasks])
+
+    def track(self, records, first_task, output_dir_func):
+        """Generator passing on (parameter dict, number of repeats) records,
+        such as those being written to a parameter file, while adding their
+        simulations to the catalogue.
+        :param records: Iterable of (parameter dict, number of repeats)
+        :param first_task: Id of the first simulation
+        :param output_dir_func: Function of a simulation id returning its output directory
+        """
+        task_id = first_task
+        batch = []
+        for params, repeats in records:
+            for repeat_index in range(repeats):
+                batch.append((task_id, params, repeat_index, output_dir_func(task_id)))
+                task_id += 1
+            if len(batch) >= self.batch_size:
+                self._insert(batch)
+                batch = []
+            yield params, repeats
+        if batch:
+            self._insert(batch)
+
+    def _update(self, record):
+        # A record that isn't a full status change leaves the other columns as they were
+        columns = [name for name in _LEDGER_COLUMNS if name in record]
+        self._connection.execute("UPDATE tasks SET {} WHERE id = ?".format(
+            ", ".join("{} = ?".format(_quote(name)) for name in columns)),
+            [_sql_value(record[name]) for name in columns] + [record["id"]])
+
+    def record(self, record):
+        """Update a simulation from a ledger record."""
+        with self._connection:
+            self._update(record)
+
+    def update_from_ledger(self, ledger):
+        """Bring the status of every simulation up to date with a ledger."""
+        with self._connection:
+            for record in ledger.read().values():
+                self._update(record)
+
+    def query(self, where=None, args=(), order_by="id"):
+        """Simulations matching an SQL condition on the columns.
+        :param where: e.g. "c >= ? AND status = 'failed'", None for every simulation
+        :param args: Values of the ? placeholders in where
+        :param order_by: SQL ordering of the results
+        :return: List of dicts of column: value
+        """
+        sql = "SELECT * FROM tasks"
+        if where:
+            sql += " WHERE " + where
+        if order_by:
+            sql += " ORDER BY " + order_by
+        return [dict(zip(row.keys(), row)) for row in self._connection.execute(sql, args)]
+
+    def lookup(self, **params):
+        """Simulations whose parameters equal the given values, e.g. lookup(a=2.5, b=1)."""
+        names = sorted(params)
+        unknown = [name for name in names if name not in self._columns]
+        if unknown:
+            raise KeyError("No such parameters: {}".format(", ".join(unknown)))
+        return self.query(" AND ".join("{} = ?".format(_quote(name)) for name in names),
+                          [_sql_value(params[name]) for name in names])
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def close(self):
+        self._connection.close()
+
+
+def remove_catalogue(path):
+    """Remove a catalogue along with its write-ahead log."""
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def main(argv):
+    """Entry point of chastesweep_catalogue.
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="Bring a sweep's catalogue up to date with its ledger and list the "
+                                                 "simulations matching a condition, one JSON record per line")
+    parser.add_argument("output_dir", help="Output directory of the sweep")
+    parser.add_argument("--where", help="SQL condition on the parameters and the columns {}, e.g. "
+                                        "\"c >= 14 AND status = 'failed'\"".format(", ".join(TASK_COLUMNS)))
+    parser.add_argument("--catalogue", default="sweep.db", help="File name of the catalogue in output_dir")
+    parser.add_argument("--ledger", default="ledger.jsonl", help="File name of the ledger in output_dir")
+    args = parser.parse_args(argv[1:])
+
+    path = os.path.join(args.output_dir, args.catalogue)
+    if not os.path.exists(path):
+        print("No catalogue {}, generate the sweep with catalogue=True".format(path))
+        return 1
+    catalogue = Catalogue(path)
+    try:
+        catalogue.update_from_ledger(Ledger(os.path.join(args.output_dir, args.ledger)))
+        for row in catalogue.query(args.where):
+            print(json.dumps(row, sort_keys=True))
+    except sqlite3.OperationalError as e:
+        print("Invalid condition: {}".format(e))
+        return 2
+    finally:
+        catalogue.close()
+    return 0
@@ -0,0 +1,148 @@
+"""Predicting the run time of simulations from their parameters, and packing
+simulations into array jobs of roughly equal predicted run time."""
+from __future__ import print_function
+import os
+import json
+import heapq
+import math
+import numbers
+import numpy as np
+
+from chastesweep.util.ledger import Ledger, DONE
+from chastesweep.util.paramstore import json_default
+from chastesweep.util.paramtable import compact_records
+from chastesweep.util.runner import BatchSweep
+
+
+def pack_tasks(task_ids, costs, num_jobs):
+    """Pack simulations into jobs with the longest processing time first
+    heuristic. Simulations are taken from the most to the least costly, each
+    going to the job with the least predicted run time so far.
+    :param task_ids: Ids of the simulations
+    :param costs: Predicted run time of each simulation
+    :param num_jobs: Number of jobs, at most one per simulation is used
+    :return: List holding a list of simulation ids for each job, most costly first
+    """
+    num_jobs = min(num_jobs, len(task_ids))
+    jobs = [[] for _ in range(num_jobs)]
+    # (predicted run time, job), a sorted list is already a heap
+    loads = [(0.0, job) for job in range(num_jobs)]
+    for i in sorted(range(len(task_ids)), key=lambda i: costs[i], reverse=True):
+        load, job = heapq.heappop(loads)
+        jobs[job].append(task_ids[i])
+        heapq.heappush(loads, (load + costs[i], job))
+    return jobs
+
+
+def predict_costs(cost_model, expanded_output):
+    """Predicted run time of each simulation of an expanded sweep. The cost
+    model is called once for each distinct parameter set.
+    :param cost_model: Function of a parameter dict returning its predicted run time, e.g. a CostModel
+    :param expanded_output: ParamTable or list of parameter dicts
+    :return: List of predicted run times
+    """
+    return record_costs(cost_model, compact_records(expanded_output))
+
+
+def record_costs(cost_model, records):
+    """Predicted run time of each simulation of a sweep given as records.
+    :param cost_model: Function of a parameter dict returning its predicted run time, e.g. a CostModel
+    :param records: Iterable of (parameter dict, number of repeats), e.g. a shard's records
+    :return: List of predicted run times
+    """
+    costs = []
+    for params, repeats in records:
+        costs.extend([float(cost_model(params))] * repeats)
+    return costs
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True, default=json_default)
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+class CostModel:
+    """Predicts the wall time of a simulation from its parameters, fitted to
+    the wall times of simulations that have already run.
+
+    A parameter set that has been run before is predicted by the mean of its
+    times. Any other is predicted by a least squares fit of the log wall time
+    to the numeric parameters and the logs of those that are always positive,
+    which captures power laws in e.g. mesh size or end time. Parameters that
+    are not numbers are ignored by the fit.
+    """
+
+    # wall times are clipped to this before taking logs
+    min_wall = 1e-3
+
+    def __init__(self, samples):
+        """
+        :param samples: Iterable of (parameter dict, wall time in seconds)
+        """
+        samples = list(samples)
+        if not samples:
+            raise ValueError("No completed simulations to fit the cost model to")
+
+        # key of a parameter set: [total wall time, number of runs]
+        self._known = {}
+        for params, wall in samples:
+            totals = self._known.setdefault(_params_key(params), [0.0, 0])
+            totals[0] += wall
+            totals[1] += 1
+
+        # numeric parameters of every sample, and which of those can be logged
+        names = set(samples[0][0].keys())
+        for params, wall in samples:
+            names &= set(key for key, value in params.items() if _is_number(value))
+        self._names = sorted(names)
+        self._log_names = [name for name in self._names if all(params[name] > 0 for params, wall in samples)]
+
+        features = np.array([self._features(params) for params, wall in samples])
+        log_wall = np.log(np.maximum([wall for params, wall in samples], self.min_wall))
+        self._coefficients = np.linalg.lstsq(features, log_wall, rcond=None)[0]
+        self._mean_log_wall = float(np.mean(log_wall))
+
+    def _features(self, params):
+        features = [1.0]
+        features.extend(float(params[name]) for name in self._names)
+        features.extend(math.log(params[name]) for name in self._log_names)
+        return features
+
+    def __call__(self, params):
+        """Predicted wall time of a parameter dict in seconds."""
+        totals = self._known.get(_params_key(params))
+        if totals is not None:
+            return totals[0] / totals[1]
+
+        try:
+            log_wall = float(np.dot(self._coefficients, self._features(params)))
+        except (KeyError, TypeError, ValueError):
+            # parameters the fit can't use, predict the typical run time
+            log_wall = self._mean_log_wall
+        return math.exp(min(log_wall, 700.0))
+
+    @classmethod
+    def from_sweep(cls, output_dir, parameters=None, ledger_file_name="ledger.jsonl"):
+        """Fit a cost model to the simulations of an earlier sweep that
+        succeeded, with the wall times recorded in its ledger. Results taken
+        from the cache are skipped.
+        :param output_dir: Output directory of the sweep
+        :param parameters: Expanded parameters of a local sweep. A batch sweep's are read from its params.json
+        :param ledger_file_name: Ledger of a local sweep
+        :return: CostModel
+        """
+        if parameters is not None:
+            records = Ledger(os.path.join(output_dir, ledger_file_name)).read()
+            return cls((parameters[task_id], record["wall"]) for task_id, record in sorted(records.items())
+                       if record["status"] == DONE and not record.get("cached"))
+
+        sweep = BatchSweep(output_dir)
+        try:
+            records = Ledger(sweep.ledger_path).read()
+            return cls([(sweep.params(task_id), record["wall"]) for task_id, record in sorted(records.items())
+                        if record["status"] == DONE and not record.get("cached")])
+        finally:
+            sweep.close()
@@ -0,0 +1,436 @@
+"""Helpers for running simulation instances as local child processes."""
+from __future__ import print_function
+import os
+import sys
+import time
+import errno
+import shutil
+import signal
+import subprocess
+import multiprocessing
+
+from chastesweep.util.cache import executable_hash, cache_key
+from chastesweep.util.ledger import DONE, FAILED
+from chastesweep.util.layout import FLAT
+
+
+def build_command(exec_cmd, output_dir, params):
+    """Builds the shell command used to run a single simulation instance.
+    :param exec_cmd: Path of the simulation executable
+    :param output_dir: Output directory of this simulation instance
+    :param params: Dictionary of parameter names and values
+    :return: Command string in the form "exec_cmd output_dir=... name=value ..."
+    """
+    param_string = ""
+    for key, value in params.items():
+        param_string = param_string + " {}={}".format(key, value)
+    return "{} output_dir={}{}".format(exec_cmd, output_dir, param_string)
+
+
+def build_argv(exec_cmd, output_dir, params):
+    """Builds the argument list of a single simulation instance, the same
+    arguments as build_command but run directly rather than through a shell,
+    so values are passed as they are without any quoting.
+    :return: List of [exec_cmd, "output_dir=...", "name=value", ...]
+    """
+    argv = [exec_cmd, "output_dir={}".format(output_dir)]
+    for key, value in params.items():
+        argv.append("{}={}".format(key, value))
+    return argv
+
+
+def simulation_output_dir(output_dir, simulation_id, layout=FLAT):
+    """Output directory of a single simulation of the sweep in output_dir.
+    :param layout: OutputLayout of the sweep, see util.layout
+    """
+    return layout.path(output_dir, simulation_id)
+
+
+def create_simulation_dir(output_dir, simulation_id, completed=None, layout=FLAT):
+    """Creates the output directory of a single simulation.
+    :param output_dir: Output directory of the whole sweep
+    :param simulation_id:
+    :param completed: When resuming a sweep, the set of ids of simulations that have already completed. The
+        output of any other simulation is assumed to be incomplete and is removed so it can be run again.
+    :param layout: OutputLayout of the sweep, see util.layout
+    :return: The simulation's output directory, or None if the simulation should not be run
+    """
+    # Create a folder to store simulation results
+    simulation_instance_output_dir = simulation_output_dir(output_dir, simulation_id, layout)
+    if os.path.exists(simulation_instance_output_dir):
+        if completed is None:
+            print("Output directory for simulation id {} already exists, aborting".format(simulation_id))
+            return None
+        elif simulation_id in completed:
+            print("Simulation id {} has already completed, skipping".format(simulation_id))
+            return None
+
+        print("Removing incomplete output of simulation id {}".format(simulation_id))
+        shutil.rmtree(simulation_instance_output_dir)
+
+    layout.make_parents(output_dir, simulation_id)
+    os.mkdir(simulation_instance_output_dir)
+    return simulation_instance_output_dir
+
+
+class SimulationLauncher:
+    """Turns the simulations of a sweep into the (id, command) pairs taken by
+    run_serial and run_parallel, and handles what happens around each run:
+    creating its output directory, recording it in the ledger and, when a
+    result cache is given, reusing a cached output instead of running it.
+    Pass commands() as the commands and finished as the on_finish callback.
+    With argv set the commands are argument lists, as taken by aioexecutor.
+
+    With an ExecutionPolicy, pass retry as the runner's retry callback and the
+    policy's timeout as its timeout. Once the policy's circuit breaker trips,
+    the remaining simulations are recorded as skipped rather than run.
+    """
+
+    def __init__(self, output_dir, exec_cmd, ledger, completed=None, cache=None, skipped_exit_code=None,
+                 repeat_param=None, argv=False, policy=None, layout=FLAT, archive=None):
+        """
+        :param output_dir: Output directory of the whole sweep
+        :param exec_cmd:
+        :param ledger: Ledger of the sweep
+        :param completed: Ids of completed simulations when resuming, see create_simulation_dir
+        :param cache: Optional ResultCache
+        :param skipped_exit_code: Exit code reported for simulations that are not run
+        :param repeat_param: If given, the repeat index of each simulation is passed to it as this parameter
+        :param argv: Build argument lists with build_argv rather than shell commands
+        :param policy: Optional ExecutionPolicy, see util.policy
+        :param layout: OutputLayout of the sweep, see util.layout
+        :param archive: Optional RunArchive each finished simulation's output directory is packed into, see
+            util.archive
+        """
+        self.output_dir = output_dir
+        self.exec_cmd = exec_cmd
+        self.ledger = ledger
+        self.completed = completed
+        self.cache = cache
+        self.skipped_exit_code = skipped_exit_code
+        self.repeat_param = repeat_param
+        self._build = build_argv if argv else build_command
+        self.exec_hash = executable_hash(exec_cmd) if cache is not None else None
+        self.policy = policy
+        self.layout = layout
+        self.archive = archive
+        self.breaker = policy.circuit_breaker() if policy is not None else None
+        # exit code of every simulation handled so far
+        self.exit_codes = {}
+        self._cache_keys = {}
+        # number of times each simulation being retried has run
+        self._attempts = {}
+
+    def commands(self, simulations):
+        """Generator of the commands of the simulations that need to be run.
+        :param simulations: Iterable of (simulation id, parameter dict, repeat index)
+        """
+        for simulation_id, params, repeat_index in simulations:
+            if self.breaker is not None and self.breaker.tripped:
+                self.ledger.skipped(simulation_id)
+                self.exit_codes[simulation_id] = self.skipped_exit_code
+                continue
+
+            # A packed simulation has no output directory to show it has completed
+            if self.archive is not None and self.completed is not None and simulation_id in self.completed and \
+                    self.archive.contains(simulation_id):
+                print("Simulation id {} has already completed and been archived, skipping".format(simulation_id))
+                self.exit_codes[simulation_id] = self.skipped_exit_code
+                continue
+
+            simulation_instance_output_dir = create_simulation_dir(self.output_dir, simulation_id, self.completed,
+                                                                   self.layout)
+            if simulation_instance_output_dir is None:
+                self.exit_codes[simulation_id] = self.skipped_exit_code
+                continue
+
+            if self.cache is not None:
+                key = cache_key(self.exec_hash, params, repeat_index)
+                if self.cache.lookup(key, simulation_instance_output_dir):
+                    print("Simulation ID {} found in the result cache".format(simulation_id))
+                    self.ledger.cached(simulation_id)
+                    self.exit_codes[simulation_id] = 0
+                    self._pack(simulation_id)
+                    continue
+                self._cache_keys[simulation_id] = key
+
+            if self.repeat_param is not None:
+                params = dict(params)
+                params[self.repeat_param] = repeat_index
+
+            print("Running simulation ID {}, outputting to {}".format(simulation_id, simulation_instance_output_dir))
+            self.ledger.started(simulation_id)
+            yield simulation_id, self._build(self.exec_cmd, simulation_instance_output_dir, params)
+
+    def finished(self, simulation_id, exit_code, usage=None):
+        """Records a finished simulation, adding its output to the cache if it succeeded and packing it into the
+        archive if there is one."""
+        self.exit_codes[simulation_id] = exit_code
+        self.ledger.finished(simulation_id, exit_code, usage)
+        self._attempts.pop(simulation_id, None)
+        key = self._cache_keys.pop(simulation_id, None)
+        if key is not None and exit_code == 0:
+            self.cache.store(key, simulation_output_dir(self.output_dir, simulation_id, self.layout))
+        self._pack(simulation_id)
+
+        if self.breaker is not None and not self.breaker.tripped:
+            self.breaker.record(exit_code != 0)
+            if self.breaker.tripped:
+                print("{:.0%} of the last {} simulations failed, skipping the simulations not yet started"
+                      .format(self.breaker.failure_rate(), self.policy.window))
+
+    def _pack(self, simulation_id):
+        if self.archive is None:
+            return
+        simulation_instance_output_dir = simulation_output_dir(self.output_dir, simulation_id, self.layout)
+        try:
+            self.archive.pack(simulation_id, simulation_instance_output_dir)
+        except (IOError, OSError) as e:
+            print("Could not archive the output of simulation ID {}, leaving it in {}: {}"
+                  .format(simulation_id, simulation_instance_output_dir, e))
+
+    def resume_breaker(self):
+        """Start the circuit breaker from the simulations that finished last
+        according to the ledger, whichever process of the sweep ran them."""
+        if self.breaker is None:
+            return
+        for record in self.ledger.tail(4 * self.policy.window):
+            # as in finished(), only the outcome of each simulation counts, not the attempts that were retried
+            if record["status"] in (DONE, FAILED) and not record.get("cached") and not record.get("retry"):
+                self.breaker.record(record["status"] == FAILED)
+        if self.breaker.tripped:
+            print("{:.0%} of the last {} simulations of the sweep failed, skipping this job's simulations"
+                  .format(self.breaker.failure_rate(), self.policy.window))
+
+    def retry(self, simulation_id, exit_code, usage=None):
+        """Decides whether a failed simulation is run again, as the retry
+        callback of the runners. The failed run is recorded in the ledger and
+        its output removed.
+        :return: Seconds to wait before running it again, or None to record it as finished with finished()
+        """
+        if self.policy is None:
+            return None
+        attempt = self._attempts.get(simulation_id, 1)
+        delay = self.policy.retry_delay(exit_code, attempt)
+        if delay is None:
+            return None
+        self._attempts[simulation_id] = attempt + 1
+
+        self.ledger.finished(simulation_id, exit_code, usage, retry=True)
+        print("Simulation ID {} failed with exit code {}, running it again in {} seconds (retry {} of {})"
+              .format(simulation_id, exit_code, delay, attempt, self.policy.retries))
+        simulation_instance_output_dir = simulation_output_dir(self.output_dir, simulation_id, self.layout)
+        shutil.rmtree(simulation_instance_output_dir, ignore_errors=True)
+        os.mkdir(simulation_instance_output_dir)
+        self.ledger.started(simulation_id, time.time() + delay)
+        return delay
+
+
+def default_num_processes():
+    """Number of simulations to keep running at once when not specified, i.e. the core count."""
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def _exit_code(status):
+    # Exit code from a wait status, negative for the signal that ended the process as in Popen.returncode
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _usage(rusage):
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    maxrss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss
+    return {"user": rusage.ru_utime, "sys": rusage.ru_stime, "maxrss": maxrss}
+
+
+def wait_process(process, block=True):
+    """Waits for a process started with subprocess.Popen to exit, collecting
+    the resources it used. The usage covers the process and every descendant
+    it waited for, e.g. a simulation started by a shell.
+    :param process: subprocess.Popen
+    :param block: Wait for the process to exit, otherwise return None if it is still running
+    :return: Tuple of (exit code, usage) where usage is a dict of the user and sys CPU seconds and the peak
+        resident set size maxrss in kilobytes, or None where the platform has no os.wait4
+    """
+    if process.returncode is not None:
+        return process.returncode, None
+
+    if not hasattr(os, "wait4"):
+        exit_code = process.wait() if block else process.poll()
+        return None if exit_code is None else (exit_code, None)
+
+    while True:
+        try:
+            pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+            break
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+            if e.errno == errno.ECHILD:
+                # Already reaped elsewhere
+                return process.wait(), None
+            raise
+    if pid == 0:
+        return None
+    # Popen must not try to reap the process again
+    process.returncode = _exit_code(status)
+    return process.returncode, _usage(rusage)
+
+
+def _start_process(cmd):
+    # Each child gets its own session so it (and anything its shell spawns)
+    # can be terminated as a group
+    if hasattr(os, "setsid"):
+        return subprocess.Popen(cmd, shell=True, preexec_fn=os.setsid)
+    return subprocess.Popen(cmd, shell=True)
+
+
+def _signal_process(process, sig):
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except OSError:
+        # Already exited
+        pass
+
+
+def terminate_processes(processes, grace_period=5.0, poll_interval=0.05):
+    """Terminates the given processes, killing any that have not exited after the grace period."""
+    processes = [p for p in processes if p.poll() is None]
+    for process in processes:
+        _signal_process(process, signal.SIGTERM)
+
+    deadline = time.time() + grace_period
+    while time.time() < deadline and any(p.poll() is None for p in processes):
+        time.sleep(poll_interval)
+
+    for process in processes:
+        if process.poll() is None:
+            _signal_process(process, signal.SIGKILL)
+            process.wait()
+
+
+def _retry_delay(retry, task_id, exit_code, usage):
+    if retry is None or exit_code == 0:
+        return None
+    return retry(task_id, exit_code, usage)
+
+
+def run_serial(commands, on_finish=None, timeout=None, retry=None, poll_interval=0.05):
+    """Runs shell commands one after another.
+    :param commands: Iterable of (task_id, command) pairs
+    :param on_finish: Called with (task_id, exit code, usage) as each command finishes, see wait_process
+    :param timeout: Seconds after which a command is terminated, None for no limit. The exit code of a terminated
+        command is minus the signal that ended it
+    :param retry: Called with (task_id, exit code, usage) when a command fails, returning the seconds to wait
+        before running it again or None to give up, e.g. SimulationLauncher.retry. on_finish is only called
+        for the last run
+    :param poll_interval: Seconds between checks on a command with a timeout
+    :return: Dictionary of task_id to exit code
+    """
+    exit_codes = {}
+    for task_id, cmd in commands:
+        while True:
+            process = _start_process(cmd)
+            deadline = time.time() + timeout if timeout is not None else None
+            try:
+                result = wait_process(process, block=deadline is None)
+                while result is None:
+                    if time.time() >= deadline:
+                        print("Simulation ID {} timed out after {} seconds, terminating".format(task_id, timeout))
+                        terminate_processes([process])
+                        result = process.returncode, None
+                        break
+                    time.sleep(poll_interval)
+                    result = wait_process(process, block=False)
+            except BaseException:
+                # As subprocess.call, don't leave the child running when interrupted
+                terminate_processes([process])
+                raise
+            exit_codes[task_id], usage = result
+            delay = _retry_delay(retry, task_id, exit_codes[task_id], usage)
+            if delay is None:
+                break
+            time.sleep(delay)
+        if on_finish is not None:
+            on_finish(task_id, exit_codes[task_id], usage)
+    return exit_codes
+
+
+def run_parallel(commands, num_processes=None, on_finish=None, poll_interval=0.05, timeout=None, retry=None):
+    """Runs shell commands, keeping at most num_processes of them running at once.
+
+    Commands are consumed lazily, a new one is only taken once a slot is free. If
+    interrupted (e.g. Ctrl-C) all running children are terminated before the
+    KeyboardInterrupt is re-raised.
+    :param commands: Iterable of (task_id, command) pairs
+    :param num_processes: Maximum number of concurrent processes, defaults to the core count
+    :param on_finish: Called with (task_id, exit code, usage) as each command finishes, see wait_process
+    :param poll_interval: Seconds to wait between checks on the running processes
+    :param timeout: Seconds after which a command is terminated, None for no limit, see run_serial
+    :param retry: Decides whether a failed command is run again, see run_serial. A command waiting to be
+        retried doesn't take up a slot
+    :return: Dictionary of task_id to exit code
+    """
+    if num_processes is None:
+        num_processes = default_num_processes()
+
+    if num_processes < 1:
+        raise ValueError("Number of processes must be at least 1")
+
+    commands = iter(commands)
+    # task_id: (process, command, deadline)
+    running = {}
+    # (time, task_id, command) of the failed commands to run again
+    retries = []
+    exit_codes = {}
+    exhausted = False
+
+    try:
+        while running or retries or not exhausted:
+            while len(running) < num_processes:
+                if retries and retries[0][0] <= time.time():
+                    ready_time, task_id, cmd = retries.pop(0)
+                elif not exhausted:
+                    try:
+                        task_id, cmd = next(commands)
+                    except StopIteration:
+                        exhausted = True
+                        continue
+                else:
+                    break
+                running[task_id] = (_start_process(cmd), cmd, time.time() + timeout if timeout is not None else None)
+
+            finished = []
+            for task_id, (process, cmd, deadline) in list(running.items()):
+                result = wait_process(process, block=False)
+                if result is None and deadline is not None and time.time() >= deadline:
+                    print("Simulation ID {} timed out after {} seconds, terminating".format(task_id, timeout))
+                    terminate_processes([process])
+                    result = process.returncode, None
+                if result is not None:
+                    del running[task_id]
+                    finished.append(task_id)
+                    exit_codes[task_id], usage = result
+                    delay = _retry_delay(retry, task_id, exit_codes[task_id], usage)
+                    if delay is not None:
+                        retries.append((time.time() + delay, task_id, cmd))
+                        retries.sort(key=lambda waiting: waiting[0])
+                    elif on_finish is not None:
+                        on_finish(task_id, exit_codes[task_id], usage)
+
+            if (running or retries) and not finished:
+                time.sleep(poll_interval)
+
+    except KeyboardInterrupt:
+        print("Interrupted, terminating {} running simulation(s)".format(len(running)))
+        terminate_processes([process for process, cmd, deadline in running.values()])
+        raise
+
+    return exit_codes
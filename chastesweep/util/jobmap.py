@@ -0,0 +1,65 @@
+"""Map from scheduler array jobs to the simulation ids each one runs, used when
+the ids of a job are not a contiguous block (e.g. when resuming a sweep).
+
+The file starts with an 8 byte magic string and the number of jobs, followed
+by num_jobs + 1 offsets into the list of ids and then the ids themselves. All
+numbers are little-endian unsigned 64 bit integers, so the ids of a job are
+found with two fixed-width reads."""
+import mmap
+import struct
+
+JOB_MAP_MAGIC = b"CSPJOB01"
+_UINT = struct.Struct("<Q")
+
+
+class JobMapError(Exception):
+    """Raised when a job map file is malformed."""
+    pass
+
+
+def write_job_map(path, jobs):
+    """Write a job map.
+    :param path:
+    :param jobs: List holding a list of simulation ids for each array job
+    """
+    with open(path, "wb") as job_map_file:
+        job_map_file.write(JOB_MAP_MAGIC)
+        job_map_file.write(_UINT.pack(len(jobs)))
+        offset = 0
+        job_map_file.write(_UINT.pack(offset))
+        for job in jobs:
+            offset += len(job)
+            job_map_file.write(_UINT.pack(offset))
+        for job in jobs:
+            for task_id in job:
+                job_map_file.write(_UINT.pack(task_id))
+
+
+class JobMap:
+    """Read-only view of a job map, indexed by array job from 0."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as job_map_file:
+            self._data = mmap.mmap(job_map_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._data[:len(JOB_MAP_MAGIC)] != JOB_MAP_MAGIC:
+            self.close()
+            raise JobMapError("{} is not a job map".format(path))
+        self._num_jobs = self._uint(0)
+        self._ids_start = 1 + self._num_jobs + 1
+
+    def _uint(self, i):
+        return _UINT.unpack_from(self._data, len(JOB_MAP_MAGIC) + i * _UINT.size)[0]
+
+    def __len__(self):
+        return self._num_jobs
+
+    def __getitem__(self, job):
+        if job < 0 or job >= self._num_jobs:
+            raise IndexError("Job {} out of range".format(job))
+        start = self._uint(1 + job)
+        end = self._uint(2 + job)
+        return [self._uint(self._ids_start + i) for i in range(start, end)]
+
+    def close(self):
+        self._data.close()
@@ -0,0 +1,98 @@
+"""Where the output directory of each simulation goes within the output
+directory of its sweep. Filesystems such as Lustre and NFS slow down badly
+once a directory holds very many entries, so a large sweep can spread its
+simulations over a tree of directories rather than putting them all in one."""
+from __future__ import print_function
+import os
+import errno
+
+
+class OutputLayout:
+    """Puts each simulation's output directory, named after its id, levels
+    directories deep. The directory at each level is named after the id
+    divided by a power of fan_out, so with fan_out=100 and levels=2
+    simulation 123456 is in 12/34/123456. No directory below the top level
+    holds more than fan_out entries, and the top level holds one entry per
+    fan_out ** levels simulations. levels=0 puts every simulation directly in
+    the sweep's output directory.
+    """
+
+    def __init__(self, fan_out=100, levels=0):
+        """
+        :param fan_out: Most simulations, or directories of them, in each directory below the top level
+        :param levels: Number of directories between the sweep's output directory and each simulation's
+        """
+        if fan_out < 2:
+            raise ValueError("Fan out must be at least 2")
+        if levels < 0:
+            raise ValueError("Number of levels can't be negative")
+        self.fan_out = fan_out
+        self.levels = levels
+
+    def settings(self):
+        """Keyword arguments recreating this layout, as stored in params.json."""
+        return {"fan_out": self.fan_out, "levels": self.levels}
+
+    def parents(self, task_id):
+        """Names of the directories holding a simulation's output directory, from the top level down."""
+        if self.levels == 0:
+            return []
+        # Only the top level isn't limited to fan_out entries
+        return [str(task_id // self.fan_out ** self.levels)] + \
+            [str(task_id // self.fan_out ** level % self.fan_out) for level in range(self.levels - 1, 0, -1)]
+
+    def relative_path(self, task_id):
+        """Path of a simulation's output directory relative to the sweep's output directory."""
+        return os.path.join(*(self.parents(task_id) + [str(task_id)]))
+
+    def path(self, output_dir, task_id):
+        """Path of a simulation's output directory."""
+        return os.path.join(output_dir, self.relative_path(task_id))
+
+    def task_id(self, path):
+        """Id of the simulation whose output directory is path, relative or not.
+        :raises ValueError: If path is not where this layout puts a simulation
+        """
+        names = os.path.normpath(path).split(os.sep)
+        try:
+            task_id = int(names[-1])
+        except ValueError:
+            raise ValueError("{} is not the output directory of a simulation".format(path))
+        if names[-1 - self.levels:-1] != self.parents(task_id) or task_id < 0:
+            raise ValueError("{} is not where simulation {} is put by this layout".format(path, task_id))
+        return task_id
+
+    def make_parents(self, output_dir, task_id):
+        """Create the directories holding a simulation's output directory, if
+        they don't exist. Safe when other processes are creating them too."""
+        if self.levels == 0:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path(output_dir, task_id)))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    def task_dirs(self, output_dir):
+        """Generator of the (id, output directory) of every simulation with an
+        output directory, in order of id, listing one directory at a time."""
+        def walk(path, level):
+            try:
+                names = os.listdir(path)
+            except OSError:
+                return
+            for name in sorted((name for name in names if name.isdigit()), key=int):
+                child = os.path.join(path, name)
+                if not os.path.isdir(child):
+                    continue
+                if level == self.levels:
+                    yield int(name), child
+                else:
+                    for task_dir in walk(child, level + 1):
+                        yield task_dir
+
+        return walk(output_dir, 0)
+
+
+# Every simulation directly in the sweep's output directory
+FLAT = OutputLayout()
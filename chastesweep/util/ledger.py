@@ -0,0 +1,135 @@
+"""Persistent record of the state of every simulation in a sweep, used to
+resume a sweep that was stopped part way through, and of the time and
+resources each simulation took, summarised by util.summary."""
+from __future__ import print_function
+import os
+import json
+import time
+import socket
+
+STARTED = "started"
+DONE = "done"
+FAILED = "failed"
+# not run because the sweep's circuit breaker tripped, see util.policy
+SKIPPED = "skipped"
+
+
+class Ledger:
+    """Append-only log of simulation status changes, one JSON record per line.
+
+    Each record is written with a single write() to a file opened with
+    O_APPEND, so records from concurrent writers are not interleaved. The
+    latest record of a simulation holds its current status. A record cut short
+    by a killed writer is ignored when reading. The record of a finished
+    simulation also holds its wall time, host and, where the runner could
+    collect them, its CPU time and peak memory.
+
+    Records can also be mirrored into a util.catalogue.Catalogue of the sweep,
+    the ledger remaining the record the sweep is resumed from.
+    """
+
+    def __init__(self, path, catalogue=None):
+        self.path = path
+        self.catalogue = catalogue
+        self.host = socket.gethostname()
+        # start time of the simulations started through this instance
+        self._start_times = {}
+
+    def append(self, record):
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        if self.catalogue is not None:
+            self.catalogue.record(record)
+
+    def started(self, task_id, start_time=None):
+        """Record that a simulation has been launched.
+        :param start_time: When it starts, if not now, e.g. a retry that waits before it runs
+        """
+        start_time = start_time if start_time is not None else time.time()
+        self._start_times[task_id] = start_time
+        self.append({"id": task_id, "status": STARTED, "start": start_time})
+
+    def finished(self, task_id, exit_code, usage=None, retry=False):
+        """Record the exit code, timing and host of a simulation launched with
+        started(), and the resources it used if known.
+        :param usage: Dict of user and sys CPU seconds and peak RSS maxrss in kilobytes, see executor.wait_process
+        :param retry: Whether the simulation is run again, so this failure isn't its outcome
+        """
+        end_time = time.time()
+        start_time = self._start_times.pop(task_id, end_time)
+        record = {"id": task_id,
+                  "status": DONE if exit_code == 0 else FAILED,
+                  "exit_code": exit_code,
+                  "start": start_time,
+                  "end": end_time,
+                  "wall": end_time - start_time,
+                  "host": self.host}
+        if usage is not None:
+            record.update(usage)
+        if retry:
+            record["retry"] = True
+        self.append(record)
+
+    def cached(self, task_id):
+        """Record that a simulation's output was taken from the result cache."""
+        now = time.time()
+        self.append({"id": task_id, "status": DONE, "exit_code": 0, "start": now, "end": now, "wall": 0.0,
+                     "cached": True})
+
+    def skipped(self, task_id):
+        """Record that a simulation was not run as the sweep was stopped early."""
+        self.append({"id": task_id, "status": SKIPPED, "end": time.time()})
+
+    def records(self):
+        """Iterate through every complete record in the order they were written."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as ledger_file:
+            for line in ledger_file:
+                try:
+                    yield json.loads(line.decode("utf-8"))
+                except ValueError:
+                    continue
+
+    def tail(self, count, chunk_size=65536):
+        """The last count complete records, or as many as there are, in the
+        order they were written. Only the end of the ledger is read, however
+        long it is."""
+        if count < 1 or not os.path.exists(self.path):
+            return []
+        with open(self.path, "rb") as ledger_file:
+            ledger_file.seek(0, os.SEEK_END)
+            end = ledger_file.tell()
+            size = min(chunk_size, end)
+            while True:
+                ledger_file.seek(end - size)
+                lines = ledger_file.read(size).split(b"\n")
+                if size < end:
+                    # The first line may be the end of a record
+                    lines = lines[1:]
+                records = []
+                for line in lines:
+                    try:
+                        records.append(json.loads(line.decode("utf-8")))
+                    except ValueError:
+                        continue
+                if len(records) >= count or size == end:
+                    return records[-count:]
+                size = min(size * 2, end)
+
+    def read(self):
+        """Latest record of each simulation.
+        :return: Dictionary of simulation id to record
+        """
+        latest = {}
+        for record in self.records():
+            latest[record["id"]] = record
+        return latest
+
+    def completed(self):
+        """Set of the ids of simulations that finished successfully."""
+        return set(task_id for task_id, record in self.read().items() if record["status"] == DONE)
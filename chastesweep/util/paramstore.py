@@ -0,0 +1,201 @@
+from __future__ import print_function
+"""Indexed parameter store, holding one JSON record per line alongside a fixed
+width index of record offsets. A single record can be read by seeking straight
+to it, so an array task never has to parse the parameters of every other task.
+
+Each record is a distinct parameter set, stored once however many times it is
+repeated. The index file (the store's path with ".idx" appended) starts with
+an 8 byte magic string followed by a (byte offset, first task) pair for every
+record, then a final pair holding the end of the data file and the total number
+of tasks. All numbers are little-endian unsigned 64 bit integers. Task ids,
+counting every repeat, are mapped to their record by binary search over the
+first task of each record."""
+import os
+import json
+import mmap
+import struct
+
+INDEX_MAGIC = b"CSPIDX02"
+INDEX_SUFFIX = ".idx"
+_ENTRY = struct.Struct("<QQ")
+
+
+class ParamStoreError(Exception):
+    """Raised when a parameter store or its index is malformed."""
+    pass
+
+
+def json_default(obj):
+    # NumPy scalars (e.g. from np.arange) are not JSON serializable
+    if hasattr(obj, "item"):
+        return obj.item()
+    raise TypeError("{} is not JSON serializable".format(repr(obj)))
+
+
+def encode_record(record):
+    """Encode a record as a single line of JSON."""
+    line = json.dumps(record, default=json_default, separators=(",", ":")) + "\n"
+    return line.encode("utf-8")
+
+
+class ParamStoreWriter:
+    """Writes records to a parameter store one at a time, so that the records
+    never have to be held in memory together.
+    >>> with ParamStoreWriter("params.jsonl") as writer:
+    >>>     for params, repeats in compact_records(expanded_output):
+    >>>         writer.append(params, repeats)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.num_records = 0
+        self.num_tasks = 0
+        self._offset = 0
+        self._data_file = open(path, "wb")
+        self._index_file = open(path + INDEX_SUFFIX, "wb")
+        self._index_file.write(INDEX_MAGIC)
+
+    def append(self, record, repeats=1):
+        """Append a record, run repeats times, and return its position in the store."""
+        line = encode_record(record)
+        self._index_file.write(_ENTRY.pack(self._offset, self.num_tasks))
+        self._data_file.write(line)
+        self._offset += len(line)
+        self.num_tasks += repeats
+        self.num_records += 1
+        return self.num_records - 1
+
+    def close(self):
+        if self._data_file.closed:
+            return
+        self._index_file.write(_ENTRY.pack(self._offset, self.num_tasks))
+        self._data_file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_param_store(path, records):
+    """Write all records to a new parameter store at path.
+    :param path:
+    :param records: Iterable of (parameter dict, number of repeats)
+    :return: Number of tasks written, counting repeats
+    """
+    with ParamStoreWriter(path) as writer:
+        for record, repeats in records:
+            writer.append(record, repeats)
+    return writer.num_tasks
+
+
+def write_params_json(path, settings, records):
+    """Write a params.json file holding the settings plus a "params" list of
+    the parameter dict of every task. The list is written a record at a time
+    rather than built in memory. A "repeats" list follows, holding the number
+    of repeats of each record, from which the repeat index of each task is
+    found.
+    :param path:
+    :param settings: Dict of the other entries of the file
+    :param records: Iterable of (parameter dict, number of repeats)
+    :return: Number of tasks written, counting repeats
+    """
+    num_tasks = 0
+    record_repeats = []
+    with open(path, "w") as json_file:
+        json_file.write(json.dumps(settings)[:-1] + (", " if settings else "") + '"params": [')
+        for record, repeats in records:
+            line = json.dumps(record, default=json_default)
+            for _ in range(repeats):
+                json_file.write(", " + line if num_tasks else line)
+                num_tasks += 1
+            record_repeats.append(repeats)
+        json_file.write('], "repeats": {}}}'.format(json.dumps(record_repeats)))
+    return num_tasks
+
+
+def _map_file(f):
+    # mmap cannot map an empty file
+    if os.fstat(f.fileno()).st_size == 0:
+        return b""
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class ParamStore:
+    """Read-only, random access view of a parameter store, indexed by task id
+    (counting repeats). Both the data and index files are memory mapped, so
+    looking up a task only touches the pages holding the index entries visited
+    by the binary search and its line of JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + INDEX_SUFFIX, "rb") as index_file:
+            self._index = _map_file(index_file)
+        with open(path, "rb") as data_file:
+            self._data = _map_file(data_file)
+
+        header_size = len(INDEX_MAGIC)
+        if self._index[:header_size] != INDEX_MAGIC or len(self._index) < header_size + _ENTRY.size \
+                or (len(self._index) - header_size) % _ENTRY.size:
+            self.close()
+            raise ParamStoreError("{} is not a parameter store index".format(path + INDEX_SUFFIX))
+        self.num_records = (len(self._index) - header_size) // _ENTRY.size - 1
+        self._num_tasks = self._entry(self.num_records)[1]
+
+    def _entry(self, i):
+        # (byte offset, first task) of record i
+        return _ENTRY.unpack_from(self._index, len(INDEX_MAGIC) + i * _ENTRY.size)
+
+    def record(self, i):
+        """The i'th distinct parameter set."""
+        if i < 0 or i >= self.num_records:
+            raise IndexError("Record {} out of range".format(i))
+        line = self._data[self._entry(i)[0]:self._entry(i + 1)[0]]
+        return json.loads(line.decode("utf-8"))
+
+    def repeats(self, i):
+        """Number of times the i'th parameter set is repeated."""
+        return self._entry(i + 1)[1] - self._entry(i)[1]
+
+    def locate(self, task_id):
+        """Map a task id to a (record, repeat index) pair."""
+        if task_id < 0 or task_id >= self._num_tasks:
+            raise IndexError("Task {} out of range".format(task_id))
+        # find the last record whose first task is <= task_id
+        low = 0
+        high = self.num_records - 1
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self._entry(mid)[1] <= task_id:
+                low = mid
+            else:
+                high = mid - 1
+        return low, task_id - self._entry(low)[1]
+
+    def __len__(self):
+        return self._num_tasks
+
+    def __getitem__(self, task_id):
+        """Parameter dict of task task_id."""
+        if task_id < 0:
+            task_id += self._num_tasks
+        return self.record(self.locate(task_id)[0])
+
+    def __iter__(self):
+        for i in range(self.num_records):
+            record = self.record(i)
+            for repeat_index in range(self.repeats(i)):
+                yield record
+
+    def close(self):
+        for mapped in (self._index, self._data):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
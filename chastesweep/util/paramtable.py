@@ -0,0 +1,168 @@
+from __future__ import print_function
+"""Columnar representation of an expanded parameter scan, an alternative to a
+list holding one dict per task."""
+import numpy as np
+
+
+class ParamTable:
+    """Expanded parameters stored by column.
+
+    Each distinct parameter set (a "combination") is stored once. For every
+    parameter name, codes[name] holds the index into values[name] of that
+    parameter's value in each combination, and repeats holds the number of
+    tasks each combination is run for. Tasks are numbered in the same order
+    that Scan.params() yields them, so a ParamTable can be used wherever the
+    list returned by ParamSweeper.expand_parameters is expected.
+    """
+
+    def __init__(self, names, values, codes, repeats):
+        # parameter names, in the order they appear in each parameter dict
+        self.names = list(names)
+        # dict of name: sequence of values that parameter takes
+        self.values = values
+        # dict of name: integer array of indices into values, one per combination
+        self.codes = codes
+        # number of tasks to run for each combination
+        self.repeats = np.asarray(repeats, dtype=np.int64)
+        # cumulative number of tasks up to and including each combination
+        self._task_offsets = np.cumsum(self.repeats)
+
+    def num_combinations(self):
+        """Number of distinct parameter sets, not counting repeats."""
+        return len(self.repeats)
+
+    def __len__(self):
+        """Total number of tasks, i.e. combinations including their repeats."""
+        return int(self._task_offsets[-1]) if len(self._task_offsets) else 0
+
+    def column(self, name):
+        """Array of the values of parameter name, one per combination."""
+        return np.asarray(self.values[name])[self.codes[name]]
+
+    def columns(self):
+        """Dict of name: array of values, one per combination."""
+        return dict((name, self.column(name)) for name in self.names)
+
+    def task_columns(self):
+        """Dict of name: array of values, one per task (repeats expanded)."""
+        return dict((name, np.repeat(self.column(name), self.repeats)) for name in self.names)
+
+    def repeat_indices(self):
+        """Array holding the repeat index of every task, counting from 0 within
+        its combination."""
+        first_tasks = np.repeat(self._task_offsets - self.repeats, self.repeats)
+        return np.arange(len(self), dtype=np.int64) - first_tasks
+
+    def combination(self, i):
+        """The parameter dict of the i'th combination."""
+        params = {}
+        for name in self.names:
+            params[name] = self.values[name][int(self.codes[name][i])]
+        return params
+
+    def locate(self, task_id):
+        """Map a task id (counting repeats) to a (combination, repeat) pair."""
+        if task_id < 0 or task_id >= len(self):
+            raise IndexError("Task id {} out of range".format(task_id))
+        combination = int(np.searchsorted(self._task_offsets, task_id, side='right'))
+        first_task = int(self._task_offsets[combination - 1]) if combination > 0 else 0
+        return combination, task_id - first_task
+
+    def __getitem__(self, task_id):
+        """The parameter dict of task task_id. Negative ids and slices are
+        supported."""
+        if isinstance(task_id, slice):
+            return [self[i] for i in range(*task_id.indices(len(self)))]
+        if task_id < 0:
+            task_id += len(self)
+        combination, repeat = self.locate(task_id)
+        return self.combination(combination)
+
+    def __iter__(self):
+        """Iterate through the parameter dict of every task in order, the same
+        dict is yielded for each repeat of a combination."""
+        for i in range(self.num_combinations()):
+            params = self.combination(i)
+            for repeat in range(self.repeats[i]):
+                yield params
+
+    def to_records(self):
+        """List of parameter dicts, one per task, as returned by
+        ParamSweeper.expand_parameters."""
+        return [dict(params) for params in self]
+
+
+def repeat_indices(expanded_output):
+    """Generator of the repeat index of each task of an expanded sweep, taken
+    from its records as given by compact_records. For a list of parameter
+    dicts, identical neighbouring dicts are taken to be repeats of one
+    parameter set, so pass the Scan or ParamTable itself where a parameter
+    takes the same value more than once."""
+    for params, repeat_index in expand_records(compact_records(expanded_output)):
+        yield repeat_index
+
+
+def expand_records(records):
+    """Generator of (parameter dict, repeat index) of each task of
+    (parameter dict, number of repeats) records, the repeats of a parameter
+    set sharing its dict."""
+    for params, repeats in records:
+        for repeat_index in range(repeats):
+            yield params, repeat_index
+
+
+def compact_records(expanded_output):
+    """Generator of (parameter dict, number of repeats) for each distinct
+    parameter set of an expanded sweep, either a ParamTable or a list of
+    parameter dicts in which the repeats of a parameter set are consecutive.
+    A Scan, or anything else with a records() method, is streamed through it
+    without being expanded."""
+    if isinstance(expanded_output, ParamTable):
+        for i in range(expanded_output.num_combinations()):
+            yield expanded_output.combination(i), int(expanded_output.repeats[i])
+        return
+
+    if hasattr(expanded_output, "records"):
+        for params, repeats in expanded_output.records():
+            yield params, repeats
+        return
+
+    previous = None
+    repeats = 0
+    for params in expanded_output:
+        if repeats and params == previous:
+            repeats += 1
+            continue
+        if repeats:
+            yield previous, repeats
+        previous = params
+        repeats = 1
+    if repeats:
+        yield previous, repeats
+
+
+def shard_records(records, shard_size):
+    """Splits (parameter dict, number of repeats) records, as yielded by
+    compact_records, into shards of shard_size tasks (the last may hold
+    fewer). A parameter set whose repeats cross a shard boundary is split
+    between the two shards.
+    :return: Generator of (repeat index of the shard's first task, list of records)
+    """
+    shard = []
+    shard_tasks = 0
+    first_repeat = 0
+    for params, repeats in records:
+        repeat_index = 0
+        while repeats:
+            taken = min(repeats, shard_size - shard_tasks)
+            shard.append((params, taken))
+            shard_tasks += taken
+            repeats -= taken
+            repeat_index += taken
+            if shard_tasks == shard_size:
+                yield first_repeat, shard
+                shard = []
+                shard_tasks = 0
+                first_repeat = repeat_index if repeats else 0
+    if shard:
+        yield first_repeat, shard
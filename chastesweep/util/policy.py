@@ -0,0 +1,90 @@
+"""What happens when simulations hang or fail: a wall-clock limit on each
+run, retrying failed runs after a backoff, and a circuit breaker that stops
+a sweep whose simulations are mostly failing rather than running every one
+of them, e.g. when the executable is broken."""
+from __future__ import print_function
+from collections import deque
+
+
+class ExecutionPolicy:
+    """Settings of how the simulations of a sweep are run, taken by the local
+    sweeps and generate_batch_output. A simulation that runs for longer than
+    the timeout is terminated and counts as failed. A failed simulation is run
+    again up to retries times, waiting backoff seconds before the first retry
+    and twice as long before each one after. A simulation that still fails is
+    recorded as failed and counted by the circuit breaker.
+    """
+
+    def __init__(self, timeout=None, retries=0, backoff=10.0, max_backoff=600.0, retry_exit_codes=None,
+                 failure_threshold=None, window=20):
+        """
+        :param timeout: Seconds after which a simulation is terminated, None for no limit
+        :param retries: Number of times a failed simulation is run again
+        :param backoff: Seconds before the first retry, doubled for each retry after
+        :param max_backoff: Longest wait before a retry
+        :param retry_exit_codes: Exit codes of the failures worth retrying, e.g. those of a transient error, None
+            to retry any failure. A timed out simulation's exit code is minus the signal that ended it
+        :param failure_threshold: Fraction of the last window simulations that must fail for the circuit breaker
+            to stop the sweep, None for no circuit breaker
+        :param window: Number of the most recently finished simulations the failure rate is taken over
+        """
+        if retries < 0:
+            raise ValueError("Number of retries can't be negative")
+        if failure_threshold is not None and not 0 <= failure_threshold < 1:
+            raise ValueError("Failure threshold must be at least 0 and less than 1")
+        if window < 1:
+            raise ValueError("Circuit breaker window must be at least 1")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_exit_codes = retry_exit_codes
+        self.failure_threshold = failure_threshold
+        self.window = window
+
+    def settings(self):
+        """Keyword arguments recreating this policy, as stored in params.json."""
+        return {"timeout": self.timeout,
+                "retries": self.retries,
+                "backoff": self.backoff,
+                "max_backoff": self.max_backoff,
+                "retry_exit_codes": list(self.retry_exit_codes) if self.retry_exit_codes is not None else None,
+                "failure_threshold": self.failure_threshold,
+                "window": self.window}
+
+    def retry_delay(self, exit_code, attempt):
+        """Seconds to wait before running a simulation again after its
+        attempt'th run (counting from 1) failed with exit_code, or None if it
+        should not be retried."""
+        if exit_code == 0 or attempt > self.retries:
+            return None
+        if self.retry_exit_codes is not None and exit_code not in self.retry_exit_codes:
+            return None
+        return min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+
+    def circuit_breaker(self):
+        """A new CircuitBreaker with this policy's settings, or None if it has none."""
+        if self.failure_threshold is None:
+            return None
+        return CircuitBreaker(self.failure_threshold, self.window)
+
+
+class CircuitBreaker:
+    """Trips once more than threshold of the last window simulations to
+    finish have failed, and stays tripped."""
+
+    def __init__(self, threshold, window):
+        self.threshold = threshold
+        self.tripped = False
+        self._outcomes = deque(maxlen=window)
+
+    def record(self, failed):
+        """Count a finished simulation."""
+        self._outcomes.append(bool(failed))
+        if len(self._outcomes) == self._outcomes.maxlen and \
+                sum(self._outcomes) > self.threshold * len(self._outcomes):
+            self.tripped = True
+
+    def failure_rate(self):
+        """Fraction of the simulations in the window that failed."""
+        return sum(self._outcomes) / float(len(self._outcomes)) if self._outcomes else 0.0
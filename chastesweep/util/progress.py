@@ -0,0 +1,57 @@
+"""Progress messages for long running steps, such as writing the parameter
+files of a very large sweep."""
+from __future__ import print_function
+import sys
+import time
+
+
+class Progress:
+    """Counts the items of a step and prints how far through it is, at most
+    once every interval seconds. Nothing is printed for a step finishing
+    within the first interval.
+    >>> progress = Progress("Writing parameters", "parameter sets", total=num_records)
+    >>> for record in progress.track(records):
+    >>>     ...
+    """
+
+    def __init__(self, description, unit="items", total=None, interval=5.0):
+        self.description = description
+        self.unit = unit
+        self.total = total
+        self.interval = interval
+        self.count = 0
+        self.reported = False
+        self._start_time = time.time()
+        self._last_report = self._start_time
+
+    def update(self, n=1):
+        self.count += n
+        if self.interval is None:
+            return
+        now = time.time()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def report(self):
+        if self.total:
+            print("{}: {} of {} {} ({:.0f}%)".format(self.description, self.count, self.total, self.unit,
+                                                   100.0 * self.count / self.total))
+        else:
+            print("{}: {} {}".format(self.description, self.count, self.unit))
+        sys.stdout.flush()
+        self.reported = True
+
+    def finish(self):
+        """Print the final count, if progress was reported along the way."""
+        if self.reported:
+            print("{}: done, {} {} in {:.1f} s".format(self.description, self.count, self.unit,
+                                                      time.time() - self._start_time))
+            sys.stdout.flush()
+
+    def track(self, iterable):
+        """Generator of the items of iterable, counting each one."""
+        for item in iterable:
+            yield item
+            self.update()
+        self.finish()
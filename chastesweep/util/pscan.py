@@ -7,8 +7,14 @@ TODO: implement "scientific" sweeps, where one parameter is varied at a time
 from baseline."""
 from functools import reduce # for roll-your-own product()
 import operator # for operator.mul in map in roll-your-own product()
-import collections
+try:
+    from collections.abc import Iterable
+except ImportError: # Python 2
+    from collections import Iterable
 import unittest
+import numpy as np
+from chastesweep.util.paramtable import ParamTable
+from chastesweep.util.sampling import sample_parameters, SOBOL
 
 # class P:
 #     """A param for PScan"""
@@ -71,6 +77,40 @@ def get_first(iterable, default=None):
             return item
     return default
 
+def vectorised(func):
+    """Decorator marking a count function or constraint as vectorised, see
+    Scan.add_count and Scan.add_constraint."""
+    func.vectorised = True
+    return func
+
+def is_vectorised(func):
+    return getattr(func, 'vectorised', False)
+
+class _Vectorised:
+    """Wraps a function (e.g. a lambda or builtin) that cannot be given the
+    vectorised attribute directly."""
+    vectorised = True
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self, columns):
+        return self.func(columns)
+
+def _apply_vectorised_count(result, counts):
+    """Overwrite counts in place with the result of a vectorised count
+    function, except where the result is masked or negative."""
+    result = np.ma.asarray(result)
+    data = np.broadcast_to(np.ma.getdata(result), counts.shape)
+    defer = np.broadcast_to(np.ma.getmaskarray(result), counts.shape) | (data < 0)
+    counts[...] = np.where(defer, counts, data)
+
+def _apply_vectorised_constraint(result, keep):
+    """Clear keep in place where the result of a vectorised constraint is
+    false. Masked entries are kept."""
+    result = np.ma.filled(np.ma.asarray(result), True)
+    keep &= np.broadcast_to(result.astype(bool), keep.shape)
+
 class JointParameterListSizeError(Exception):
     """Raised when two parameters that are meant to vary jointly have a
     different number of values that they are supposed to take."""
@@ -116,11 +156,22 @@ class Scan:
     1) run the same parameters many times (e.g. stoch simulation)
     2) vary certain parameters jointly (e.g. (i,j) = (1,2), (2,3), (3,4), ... )
     3) vary parameters combinatorially (e.g. (i,j) = (1,1), (1,2), (2,1), (2,2))
-    If a Scan is stopped midway, it will remember its state, allowing you to
-    load it back up, change the scan parameters, and continue the run.
+    If a sweep of a Scan is stopped midway, the ledger kept by ParamSweeper
+    remembers which simulations completed, so it can be resumed with
+    resume=True (or ParamSweeper.generate_resume_batch for batch sweeps).
     A Scan is *not* useful if your code needs to regularly generate the next
     parameters based on previous simulations.
 
+    Combinations that make no sense (e.g. a birth rate below the death rate)
+    can be left out with constraints, see add_constraint. They are removed
+    before anything is counted or expanded, and the remaining tasks are still
+    numbered 0, 1, 2, ...
+    Streaming the scan with records() or params(), or counting it, evaluates
+    the constraints a chunk of the grid at a time, so memory stays bounded
+    however large the grid is; the constraints are evaluated again each time.
+    Random access (scan[i], slices, locate and table) keeps the position of
+    every combination satisfying them, 8 bytes each.
+
     If you have several "jointly" varying parameters, each "group" of them will
     interact combinatorially. More abstractly, you should think of each set of
     jointly varying parameters as being the same as a "single" parameter.
@@ -172,12 +223,26 @@ class Scan:
     ```
     """
 
+    # number of combinations evaluated at once by vectorised count functions
+    chunk_size = 1 << 16
+
     def __init__(self, dic={}, joint_lists=[], default_repeats=1,
-                 count_funcs=[]):
+                 count_funcs=[], constraints=[]):
 # how many times to repeat simulation of a specific parameter by default
         self.default_repeats = default_repeats
 # list of functions to iteratively determine how many repeats to actually use
-        self.count_funcs = count_funcs
+        self.count_funcs = list(count_funcs)
+# list of functions deciding which combinations are run at all
+        self.constraints = list(constraints)
+# cumulative number of tasks up to and including each combination, built on
+# first random access and discarded whenever the scan is changed
+        self._task_offsets = None
+# position in the full grid of every combination satisfying the constraints,
+# built on first random access and discarded whenever the scan is changed
+        self._valid = None
+# number of combinations satisfying the constraints, counted without keeping
+# their positions and discarded whenever the scan is changed
+        self._num_valid = None
 # parameters that need to be combinatorially scanned
         self.comb_params = dict(dic)
 # parameters that need to be varied together
@@ -195,7 +260,7 @@ class Scan:
                 del self.comb_params[key]
         # make singleton variables iterable
         for key,val in self.comb_params.items():
-            if not isinstance(val, collections.Iterable):
+            if not isinstance(val, Iterable):
                 self.comb_params[key] = [self.comb_params[key]]
                 #_check_comb_param(key, val)
 
@@ -205,10 +270,128 @@ class Scan:
         for params in self.params():
             f(**params)
 
-    def params(self):
+    def params(self, start=None, stop=None, step=None):
         """A generator that iterates through all parameters requested the
         correct number of times each. Returns them as a dict with form
-        {'param_name': param_value, ... } for use as f(**params)."""
+        {'param_name': param_value, ... } for use as f(**params). Each
+        combination gets a dict of its own, which the caller may keep, shared
+        by its repeats.
+
+        start, stop and step select a slice of the tasks (counting repeats),
+        the same as scan[start:stop:step], without walking the tasks before
+        start."""
+        if start is None and stop is None and step is None:
+            for params, num_repeats in self.records():
+                for _ in range(num_repeats):
+                    yield params
+            return
+
+        start, stop, step = slice(start, stop, step).indices(len(self))
+        if step != 1:
+            # sparse slices jump straight to each task
+            for task_id in range(start, stop, step):
+                yield self[task_id]
+            return
+        if start >= stop:
+            return
+
+        combination, repeat = self.locate(start)
+        offsets = self._build_task_offsets() if self.count_funcs else None
+        task_id = start
+        for i, params in self._iter_combinations(combination):
+            # first task of the next combination
+            end = int(offsets[i]) if offsets is not None else (i + 1) * self.default_repeats
+            while task_id < min(end, stop):
+                yield params
+                task_id += 1
+            if task_id >= stop:
+                return
+
+    def records(self):
+        """A generator of (parameter dict, number of repeats) for each
+        combination in turn. Only a chunk of the combinations, and of their
+        repeat counts, is held at a time, so a sweep can be streamed out
+        however large it is, constrained or not."""
+        vectorised_counts = self._has_vectorised_counts()
+        for start, positions in self._combination_chunks():
+            stop = start + len(positions)
+            # vectorised count functions are evaluated over the whole chunk up front
+            counts = self._repeat_counts_at(positions) if vectorised_counts else None
+            # without constraints the counter simply steps through the grid
+            for i, params in self._iter_combinations(start, stop,
+                                                     positions=positions if self.constraints else None):
+                # how we have one parameter set, check how many times to repeat it
+                if counts is not None:
+                    num_repeats = int(counts[i - start])
+                else:
+                    num_repeats = self._num_repeats(params)
+                yield params, num_repeats
+
+    def _iter_combinations(self, start=0, stop=None, constrained=True, shared=False, positions=None):
+        """A generator of (index, parameter dict) for combinations start to
+        stop (ignoring repeats). Rather than unravelling every index, a
+        mixed-radix counter is advanced from one combination to the next,
+        usually changing only its last digit, and only the parameters of the
+        digits that changed are updated.
+
+        Each combination is yielded as a dict of its own by default, since
+        params() and records() hand them to callers that may keep them, so
+        those still copy every parameter at each step. With shared=True the
+        same dict is updated in place instead, making each step cost only the
+        digits that changed; it is only valid until the next step, as when
+        the constraints and count functions are evaluated.
+
+        With constrained=False the indexes are positions in the full grid,
+        including the combinations the constraints rule out. Given positions,
+        an array of the positions in the full grid of combinations start to
+        stop, those are used rather than looking them up."""
+        comb_keys, comb_sizes, joint_sizes = self._dimensions()
+        sizes = comb_sizes + joint_sizes
+        # index into grid of combination start
+        first = 0
+        if positions is not None:
+            # a chunk of positions is indexed faster as a list than as an array
+            grid = positions.tolist()
+            first = start
+            stop = start + len(grid)
+        else:
+            grid = self._valid_combinations() if constrained and self.constraints else None
+            total_combinations = len(grid) if grid is not None else reduce(operator.mul, sizes, 1)
+            stop = total_combinations if stop is None else min(stop, total_combinations)
+        if start >= stop:
+            return
+
+        # the (key, values) pairs set by each digit of the counter
+        digit_params = [[(key, self.comb_params[key])] for key in comb_keys]
+        digit_params += [list(jparam.items()) for jparam in self.joint_params]
+
+        position = int(grid[start - first]) if grid is not None else start
+        digits = unravel_index(position, sizes) if sizes else []
+        params = {}
+        for d, pairs in enumerate(digit_params):
+            for key, val_arr in pairs:
+                params[key] = val_arr[digits[d]]
+
+        for i in range(start, stop):
+            if i > start:
+                next_position = int(grid[i - first]) if grid is not None else i
+                carry = next_position - position
+                position = next_position
+                if not shared:
+                    # callers may keep the dict we yielded, so change a copy
+                    params = dict(params)
+                d = len(sizes) - 1
+                while carry and d >= 0:
+                    carry, digits[d] = divmod(digits[d] + carry, sizes[d])
+                    for key, val_arr in digit_params[d]:
+                        params[key] = val_arr[digits[d]]
+                    # carry into the next digit
+                    d -= 1
+            yield i, params
+
+    def _dimensions(self):
+        """Keys and sizes of the combinatorial parameters, followed by the sizes
+        of each group of jointly varying parameters."""
         comb_sizes = []
         comb_keys = []
         for key,val in self.comb_params.items():
@@ -217,31 +400,250 @@ class Scan:
         # length of first values array, since lengths should match for sets of
         # jointly varying parameters
         joint_sizes = [len(next(iter(jlist.values()))) for jlist in self.joint_params]
-        all_sizes = comb_sizes + joint_sizes
-        total_combinations = reduce(operator.mul, all_sizes, 1)
-        for i in range(total_combinations):
-            sub = unravel_index(i, all_sizes)
-            params = {}
-            # get the comb_params
-            for j in range(len(comb_sizes)):
-                key = comb_keys[j]
-                val_arr = self.comb_params[key]
-                params[key] = val_arr[sub[j]]
-            # get the joint_params
-            for j in range(len(joint_sizes)):
-                subj = j + len(comb_sizes)
-                for key,val_arr in self.joint_params[j].items():
-                    params[key] = val_arr[sub[subj]]
-            # how we have one parameter set, check how many times to repeat it
-            num_repeats = self.default_repeats
-            for func in self.count_funcs:
-                c = func(params)
-                if c:
-                    num_repeats = c
-            for i in range(num_repeats):
-                yield params
+        return comb_keys, comb_sizes, joint_sizes
+
+    def _combination(self, i, dims):
+        """The parameter set of the i'th combination (ignoring repeats)."""
+        comb_keys, comb_sizes, joint_sizes = dims
+        if self.constraints:
+            i = int(self._valid_combinations()[i])
+        sub = unravel_index(i, comb_sizes + joint_sizes)
+        params = {}
+        # get the comb_params
+        for j in range(len(comb_sizes)):
+            key = comb_keys[j]
+            val_arr = self.comb_params[key]
+            params[key] = val_arr[sub[j]]
+        # get the joint_params
+        for j in range(len(joint_sizes)):
+            subj = j + len(comb_sizes)
+            for key,val_arr in self.joint_params[j].items():
+                params[key] = val_arr[sub[subj]]
+        return params
+
+    def _num_repeats(self, params):
+        """Number of times to repeat a parameter set, as decided by the
+        count_funcs in the order they were added."""
+        num_repeats = self.default_repeats
+        for func in self.count_funcs:
+            c = func(params)
+            if c:
+                num_repeats = c
+        return num_repeats
+
+    def num_combinations(self):
+        """Number of distinct parameter sets satisfying the constraints, not
+        counting repeats."""
+        if not self.constraints:
+            return self._grid_size()
+        if self._valid is not None:
+            return len(self._valid)
+        if self._num_valid is None:
+            self._num_valid = sum(len(positions) for positions in self._constrained_chunks())
+        return self._num_valid
+
+    def _grid_size(self):
+        """Number of combinations of the parameter values, before applying
+        the constraints."""
+        comb_keys, comb_sizes, joint_sizes = self._dimensions()
+        return reduce(operator.mul, comb_sizes + joint_sizes, 1)
+
+    def _valid_combinations(self):
+        """Position in the full grid of every combination that satisfies all
+        the constraints, in order, kept for random access."""
+        if self._valid is None:
+            valid = list(self._constrained_chunks())
+            self._valid = np.concatenate(valid) if valid else np.zeros(0, dtype=np.int64)
+        return self._valid
+
+    def _constrained_chunks(self):
+        """A generator of the positions in the full grid of the combinations
+        that satisfy all the constraints, one array for each chunk of
+        chunk_size positions of the grid.
 
-    def add_count(self, func):
+        Constraints are applied in the order they were added. A vectorised
+        constraint is called once per chunk with a dict of name: array of
+        values and returns a boolean array, while any other constraint is
+        called with the parameter dict of each combination not already ruled
+        out."""
+        grid_size = self._grid_size()
+        value_arrays = dict((key, np.asarray(val)) for key, val in self._values().items())
+        for start in range(0, grid_size, self.chunk_size):
+            stop = min(start + self.chunk_size, grid_size)
+            keep = np.ones(stop - start, dtype=bool)
+            columns = None
+            for func in self.constraints:
+                if is_vectorised(func):
+                    if columns is None:
+                        codes = self._grid_codes(np.arange(start, stop, dtype=np.int64))
+                        columns = dict((key, value_arrays[key][codes[key]]) for key in codes)
+                    _apply_vectorised_constraint(func(columns), keep)
+                else:
+                    for i, params in self._iter_combinations(start, stop, constrained=False, shared=True):
+                        if keep[i - start] and not func(params):
+                            keep[i - start] = False
+            yield np.flatnonzero(keep) + start
+
+    def _combination_chunks(self):
+        """A generator of (index of the first combination, array of positions
+        in the full grid) of the combinations, in order, at most chunk_size at
+        a time. Only a constrained scan that has been randomly accessed holds
+        them all."""
+        if self.constraints and self._valid is None:
+            start = 0
+            for positions in self._constrained_chunks():
+                if len(positions):
+                    yield start, positions
+                    start += len(positions)
+            return
+        num_combinations = self.num_combinations()
+        for start in range(0, num_combinations, self.chunk_size):
+            yield start, self._positions(start, min(start + self.chunk_size, num_combinations))
+
+    def _positions(self, start, stop):
+        """Positions in the full grid of combinations start to stop."""
+        if self.constraints:
+            return self._valid_combinations()[start:stop]
+        return np.arange(start, stop, dtype=np.int64)
+
+    def _has_vectorised_counts(self):
+        return any(is_vectorised(func) for func in self.count_funcs)
+
+    def _codes(self, start=0, stop=None):
+        """Index into its list of values of every parameter, for combinations
+        start to stop, as a dict of name: integer array."""
+        num_combinations = self.num_combinations()
+        stop = num_combinations if stop is None else min(stop, num_combinations)
+        return self._grid_codes(self._positions(start, stop))
+
+    def _grid_codes(self, flat_index):
+        """Index into its list of values of every parameter, for an array of
+        positions in the full grid. Computed with array arithmetic instead of
+        unravelling every flat index in turn."""
+        comb_keys, comb_sizes, joint_sizes = self._dimensions()
+        sizes = comb_sizes + joint_sizes
+        num_combinations = reduce(operator.mul, sizes, 1)
+        # the last dimension varies fastest (C-style), matching unravel_index
+        digits = []
+        stride = num_combinations
+        for size in sizes:
+            if num_combinations:
+                stride //= size
+                digit = (flat_index // stride) % size
+            else:
+                digit = flat_index
+            digits.append(digit.astype(np.min_scalar_type(max(size - 1, 0))))
+
+        codes = {}
+        for j, key in enumerate(comb_keys):
+            codes[key] = digits[j]
+        for j, jparam in enumerate(self.joint_params):
+            for key in jparam:
+                codes[key] = digits[j + len(comb_sizes)]
+        return codes
+
+    def _values(self):
+        """Dict of name: list of values, for every parameter."""
+        values = dict(self.comb_params)
+        for jparam in self.joint_params:
+            values.update(jparam)
+        return values
+
+    def _repeat_counts(self, first=0, last=None):
+        """Array holding the number of repeats of combinations first to last,
+        by default all of them, worked out chunk_size combinations at a time."""
+        last = self.num_combinations() if last is None else last
+        counts = np.full(last - first, self.default_repeats, dtype=np.int64)
+        if not self.count_funcs:
+            return counts
+        for start in range(first, last, self.chunk_size):
+            stop = min(start + self.chunk_size, last)
+            counts[start - first:stop - first] = self._repeat_counts_at(self._positions(start, stop))
+        return counts
+
+    def _repeat_counts_at(self, positions):
+        """Array holding the number of repeats of the combinations at an array
+        of positions in the full grid.
+
+        Count functions are applied in the order they were added. A vectorised
+        function is called once with a dict of name: array of values, while
+        any other function is called once per combination with a parameter
+        dict."""
+        counts = np.full(len(positions), self.default_repeats, dtype=np.int64)
+        columns = None
+        for func in self.count_funcs:
+            if is_vectorised(func):
+                if columns is None:
+                    value_arrays = dict((key, np.asarray(val)) for key, val in self._values().items())
+                    codes = self._grid_codes(positions)
+                    columns = dict((key, value_arrays[key][codes[key]]) for key in codes)
+                _apply_vectorised_count(func(columns), counts)
+            else:
+                for i, params in self._iter_combinations(0, len(positions), shared=True, positions=positions):
+                    c = func(params)
+                    if c:
+                        counts[i] = c
+        return counts
+
+    def table(self):
+        """Expand the scan into a ParamTable."""
+        comb_keys, comb_sizes, joint_sizes = self._dimensions()
+        names = list(comb_keys)
+        for jparam in self.joint_params:
+            names.extend(jparam.keys())
+
+        if self.count_funcs:
+            counts = np.diff(self._build_task_offsets(), prepend=0)
+        else:
+            counts = self._repeat_counts()
+        return ParamTable(names, self._values(), self._codes(), counts)
+
+    def _build_task_offsets(self):
+        """Prefix sum of the repeat counts of every combination, so that a
+        task id can be mapped to its combination with a binary search. Only
+        needed when there are count_funcs, otherwise every combination is
+        repeated default_repeats times."""
+        if self._task_offsets is None:
+            self._task_offsets = np.cumsum(self._repeat_counts())
+        return self._task_offsets
+
+    def locate(self, task_id):
+        """Map a task id (counting repeats) to a (combination, repeat) pair
+        without walking the tasks before it."""
+        if task_id < 0 or task_id >= len(self):
+            raise IndexError("Task id {} out of range".format(task_id))
+        if not self.count_funcs:
+            return divmod(task_id, self.default_repeats)
+        offsets = self._build_task_offsets()
+        combination = int(np.searchsorted(offsets, task_id, side='right'))
+        first_task = int(offsets[combination - 1]) if combination > 0 else 0
+        return combination, task_id - first_task
+
+    def __len__(self):
+        """Total number of tasks, i.e. combinations including their repeats."""
+        if not self.count_funcs:
+            return self.num_combinations() * self.default_repeats
+        offsets = self._build_task_offsets()
+        return int(offsets[-1]) if len(offsets) else 0
+
+    def num_tasks(self):
+        """Total number of tasks, the same as len(scan), but counted a chunk
+        at a time instead of building the index used for random access."""
+        if not self.count_funcs or self._task_offsets is not None:
+            return len(self)
+        return sum(int(np.sum(self._repeat_counts_at(positions))) for start, positions in self._combination_chunks())
+
+    def __getitem__(self, task_id):
+        """The parameter dict of task task_id, the same as the task_id'th item
+        yielded by params(). Negative ids and slices are supported."""
+        if isinstance(task_id, slice):
+            return list(self.params(task_id.start, task_id.stop, task_id.step))
+        if task_id < 0:
+            task_id += len(self)
+        combination, repeat = self.locate(task_id)
+        return self._combination(combination, self._dimensions())
+
+    def add_count(self, func, vectorised=False):
         """Add (a) new function(s) to determine how many times to repeat a parameter
         set. Each function should take a dictionary of values (your parameters)
         and return an integer if it wants to determine how many times to run
@@ -257,18 +659,55 @@ class Scan:
         >>> s.add_count(default_count)
         >>> s.add_count(big_c_count)
 
+        With vectorised=True (or a function decorated with @vectorised) the
+        function is instead called with whole columns, a dictionary of NumPy
+        arrays holding the values of many parameter sets at once, and should
+        return an integer array. Masked or negative entries defer to the
+        previous count.
+        >>> s.add_count(lambda p: np.where(p['c'] >= 14, 2, -1), vectorised=True)
+
         """
+        if vectorised:
+            func = _Vectorised(func)
         self.count_funcs.append(func)
+        self._task_offsets = None
+        self._valid = None
+        self._num_valid = None
+
+    def add_constraint(self, func, vectorised=False):
+        """Add a function deciding which parameter sets are run. It should take
+        a dictionary of values (your parameters) and return False for a
+        combination that should be skipped. Combinations ruled out by any
+        constraint are dropped before counting repeats, and the remaining
+        tasks are numbered without gaps.
+        e.g.
+        >>> s.add_constraint(lambda p: p['birth_rate'] >= p['death_rate'])
+
+        With vectorised=True (or a function decorated with @vectorised) the
+        function is instead called with whole columns, a dictionary of NumPy
+        arrays, and should return a boolean array.
+        >>> s.add_constraint(lambda p: p['width'] >= p['cells'] * p['spacing'], vectorised=True)
+
+        """
+        if vectorised:
+            func = _Vectorised(func)
+        self.constraints.append(func)
+        self._task_offsets = None
+        self._valid = None
+        self._num_valid = None
 
     def add_params(self, p):
         """Add new variables or change values to be used for particular
         parameter names that will not be jointly varied."""
         new_params = p.copy()
         for key,val in new_params.items():
-            if not isinstance(val, collections.Iterable):
+            if not isinstance(val, Iterable):
                 new_params[key] = [new_params[key]]
             #_check_comb_param(key, val)
         self.comb_params.update(new_params)
+        self._task_offsets = None
+        self._valid = None
+        self._num_valid = None
 
     def add_jparam(self, jparam):
         """Add a new set of parameters that should be varied together. Should
@@ -276,6 +715,19 @@ class Scan:
         all param_values are the same size."""
         _check_joint_params(jparam)
         self.joint_params.append(jparam)
+        self._task_offsets = None
+        self._valid = None
+        self._num_valid = None
+
+    def add_samples(self, ranges, num_points, method=SOBOL, seed=None):
+        """Add num_points parameter sets sampled from continuous ranges instead
+        of a list of values, see util.sampling.sample_parameters. The sampled
+        parameters vary jointly, and combinatorially with everything else.
+        e.g.
+        >>> s.add_samples({'birth_rate': (0.1, 1.0), 'mesh_size': (1e-3, 1e-1, 'log')}, 64, seed=1)
+
+        """
+        self.add_jparam(sample_parameters(ranges, num_points, method, seed))
 
     @classmethod
     def from_dict(cls, dic, joint_lists=[]):
@@ -0,0 +1,304 @@
+"""Runs the simulations of a single scheduler array job. This is what the
+runsimulation.py script generated by ParamSweeper.generate_batch_output calls."""
+from __future__ import print_function
+import os
+import json
+import time
+import socket
+import argparse
+from bisect import bisect_right
+
+from chastesweep.util.executor import SimulationLauncher, run_serial, run_parallel
+from chastesweep.util.cache import ResultCache
+from chastesweep.util.paramstore import ParamStore
+from chastesweep.util.ledger import Ledger
+from chastesweep.util.policy import ExecutionPolicy
+from chastesweep.util.layout import OutputLayout, FLAT
+from chastesweep.util.archive import RunArchive
+from chastesweep.util.jobmap import JobMap
+from chastesweep.util.workqueue import WorkQueue
+
+
+class BatchSweep:
+    """Settings and parameters of a sweep written by
+    ParamSweeper.generate_batch_output, loaded from its params.json.
+
+    Simulation ids count from 1, the id of the first array job. When the sweep
+    was generated with tasks_per_job > 1, each array job runs a contiguous
+    block of simulations. A job map replaces this with an explicit list of ids
+    for each array job.
+
+    A shard of a sharded sweep holds the simulations from first_task onwards.
+    The params.json of the whole sweep lists its shards instead of holding
+    parameters, and each shard is opened when one of its simulations is first
+    needed.
+    """
+
+    def __init__(self, sweep_dir, params_file_name="params.json", job_map_file=None):
+        with open(os.path.join(sweep_dir, params_file_name), "r") as params_file:
+            settings = json.load(params_file)
+
+        self.exec_cmd = settings["exec_cmd"]
+        self.output_dir = settings["output_dir"]
+        self.tasks_per_job = settings.get("tasks_per_job", 1)
+        self.processes_per_job = settings.get("processes_per_job", 1)
+        self.ledger_path = os.path.join(self.output_dir, settings.get("ledger", "ledger.jsonl"))
+        self._job_map = JobMap(os.path.join(sweep_dir, job_map_file)) if job_map_file else None
+        # settings of the result cache, if the sweep uses one
+        self.cache_settings = settings.get("cache")
+        self.repeat_param = settings.get("repeat_param")
+        self.first_task = settings.get("first_task", 1)
+        # repeat index of the first simulation, when a shard starts part way through a parameter set's repeats
+        self.first_repeat = settings.get("first_repeat", 0)
+        # directory and lease of the work queue, if the sweep is run by workers
+        self.queue_settings = settings.get("queue")
+        # keyword arguments of the ExecutionPolicy, if the sweep has one
+        self.policy_settings = settings.get("policy")
+        self.layout = OutputLayout(**settings["layout"]) if settings.get("layout") else FLAT
+        # where the finished simulations are packed, if they are
+        self.archive = RunArchive(**settings["archive"]) if settings.get("archive") else None
+
+        self._sweep_dir = sweep_dir
+        self._shards = settings.get("shards")
+        self._open_shards = {}
+        if self._shards is not None:
+            self._params = None
+            self._shard_first_tasks = [shard["first_task"] for shard in self._shards]
+            self.num_tasks = sum(shard["num_tasks"] for shard in self._shards)
+        elif "params_store" in settings:
+            self._params = ParamStore(os.path.join(self.output_dir, settings["params_store"]))
+            self.num_tasks = len(self._params)
+        else:
+            self._params = settings["params"]
+            self.num_tasks = len(self._params)
+        # index just past the last simulation of each parameter set in a params.json "params" list, if it was
+        # written with their numbers of repeats
+        self._record_ends = None
+        if "repeats" in settings:
+            self._record_ends = []
+            for repeats in settings["repeats"]:
+                self._record_ends.append((self._record_ends[-1] if self._record_ends else 0) + repeats)
+
+    def _shard(self, task_id):
+        """Shard of a sharded sweep that holds simulation task_id."""
+        index = bisect_right(self._shard_first_tasks, task_id) - 1
+        if index < 0 or task_id >= self.first_task + self.num_tasks:
+            raise IndexError("Simulation ID {} out of range".format(task_id))
+        if index not in self._open_shards:
+            self._open_shards[index] = BatchSweep(self._sweep_dir, self._shards[index]["params_file"])
+        return self._open_shards[index]
+
+    def params(self, task_id):
+        """Parameter dict of simulation task_id."""
+        if self._shards is not None:
+            return self._shard(task_id).params(task_id)
+        return self._params[task_id - self.first_task]
+
+    def repeat_index(self, task_id):
+        """Repeat index of simulation task_id. The indexed store holds it
+        directly, as do the numbers of repeats in params.json. A params.json
+        written without them, by an earlier version, is read by counting the
+        identical parameter sets immediately before it."""
+        if self._shards is not None:
+            return self._shard(task_id).repeat_index(task_id)
+
+        if isinstance(self._params, ParamStore):
+            record, repeat_index = self._params.locate(task_id - self.first_task)
+            return repeat_index + self.first_repeat if record == 0 else repeat_index
+
+        if self._record_ends is not None:
+            index = task_id - self.first_task
+            record = bisect_right(self._record_ends, index)
+            repeat_index = index - (self._record_ends[record - 1] if record > 0 else 0)
+            return repeat_index + self.first_repeat if record == 0 else repeat_index
+
+        params = self.params(task_id)
+        repeat_index = 0
+        while task_id - repeat_index > self.first_task and self.params(task_id - repeat_index - 1) == params:
+            repeat_index += 1
+        if task_id - repeat_index == self.first_task:
+            repeat_index += self.first_repeat
+        return repeat_index
+
+    def job_task_ids(self, array_index):
+        """Ids of the simulations run by array job array_index."""
+        if self._job_map is not None:
+            if array_index < 1:
+                raise IndexError("Array index {} out of range".format(array_index))
+            return self._job_map[array_index - 1]
+
+        first_task_id = (array_index - 1) * self.tasks_per_job + self.first_task
+        last_sweep_task_id = self.first_task + self.num_tasks - 1
+        if array_index < 1 or first_task_id > last_sweep_task_id:
+            raise IndexError("Array index {} out of range".format(array_index))
+        last_task_id = min(first_task_id + self.tasks_per_job - 1, last_sweep_task_id)
+        return range(first_task_id, last_task_id + 1)
+
+    def close(self):
+        for shard in self._open_shards.values():
+            shard.close()
+        self._open_shards = {}
+        if isinstance(self._params, ParamStore):
+            self._params.close()
+        if self._job_map is not None:
+            self._job_map.close()
+
+
+def run_array_job(sweep, array_index, resume=False):
+    """Runs the simulations of array job array_index, one at a time or with up
+    to sweep.processes_per_job running at once. Each simulation is recorded in
+    the sweep's ledger.
+    :param sweep:
+    :param array_index:
+    :param resume: Remove any existing output of the job's simulations and run them again, used by the
+        job map written by ParamSweeper.generate_resume_batch which only holds the unfinished simulations
+    :return: 0 if every simulation was run and succeeded, otherwise the first non-zero exit code (1 when a
+        simulation's output directory already existed)
+    """
+    task_ids = sweep.job_task_ids(array_index)
+    ledger = Ledger(sweep.ledger_path)
+    # No simulation of a resumed job is treated as completed
+    completed = set() if resume else None
+    cache = ResultCache(**sweep.cache_settings) if sweep.cache_settings else None
+    policy = ExecutionPolicy(**sweep.policy_settings) if sweep.policy_settings else None
+    launcher = SimulationLauncher(sweep.output_dir, sweep.exec_cmd, ledger, completed, cache, skipped_exit_code=1,
+                                  repeat_param=sweep.repeat_param, policy=policy, layout=sweep.layout,
+                                  archive=sweep.archive)
+    launcher.resume_breaker()
+    timeout = policy.timeout if policy is not None else None
+
+    # The repeat index is only needed for the cache key or to pass to the simulation
+    need_repeat_index = cache is not None or sweep.repeat_param is not None
+    simulations = ((task_id, sweep.params(task_id), sweep.repeat_index(task_id) if need_repeat_index else 0)
+                   for task_id in task_ids)
+    if sweep.processes_per_job > 1:
+        run_parallel(launcher.commands(simulations), sweep.processes_per_job, launcher.finished, timeout=timeout,
+                     retry=launcher.retry)
+    else:
+        run_serial(launcher.commands(simulations), launcher.finished, timeout, launcher.retry)
+
+    if cache is not None:
+        print(cache.summary())
+
+    exit_codes = launcher.exit_codes
+    for task_id in task_ids:
+        if exit_codes[task_id] != 0:
+            return exit_codes[task_id]
+    return 0
+
+
+def run_worker(sweep, array_index, poll_interval=None):
+    """Runs simulations taken from the sweep's work queue until every one has
+    finished, one at a time or with up to sweep.processes_per_job running at
+    once. Simulations are claimed in order, or in the order of the job map's
+    first job if there is one. When no unclaimed simulations are left, the
+    worker waits for those other workers are running, taking over any whose
+    worker stops renewing its lease.
+    :param sweep:
+    :param array_index: Only used to name the worker
+    :param poll_interval: Seconds between checks on the other workers' claims, by default a tenth of the lease
+        up to 10 s
+    :return: 0 if every simulation this worker ran succeeded, otherwise the first non-zero exit code
+    """
+    if sweep.queue_settings is None:
+        raise ValueError("The sweep was not generated with a work queue")
+
+    if sweep._job_map is not None:
+        task_ids = sweep.job_task_ids(1)
+    else:
+        task_ids = range(sweep.first_task, sweep.first_task + sweep.num_tasks)
+    lease = sweep.queue_settings["lease"]
+    # the host and pid tell apart a worker restarted with the same array index
+    queue = WorkQueue(os.path.join(sweep.output_dir, sweep.queue_settings["dir"]), task_ids, lease,
+                      worker_id="{}.{}.{}".format(array_index, socket.gethostname(), os.getpid()))
+    poll_interval = poll_interval if poll_interval is not None else min(lease / 10.0, 10.0)
+
+    ledger = Ledger(sweep.ledger_path)
+    cache = ResultCache(**sweep.cache_settings) if sweep.cache_settings else None
+    policy = ExecutionPolicy(**sweep.policy_settings) if sweep.policy_settings else None
+    # A claimed simulation has not finished, any output it has is from a worker that died
+    launcher = SimulationLauncher(sweep.output_dir, sweep.exec_cmd, ledger, set(), cache, skipped_exit_code=1,
+                                  repeat_param=sweep.repeat_param, policy=policy, layout=sweep.layout,
+                                  archive=sweep.archive)
+    launcher.resume_breaker()
+    timeout = policy.timeout if policy is not None else None
+    need_repeat_index = cache is not None or sweep.repeat_param is not None
+
+    def simulations():
+        for task_id in queue.claims():
+            yield task_id, sweep.params(task_id), sweep.repeat_index(task_id) if need_repeat_index else 0
+            # by now the launcher has either started the simulation or taken it from the cache
+            if task_id in launcher.exit_codes and queue.holds(task_id):
+                queue.finish(task_id)
+
+    def finished(task_id, exit_code, usage):
+        launcher.finished(task_id, exit_code, usage)
+        queue.finish(task_id)
+
+    queue.start_heartbeat()
+    try:
+        while True:
+            if sweep.processes_per_job > 1:
+                run_parallel(launcher.commands(simulations()), sweep.processes_per_job, finished, timeout=timeout,
+                             retry=launcher.retry)
+            else:
+                run_serial(launcher.commands(simulations()), finished, timeout, launcher.retry)
+            if not queue.pending():
+                break
+            time.sleep(poll_interval)
+    finally:
+        queue.stop_heartbeat()
+
+    if cache is not None:
+        print(cache.summary())
+
+    for task_id, exit_code in sorted(launcher.exit_codes.items()):
+        if exit_code != 0:
+            return exit_code
+    return 0
+
+
+def main(argv):
+    """Entry point of runsimulation.py, argv[1] is the scheduler's array task id.
+    :return: Exit code
+    """
+    if len(argv) < 2:
+        print("A simulation ID must be provided as an argument, e.g. : \n runsimulation.py $SGE_TASK_ID")
+        return 1
+
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]))
+    parser.add_argument("array_index", help="Array task id assigned by the scheduler")
+    parser.add_argument("--job-map", help="Job map file listing the simulations of each array job")
+    parser.add_argument("--params", default="params.json",
+                        help="Parameters file of the sweep, or of the shard of the sweep this array job is part of")
+    parser.add_argument("--resume", action="store_true", help="Rerun simulations whose output already exists")
+    parser.add_argument("--worker", action="store_true",
+                        help="Take simulations from the sweep's work queue rather than running a fixed set")
+    args = parser.parse_args(argv[1:])
+
+    try:
+        array_index = int(args.array_index)
+    except ValueError:
+        print("Simulation ID must be an integer")
+        return 1
+
+    # The runner is written into the sweep's output directory, next to params.json
+    sweep_dir = os.path.dirname(os.path.abspath(argv[0]))
+    try:
+        sweep = BatchSweep(sweep_dir, args.params, job_map_file=args.job_map)
+    except IOError:
+        print("Could not open parameters file")
+        return 1
+
+    try:
+        if args.worker:
+            return run_worker(sweep, array_index)
+        return run_array_job(sweep, array_index, args.resume)
+    except IndexError:
+        print("Simulation ID {} is outside of the sweep".format(array_index))
+        return 1
+    except OSError:
+        print("OS error")
+        return 1
+    finally:
+        sweep.close()
@@ -0,0 +1,209 @@
+"""Sampling a fixed number of points from continuous parameter ranges, as an
+alternative to sweeping every combination of a list of values.
+
+Latin hypercube samples, and scrambled Halton and Sobol sequences, are drawn in
+the unit hypercube and then scaled to each parameter's range. The sampled
+points vary jointly, so they are added to a sweep as one joint group:
+
+>>> points = sample_parameters({'birth_rate': (0.1, 1.0), 'mesh_size': (1e-3, 1e-1, 'log')}, 64, seed=1)
+>>> p.update(points)
+>>> sweeper.expand_parameters(p, joint_lists=[list(points)])
+
+or with Scan.add_samples. Repeats, count functions and constraints then apply
+to the sampled points as to any other parameter set.
+"""
+from __future__ import division
+import numpy as np
+
+LATIN_HYPERCUBE = "lhs"
+HALTON = "halton"
+SOBOL = "sobol"
+
+# Primitive polynomials (degree s, coefficients a) and initial direction
+# numbers m of dimensions 2 to 21 of the Sobol sequence, from S. Joe and
+# F. Y. Kuo's new-joe-kuo-6.21201. The first dimension is the van der Corput
+# sequence.
+_SOBOL_DIRECTIONS = [
+    (1, 0, [1]),
+    (2, 1, [1, 3]),
+    (3, 1, [1, 3, 1]),
+    (3, 2, [1, 1, 1]),
+    (4, 1, [1, 1, 3, 3]),
+    (4, 4, [1, 3, 5, 13]),
+    (5, 2, [1, 1, 5, 5, 17]),
+    (5, 4, [1, 1, 5, 5, 5]),
+    (5, 7, [1, 1, 7, 11, 19]),
+    (5, 11, [1, 1, 5, 1, 1]),
+    (5, 13, [1, 1, 1, 3, 11]),
+    (5, 14, [1, 3, 5, 5, 31]),
+    (6, 1, [1, 3, 3, 9, 7, 49]),
+    (6, 13, [1, 1, 1, 15, 21, 21]),
+    (6, 16, [1, 3, 1, 13, 27, 49]),
+    (6, 19, [1, 1, 1, 15, 7, 5]),
+    (6, 22, [1, 3, 1, 15, 13, 25]),
+    (6, 25, [1, 1, 5, 5, 19, 61]),
+    (7, 1, [1, 3, 7, 11, 23, 15, 103]),
+    (7, 4, [1, 3, 7, 13, 13, 15, 69]),
+]
+
+# bits of each Sobol coordinate
+_SOBOL_BITS = 30
+
+
+class SamplingError(Exception):
+    """Raised when a sample can't be drawn, e.g. for too many dimensions."""
+    pass
+
+
+def _primes(n):
+    """The first n prime numbers."""
+    primes = []
+    candidate = 2
+    while len(primes) < n:
+        if all(candidate % p for p in primes if p * p <= candidate):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def latin_hypercube(num_points, num_dims, seed=None):
+    """Latin hypercube sample of the unit hypercube: each dimension is split
+    into num_points equal intervals, each holding exactly one point.
+    :return: Array of shape (num_points, num_dims)
+    """
+    rng = np.random.RandomState(seed)
+    points = np.empty((num_points, num_dims))
+    for d in range(num_dims):
+        points[:, d] = (rng.permutation(num_points) + rng.uniform(size=num_points)) / num_points
+    return points
+
+
+def halton(num_points, num_dims, seed=None, scramble=True):
+    """Points of the Halton sequence, with the d'th dimension the radical
+    inverse of the point's index in the d'th prime base. Scrambling applies a
+    random permutation to the digits of each position, which removes the
+    correlation between dimensions with large bases.
+    :return: Array of shape (num_points, num_dims)
+    """
+    rng = np.random.RandomState(seed)
+    index = np.arange(num_points, dtype=np.int64)
+    points = np.zeros((num_points, num_dims))
+    for d, base in enumerate(_primes(num_dims)):
+        # as many digits as a double can resolve
+        num_digits = int(53 * np.log(2) / np.log(base))
+        remaining = index.copy()
+        scale = 1.0
+        for _ in range(num_digits):
+            scale /= base
+            digits = remaining % base
+            remaining //= base
+            if scramble:
+                digits = rng.permutation(base)[digits]
+            points[:, d] += digits * scale
+            if not scramble and not remaining.any():
+                break
+    return points
+
+
+def _sobol_direction_numbers(num_dims):
+    """Direction numbers V[d, j] of the Sobol sequence, as integers of
+    _SOBOL_BITS bits."""
+    directions = np.zeros((num_dims, _SOBOL_BITS), dtype=np.int64)
+    # van der Corput in the first dimension
+    directions[0] = [1 << (_SOBOL_BITS - 1 - j) for j in range(_SOBOL_BITS)]
+    for d in range(1, num_dims):
+        s, a, m = _SOBOL_DIRECTIONS[d - 1]
+        m = list(m)
+        for j in range(s, _SOBOL_BITS):
+            new_m = m[j - s] ^ (m[j - s] << s)
+            for k in range(1, s):
+                if (a >> (s - 1 - k)) & 1:
+                    new_m ^= m[j - k] << k
+            m.append(new_m)
+        directions[d] = [m[j] << (_SOBOL_BITS - 1 - j) for j in range(_SOBOL_BITS)]
+    return directions
+
+
+def _linear_matrix_scramble(directions, rng):
+    """Multiply the direction numbers of each dimension by a random lower
+    triangular binary matrix with a unit diagonal, which keeps the net
+    properties of the sequence."""
+    scrambled = np.zeros_like(directions)
+    num_dims, bits = directions.shape
+    for d in range(num_dims):
+        # row i of the matrix, as a mask over the bits from the most significant
+        rows = []
+        for i in range(bits):
+            row = 1 << (bits - 1 - i)
+            for k in range(i):
+                if rng.randint(2):
+                    row |= 1 << (bits - 1 - k)
+            rows.append(row)
+        for j in range(bits):
+            value = 0
+            for i, row in enumerate(rows):
+                if bin(int(directions[d, j]) & row).count("1") % 2:
+                    value |= 1 << (bits - 1 - i)
+            scrambled[d, j] = value
+    return scrambled
+
+
+def sobol(num_points, num_dims, seed=None, scramble=True):
+    """Points of the Sobol sequence, in up to 21 dimensions. Scrambling is a
+    random linear matrix scramble followed by a random digital shift. The
+    first 2^k points of the sequence are balanced, so a power of 2 works best
+    for num_points.
+    :return: Array of shape (num_points, num_dims)
+    """
+    if num_dims > len(_SOBOL_DIRECTIONS) + 1:
+        raise SamplingError("Sobol sequences are only supported up to {} dimensions, use Halton"
+                            .format(len(_SOBOL_DIRECTIONS) + 1))
+    if num_points > 1 << _SOBOL_BITS:
+        raise SamplingError("At most {} Sobol points can be drawn".format(1 << _SOBOL_BITS))
+
+    rng = np.random.RandomState(seed)
+    directions = _sobol_direction_numbers(num_dims)
+    shift = np.zeros(num_dims, dtype=np.int64)
+    if scramble:
+        directions = _linear_matrix_scramble(directions, rng)
+        shift = rng.randint(0, 1 << _SOBOL_BITS, size=num_dims).astype(np.int64)
+
+    # point i is the XOR of the direction numbers of the set bits of i's Gray code
+    index = np.arange(num_points, dtype=np.int64)
+    gray = index ^ (index >> 1)
+    values = np.tile(shift, (num_points, 1))
+    for j in range(_SOBOL_BITS):
+        bit = ((gray >> j) & 1).astype(bool)
+        values[bit] ^= directions[:, j]
+    return values / float(1 << _SOBOL_BITS)
+
+
+_SAMPLERS = {LATIN_HYPERCUBE: latin_hypercube, HALTON: halton, SOBOL: sobol}
+
+
+def sample_parameters(ranges, num_points, method=SOBOL, seed=None):
+    """Draw num_points parameter sets from continuous ranges.
+    :param ranges: Dict of parameter name: (low, high), or (low, high, 'log') to sample uniformly in log space
+    :param num_points: Number of parameter sets
+    :param method: LATIN_HYPERCUBE, HALTON or SOBOL
+    :param seed: Seed of the randomisation, the same seed gives the same points
+    :return: Dict of parameter name: array of num_points values, to be varied jointly
+    """
+    if method not in _SAMPLERS:
+        raise SamplingError("Unsupported sampling method {}".format(method))
+
+    # sorted so a parameter always gets the same dimension of the sequence
+    names = sorted(ranges)
+    unit_points = _SAMPLERS[method](num_points, len(names), seed=seed)
+
+    samples = {}
+    for d, name in enumerate(names):
+        low, high = ranges[name][0], ranges[name][1]
+        log_scale = len(ranges[name]) > 2 and ranges[name][2] == "log"
+        if log_scale:
+            if low <= 0 or high <= 0:
+                raise SamplingError("Log scaled range of {} must be positive".format(name))
+            samples[name] = np.exp(np.log(low) + unit_points[:, d] * (np.log(high) - np.log(low)))
+        else:
+            samples[name] = low + unit_points[:, d] * (high - low)
+    return samples
@@ -0,0 +1,152 @@
+"""Summaries of the time and resources taken by the simulations of a sweep,
+read from the records of its ledger."""
+from __future__ import print_function, division
+import os
+import json
+import argparse
+import numpy as np
+
+from chastesweep.util.ledger import Ledger, STARTED, DONE, FAILED, SKIPPED
+from chastesweep.util.paramstore import json_default
+from chastesweep.util.runner import BatchSweep
+
+# Resources summarised by their distribution over the simulations that ran, and their units
+RESOURCES = [("wall", "s"), ("cpu", "s"), ("maxrss", "KB")]
+PERCENTILES = [("min", 0), ("median", 50), ("p90", 90), ("p99", 99), ("max", 100)]
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True, default=json_default)
+
+
+def summarise(output_dir, parameters=None, top=10, ledger_file_name="ledger.jsonl"):
+    """Summary of the simulations recorded in a sweep's ledger. Results taken
+    from the cache are counted but left out of the times and resources.
+    :param output_dir: Output directory of the sweep
+    :param parameters: Expanded parameters of a local sweep. A batch sweep's are read from its params.json, and
+        without either the slowest simulations are listed by id
+    :param top: Number of slowest parameter sets to list
+    :param ledger_file_name: Ledger of a local sweep
+    :return: Dict of the counts of each status, throughput, totals, the distribution of each resource, the
+        slowest parameter sets and the simulations run on each host
+    """
+    sweep = None
+    if parameters is None and os.path.exists(os.path.join(output_dir, "params.json")):
+        sweep = BatchSweep(output_dir)
+        ledger_path = sweep.ledger_path
+    else:
+        ledger_path = os.path.join(output_dir, ledger_file_name)
+
+    try:
+        records = Ledger(ledger_path).read()
+        counts = dict((status, 0) for status in (STARTED, DONE, FAILED, SKIPPED))
+        for record in records.values():
+            counts[record["status"]] += 1
+        ran = [record for record in records.values()
+               if record["status"] in (DONE, FAILED) and not record.get("cached")]
+
+        summary = {"done": counts[DONE], "failed": counts[FAILED], "running": counts[STARTED],
+                   "skipped": counts[SKIPPED],
+                   "cached": sum(1 for record in records.values() if record.get("cached"))}
+        if not ran:
+            return summary
+
+        for record in ran:
+            if "user" in record:
+                record["cpu"] = record["user"] + record["sys"]
+
+        span = max(record["end"] for record in ran) - min(record["start"] for record in ran)
+        summary["span"] = span
+        summary["throughput"] = len(ran) / span * 3600 if span > 0 else None
+        summary["wall_total"] = sum(record["wall"] for record in ran)
+        cpu = [record["cpu"] for record in ran if "cpu" in record]
+        summary["cpu_total"] = sum(cpu) if cpu else None
+        if cpu and summary["wall_total"] > 0:
+            summary["cpu_efficiency"] = summary["cpu_total"] / sum(record["wall"] for record in ran
+                                                                    if "cpu" in record)
+
+        summary["distributions"] = {}
+        for resource, unit in RESOURCES:
+            values = [record[resource] for record in ran if resource in record]
+            if values:
+                summary["distributions"][resource] = dict(
+                    (name, float(np.percentile(values, q))) for name, q in PERCENTILES)
+
+        hosts = {}
+        for record in ran:
+            host = record.get("host", "unknown")
+            hosts[host] = hosts.get(host, 0) + 1
+        summary["hosts"] = hosts
+
+        # mean wall time of each parameter set over its repeats
+        walls = {}
+        for record in ran:
+            if sweep is not None:
+                params = sweep.params(record["id"])
+            elif parameters is not None:
+                params = parameters[record["id"]]
+            else:
+                params = {"id": record["id"]}
+            entry = walls.setdefault(_params_key(params), [params, 0.0, 0])
+            entry[1] += record["wall"]
+            entry[2] += 1
+        slowest = sorted(((params, total / runs, runs) for params, total, runs in walls.values()),
+                         key=lambda item: item[1], reverse=True)
+        summary["slowest"] = slowest[:top]
+    finally:
+        if sweep is not None:
+            sweep.close()
+
+    return summary
+
+
+def format_summary(summary):
+    """Text report of a summary from summarise."""
+    lines = ["{done} done, {failed} failed, {running} started but not finished, {cached} from the cache"
+             .format(**summary)]
+    if summary.get("skipped"):
+        lines[0] += ", {} skipped by the circuit breaker".format(summary["skipped"])
+    if "span" not in summary:
+        return "\n".join(lines)
+
+    if summary["throughput"] is not None:
+        lines.append("{:.1f} simulations per hour over {:.1f} s".format(summary["throughput"], summary["span"]))
+    line = "Total wall time {:.1f} s".format(summary["wall_total"])
+    if summary["cpu_total"] is not None:
+        line += ", CPU time {:.1f} s".format(summary["cpu_total"])
+    if summary.get("cpu_efficiency") is not None:
+        line += ", {:.0%} CPU per wall second".format(summary["cpu_efficiency"])
+    lines.append(line)
+
+    lines.append("")
+    lines.append("{:<10}".format("") + "".join("{:>12}".format(name) for name, q in PERCENTILES))
+    for resource, unit in RESOURCES:
+        if resource in summary["distributions"]:
+            distribution = summary["distributions"][resource]
+            lines.append("{:<10}".format("{} ({})".format(resource, unit)) +
+                         "".join("{:>12.1f}".format(distribution[name]) for name, q in PERCENTILES))
+
+    lines.append("")
+    lines.append("Slowest parameter sets (mean wall time, runs):")
+    for params, wall, runs in summary["slowest"]:
+        lines.append("{:>10.1f} s {:>4}  {}".format(wall, runs, _params_key(params)))
+
+    lines.append("")
+    lines.append("Simulations per host:")
+    for host, count in sorted(summary["hosts"].items()):
+        lines.append("  {}: {}".format(host, count))
+    return "\n".join(lines)
+
+
+def main(argv):
+    """Entry point of chastesweep_summary.
+    :return: Exit code
+    """
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]),
+                                     description="Summarise the time and resources taken by a sweep's simulations")
+    parser.add_argument("output_dir", help="Output directory of the sweep")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest parameter sets to list")
+    args = parser.parse_args(argv[1:])
+
+    print(format_summary(summarise(args.output_dir, top=args.top)))
+    return 0
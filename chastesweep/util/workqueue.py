@@ -0,0 +1,218 @@
+"""A queue of the simulations of a sweep that any number of workers, on one
+node or on several nodes sharing a filesystem, take simulations from as they
+become free, rather than each being given a fixed set of simulations."""
+from __future__ import print_function
+import os
+import time
+import errno
+import socket
+import threading
+
+DONE_SUFFIX = ".done"
+
+
+class WorkQueue:
+    """Simulations are claimed by creating a claim file named after the
+    simulation id with O_CREAT | O_EXCL, which only one worker can succeed at,
+    and marked finished by renaming the claim to <id>.done. No locks are
+    taken, so a worker that dies can't block the others.
+
+    A claim is a lease renewed by a heartbeat thread touching the claim file.
+    A claim that has not been touched for longer than the lease is taken to
+    belong to a dead worker and can be reclaimed, by renaming it away (only one
+    worker's rename succeeds) and claiming the simulation afresh. The lease is
+    compared with the claim file's modification time, so it should be much
+    longer than any clock difference between the nodes.
+
+    Simulations are claimed in the order of task_ids. The position of the last
+    claim is kept in a hint file, so a worker joining late doesn't try every
+    claimed simulation in turn.
+    """
+
+    hint_file_name = "next"
+
+    def __init__(self, queue_dir, task_ids, lease=600.0, worker_id=None):
+        """
+        :param queue_dir: Directory of the claim files, created if needed
+        :param task_ids: Sequence of the ids of the simulations, in the order they are claimed
+        :param lease: Seconds after its last heartbeat that a claim can be reclaimed
+        :param worker_id: Name of this worker written into its claims, defaults to host.pid
+        """
+        try:
+            os.makedirs(queue_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.queue_dir = queue_dir
+        self.task_ids = task_ids
+        self.lease = lease
+        self.worker_id = worker_id if worker_id is not None else "{}.{}".format(socket.gethostname(), os.getpid())
+        # claim file of each simulation this worker holds
+        self._held = {}
+        self._lock = threading.Lock()
+        self._cursor = 0
+        self._heartbeat = None
+        self._stop = threading.Event()
+
+    def _claim_path(self, task_id):
+        return os.path.join(self.queue_dir, str(task_id))
+
+    def _read_hint(self):
+        try:
+            with open(os.path.join(self.queue_dir, self.hint_file_name)) as hint_file:
+                return int(hint_file.read())
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _write_hint(self, position):
+        # Only a hint, a racing worker may overwrite it with a lower position which just costs a few retries
+        path = os.path.join(self.queue_dir, self.hint_file_name)
+        tmp_path = "{}.{}".format(path, self.worker_id)
+        with open(tmp_path, "w") as hint_file:
+            hint_file.write(str(position))
+        os.rename(tmp_path, path)
+
+    def _try_claim(self, task_id):
+        path = self._claim_path(task_id)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        try:
+            os.write(fd, self.worker_id.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+        # The simulation finished between another worker renaming its claim and this one creating it
+        if os.path.exists(path + DONE_SUFFIX):
+            os.remove(path)
+            return False
+
+        with self._lock:
+            self._held[task_id] = path
+        return True
+
+    def _expired(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.lease
+        except OSError:
+            return False
+
+    def _try_reclaim(self, task_id):
+        path = self._claim_path(task_id)
+        if not self._expired(path):
+            return False
+        stale_path = "{}.stale.{}".format(path, self.worker_id)
+        try:
+            os.rename(path, stale_path)
+        except OSError:
+            # Another worker reclaimed it, or it finished
+            return False
+        if not self._expired(stale_path):
+            # Its worker renewed the lease after all, put the claim back unless someone has claimed it since
+            try:
+                os.link(stale_path, path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        print("Reclaiming simulation ID {}, whose worker's lease expired".format(task_id))
+        return self._try_claim(task_id)
+
+    def claim(self):
+        """Claim the next simulation no worker has claimed.
+        :return: Its id, or None if every simulation has been claimed
+        """
+        self._cursor = max(self._cursor, self._read_hint())
+        while self._cursor < len(self.task_ids):
+            task_id = self.task_ids[self._cursor]
+            self._cursor += 1
+            if self._try_claim(task_id):
+                self._write_hint(self._cursor)
+                return task_id
+        return None
+
+    def pending(self):
+        """Ids of the simulations claimed by other workers that have not finished."""
+        names = set(os.listdir(self.queue_dir))
+        with self._lock:
+            held = set(str(task_id) for task_id in self._held)
+        return sorted(int(name) for name in names
+                      if name.isdigit() and name + DONE_SUFFIX not in names and name not in held)
+
+    def reclaim(self):
+        """Claim a simulation whose worker's lease has expired.
+        :return: Its id, or None if there is none
+        """
+        for task_id in self.pending():
+            if self._try_reclaim(task_id):
+                return task_id
+        return None
+
+    def claims(self):
+        """Generator claiming simulations one at a time, as they are needed:
+        first those no worker has claimed, then those whose worker's lease has
+        expired. It stops once neither is left, while other workers may still
+        be running simulations, see pending."""
+        while True:
+            task_id = self.claim()
+            if task_id is None:
+                task_id = self.reclaim()
+            if task_id is None:
+                return
+            yield task_id
+
+    def holds(self, task_id):
+        with self._lock:
+            return task_id in self._held
+
+    def _owns(self, path):
+        # The claim may have been reclaimed by another worker while this one wasn't renewing its lease
+        try:
+            with open(path, "rb") as claim_file:
+                return claim_file.read().decode("utf-8") == self.worker_id
+        except (IOError, OSError):
+            return False
+
+    def finish(self, task_id):
+        """Mark a simulation this worker claimed as finished, whether or not it succeeded."""
+        with self._lock:
+            path = self._held.pop(task_id)
+        if not self._owns(path):
+            print("The claim on simulation ID {} was lost to another worker, it may have run twice".format(task_id))
+            return
+        os.rename(path, path + DONE_SUFFIX)
+
+    def heartbeat(self):
+        """Renew the lease of every claim this worker holds."""
+        with self._lock:
+            paths = list(self._held.values())
+        for path in paths:
+            if self._owns(path):
+                try:
+                    os.utime(path, None)
+                except OSError:
+                    # Finished in the meantime
+                    pass
+
+    def start_heartbeat(self, interval=None):
+        """Renew the leases from a background thread, by default four times a lease."""
+        interval = interval if interval is not None else self.lease / 4.0
+
+        def beat():
+            while not self._stop.wait(interval):
+                self.heartbeat()
+
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=beat)
+        self._heartbeat.daemon = True
+        self._heartbeat.start()
+
+    def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            self._stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
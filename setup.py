@@ -4,7 +4,8 @@ with open("README.md", "r") as fh:
 setuptools.setup(
      name='chastesweep',
      version='0.10',
-     scripts=['chastesweep_genmain'],
+     scripts=['chastesweep_genmain', 'chastesweep_aggregate', 'chastesweep_summary',
+             'chastesweep_catalogue'],
      author="Twin Karmakharm",
      author_email="t.karmakharm@sheffield.ac.uk",
      description="Parameter Sweeper for Chaste",